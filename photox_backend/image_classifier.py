@@ -8,11 +8,18 @@ from io import BytesIO
 
 
 class ImageClassifier:
+    # 模型、预处理和类别列表在进程内只加载一次，所有实例共用
+    _model = None
+    _preprocess = None
+    _categories = None
+
     def __init__(self):
 
-    # 加载模型（使用新版 API）
-     self.model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)  # 或 IMAGENET1K_V2
-     self.model.eval()
+        # 加载模型（使用新版 API）
+        if ImageClassifier._model is None:
+            ImageClassifier._model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT).eval()  # 或 IMAGENET1K_V2
+            ImageClassifier._preprocess = models.ResNet50_Weights.DEFAULT.transforms()
+        self.model = ImageClassifier._model
 
 
     def predict(self,image_name):
@@ -27,9 +34,8 @@ class ImageClassifier:
         #     image = Image.open(image_name).convert("RGB")
 
         # 图像预处理（自动匹配权重对应的预处理）
-        preprocess = models.ResNet50_Weights.DEFAULT.transforms()
         image = Image.open(image_name).convert("RGB")
-        input_tensor = preprocess(image).unsqueeze(0)
+        input_tensor = self._preprocess(image).unsqueeze(0)
 
         # 推理
 
@@ -44,12 +50,15 @@ class ImageClassifier:
         top_probs = top_probs.cpu().numpy()
         top_indices = top_indices.cpu().numpy()
 
-        # 加载正确的类别文件
-        with open("imagenet_classes.txt", "r") as f:
-            categories = [s.strip() for s in f.readlines()]
+        # 加载正确的类别文件（只读取一次）
+        if ImageClassifier._categories is None:
+            with open("imagenet_classes.txt", "r") as f:
+                categories = [s.strip() for s in f.readlines()]
 
-        # 验证类别数量
-        assert len(categories) == 1000, "类别文件必须包含 1000 个类别"
+            # 验证类别数量
+            assert len(categories) == 1000, "类别文件必须包含 1000 个类别"
+            ImageClassifier._categories = categories
+        categories = ImageClassifier._categories
         # 生成结果列表
         results = [
             (categories[idx], float(prob))
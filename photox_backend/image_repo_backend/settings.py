@@ -1,5 +1,7 @@
 # image_repo_backend/settings.py
+import json
 import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 # 如果你使用 .env 文件管理敏感信息 (推荐)
@@ -229,16 +231,155 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'upload-offset',
 ]
 
 # 暴露响应头
-CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken']
+CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken', 'Upload-Offset']
 
 # 七牛云配置 (从环境变量读取，但提供默认值)
 QINIU_ACCESS_KEY = os.getenv('QINIU_ACCESS_KEY', 'NT8GPMLylWq3_WIl9aNk1zAUWTJtoWrGGVqbvKxh')
 QINIU_SECRET_KEY = os.getenv('QINIU_SECRET_KEY', 'uNj2QCpEElzFF4ZkFkvjrBrDITB9ZpO_0ixDbfXD')
 QINIU_BUCKET_NAME = os.getenv('QINIU_BUCKET_NAME', 'whuphotox')
 QINIU_BUCKET_URL = os.getenv('QINIU_BUCKET_URL', 'http://sv81ux7sp.hn-bkt.clouddn.com')
+# 图片 bucket 绑定的外链域名
+QINIU_IMAGE_DOMAIN = os.getenv('QINIU_IMAGE_DOMAIN', 'http://syahnegzj.hn-bkt.clouddn.com')
+
+# 图片存储后端：'qiniu' 七牛云；'local' 本地目录（通过 MEDIA_URL 访问，用于开发和离线压测）
+IMAGE_STORAGE_BACKEND = os.getenv('IMAGE_STORAGE_BACKEND', 'qiniu')
+# 本地存储的根目录，默认与 MEDIA_ROOT 相同
+IMAGE_LOCAL_STORAGE_ROOT = os.getenv('IMAGE_LOCAL_STORAGE_ROOT', str(MEDIA_ROOT))
+# 本地存储生成外链时 MEDIA_URL 前面拼接的站点地址，留空则返回相对路径
+IMAGE_LOCAL_STORAGE_BASE_URL = os.getenv('IMAGE_LOCAL_STORAGE_BASE_URL', '')
+
+# AI 模型服务密钥
+DASHSCOPE_API_KEY = os.getenv('DASHSCOPE_API_KEY', 'sk-3658ae5ea3284ff4865227db05f4a214')
+QNAIGC_API_KEY = os.getenv('QNAIGC_API_KEY', 'sk-ff8f03a8cfbc03d7df75b7ddb6b1fb7f0bfc8116e02986306865aa9149741301')
+# 视觉大模型服务的 OpenAI 兼容接口地址（压测时可指向 mock_vision_server 启动的本地模拟服务）
+AI_DASHSCOPE_BASE_URL = os.getenv('AI_DASHSCOPE_BASE_URL', 'https://dashscope.aliyuncs.com/compatible-mode/v1')
+AI_QNAIGC_BASE_URL = os.getenv('AI_QNAIGC_BASE_URL', 'https://api.qnaigc.com/v1')
+
+# 图片入库配置
+# 上传默认模式：'sync' 在请求内完成全部处理；'async' 立即返回 202，由后台线程池处理
+IMAGE_UPLOAD_DEFAULT_MODE = os.getenv('IMAGE_UPLOAD_DEFAULT_MODE', 'sync')
+# 后台入库线程池大小（每个 gunicorn worker 进程各自一个线程池）
+IMAGE_INGEST_WORKERS = int(os.getenv('IMAGE_INGEST_WORKERS', '4'))
+# 异步入库时原始文件的暂存目录
+IMAGE_INGEST_SPOOL_DIR = os.getenv('IMAGE_INGEST_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'photox_ingest'))
+# 为 True 时在当前线程内同步执行后台任务（测试环境使用）
+IMAGE_INGEST_EAGER = os.getenv('IMAGE_INGEST_EAGER', 'false').lower() == 'true'
+# 批量上传时每个用户同时处理的文件数上限
+IMAGE_BATCH_UPLOAD_CONCURRENCY = int(os.getenv('IMAGE_BATCH_UPLOAD_CONCURRENCY', '4'))
+# 入库时生成的派生图片尺寸（最长边像素，逗号分隔），每个尺寸生成 WebP 和渐进式 JPEG
+IMAGE_VARIANT_SIZES = os.getenv('IMAGE_VARIANT_SIZES', '256,768,1600')
+# 派生图片的编码质量
+IMAGE_VARIANT_QUALITY = int(os.getenv('IMAGE_VARIANT_QUALITY', '80'))
+
+# 分片续传配置
+# 单个文件的最大大小（字节）
+IMAGE_CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_CHUNKED_UPLOAD_MAX_SIZE', str(200 * 1024 * 1024)))
+# 单个分片请求体的最大大小（字节）
+IMAGE_UPLOAD_CHUNK_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_CHUNK_MAX_SIZE', str(8 * 1024 * 1024)))
+# 未完成的上传会话保留时长（小时），过期后由 cleanup_upload_sessions 命令清理
+IMAGE_UPLOAD_SESSION_TTL_HOURS = int(os.getenv('IMAGE_UPLOAD_SESSION_TTL_HOURS', '24'))
+
+# AI 调用结果缓存（分类、描述、风格、情感），按图片内容哈希 + 模型 + 提示词版本 + 预处理参数命中
+AI_RESULT_CACHE_ENABLED = os.getenv('AI_RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+# 缓存条目上限，超出后按最近使用时间淘汰
+AI_RESULT_CACHE_MAX_ENTRIES = int(os.getenv('AI_RESULT_CACHE_MAX_ENTRIES', '50000'))
+# 每写入多少条检查一次是否需要淘汰
+AI_RESULT_CACHE_EVICT_EVERY = int(os.getenv('AI_RESULT_CACHE_EVICT_EVERY', '100'))
+
+# 视觉大模型 HTTP 客户端配置（连接池、超时），见 images/ai/client.py
+# 连接超时和读取超时（秒）
+AI_HTTP_CONNECT_TIMEOUT = float(os.getenv('AI_HTTP_CONNECT_TIMEOUT', '5'))
+AI_HTTP_READ_TIMEOUT = float(os.getenv('AI_HTTP_READ_TIMEOUT', '30'))
+# 连接池缓存的主机数和每个主机保留复用的最大连接数（超出时临时新建连接，不排队等待）
+AI_HTTP_POOL_CONNECTIONS = int(os.getenv('AI_HTTP_POOL_CONNECTIONS', '4'))
+AI_HTTP_POOL_MAXSIZE = int(os.getenv('AI_HTTP_POOL_MAXSIZE', '10'))
+
+# 视觉大模型调用的熔断、重试和对冲配置，见 images/ai/resilience.py
+# 连续失败多少次后熔断，以及熔断持续的秒数
+AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv('AI_BREAKER_FAILURE_THRESHOLD', '5'))
+AI_BREAKER_RESET_SECONDS = float(os.getenv('AI_BREAKER_RESET_SECONDS', '30'))
+# 单次调用（含所有重试）的总时间预算（秒）、最多尝试次数和退避基数（秒）
+AI_CALL_BUDGET_SECONDS = float(os.getenv('AI_CALL_BUDGET_SECONDS', '40'))
+AI_RETRY_MAX_ATTEMPTS = int(os.getenv('AI_RETRY_MAX_ATTEMPTS', '3'))
+AI_RETRY_BASE_DELAY = float(os.getenv('AI_RETRY_BASE_DELAY', '0.5'))
+# 是否对慢请求发出对冲请求，以及对冲前的最短等待时间（秒，实际取与近期 p95 的较大值）
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'true').lower() == 'true'
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '2'))
+# 延迟目标（秒），超过的调用计入 slo_violations
+AI_LATENCY_SLO_SECONDS = float(os.getenv('AI_LATENCY_SLO_SECONDS', '10'))
+
+# 本地 ImageNet 模型（torchvision 模型名），用于分类前的候选预筛选
+AI_LOCAL_MODEL = os.getenv('AI_LOCAL_MODEL', 'resnet50')
+# 本地模型推理后端：eager（默认）、quantized（动态 int8 量化）、torchscript、quantized_torchscript（量化后导出的 TorchScript）、
+# onnx（需要 onnx、onnxruntime）；导出类后端需先运行 export_local_model 命令导出到 AI_LOCAL_MODEL_EXPORT_DIR，文件不存在时回退到 eager
+AI_LOCAL_MODEL_BACKEND = os.getenv('AI_LOCAL_MODEL_BACKEND', 'eager')
+AI_LOCAL_MODEL_EXPORT_DIR = os.getenv('AI_LOCAL_MODEL_EXPORT_DIR', os.path.join(BASE_DIR, 'images', 'ai', 'exported'))
+# 每个进程的 torch 算子内线程数（0 为 torch 默认值，即使用全部核心；多 worker 部署时应调小）
+AI_LOCAL_MODEL_THREADS = int(os.getenv('AI_LOCAL_MODEL_THREADS', '2'))
+# 并发预测合并为一个批次时的最大图片数
+AI_LOCAL_MODEL_BATCH_SIZE = int(os.getenv('AI_LOCAL_MODEL_BATCH_SIZE', '8'))
+# 进程内已加载本地模型的内存预算（MB），超出时淘汰最久未使用的模型（0 为不限制）
+AI_LOCAL_MODEL_MEMORY_BUDGET_MB = int(os.getenv('AI_LOCAL_MODEL_MEMORY_BUDGET_MB', '1024'))
+# 启动预加载时额外加载的模型，逗号分隔的 模型名[:权重]，如 "mobilenet_v3_large,efficientnet_b0:IMAGENET1K_V1"
+AI_LOCAL_MODEL_WARMUP = os.getenv('AI_LOCAL_MODEL_WARMUP', '')
+# 是否在应用启动时加载默认模型和 AI_LOCAL_MODEL_WARMUP（配合 gunicorn --preload，使 worker 在 fork 后共享权重内存）
+AI_LOCAL_MODEL_PRELOAD = os.getenv('AI_LOCAL_MODEL_PRELOAD', 'false').lower() == 'true'
+# 是否先用本地模型预筛选候选类别/标签，只把候选放进分类提示词（需要 torch 和模型权重）
+AI_TAG_SHORTLIST_ENABLED = os.getenv('AI_TAG_SHORTLIST_ENABLED', 'false').lower() == 'true'
+# 提示词中保留的候选类别数和标签数
+AI_CATEGORY_SHORTLIST_SIZE = int(os.getenv('AI_CATEGORY_SHORTLIST_SIZE', '5'))
+AI_TAG_SHORTLIST_SIZE = int(os.getenv('AI_TAG_SHORTLIST_SIZE', '30'))
+# 由 build_tag_shortlist_map 命令生成的“ImageNet 标签 -> 类别/标签”映射文件
+AI_TAG_SHORTLIST_MAP_PATH = os.getenv('AI_TAG_SHORTLIST_MAP_PATH', os.path.join(BASE_DIR, 'images', 'ai', 'tag_shortlist_map.json'))
+
+# 分类级联：本地模型 top-1 置信度达到阈值时直接采用本地结果，否则调用大模型
+AI_CASCADE_ENABLED = os.getenv('AI_CASCADE_ENABLED', 'false').lower() == 'true'
+AI_CASCADE_CONFIDENCE_THRESHOLD = float(os.getenv('AI_CASCADE_CONFIDENCE_THRESHOLD', '0.7'))
+# 本地结果最多保留的标签数，以及标签的最低映射得分
+AI_CASCADE_MAX_TAGS = int(os.getenv('AI_CASCADE_MAX_TAGS', '5'))
+AI_CASCADE_MIN_TAG_SCORE = float(os.getenv('AI_CASCADE_MIN_TAG_SCORE', '0.2'))
+
+# 风格和情感分析是否合并为一次模型调用（某一部分无效时仍单独调用该部分）
+AI_STYLE_COMBINED = os.getenv('AI_STYLE_COMBINED', 'true').lower() == 'true'
+
+# 同一张图片同一种分析的并发请求是否合并：只有取得租约的请求调用模型，其他请求等待其结果
+AI_SINGLE_FLIGHT_ENABLED = os.getenv('AI_SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+# 租约有效期（秒，持有者崩溃时等待的请求在过期后接管）、等待结果的最长时间（秒）和轮询间隔（秒）
+AI_SINGLE_FLIGHT_LEASE_SECONDS = int(os.getenv('AI_SINGLE_FLIGHT_LEASE_SECONDS', '90'))
+AI_SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv('AI_SINGLE_FLIGHT_WAIT_SECONDS', '120'))
+AI_SINGLE_FLIGHT_POLL_SECONDS = float(os.getenv('AI_SINGLE_FLIGHT_POLL_SECONDS', '0.2'))
+
+# 是否记录每次视觉大模型调用（模型、token、延迟、结果），以及进程内未写库记录的最大条数
+AI_METERING_ENABLED = os.getenv('AI_METERING_ENABLED', 'true').lower() == 'true'
+AI_METERING_BUFFER_SIZE = int(os.getenv('AI_METERING_BUFFER_SIZE', '5000'))
+# 各模型价格（元/百万 token），JSON 格式，如 {"qwen-vl-max": {"prompt": 3, "completion": 9}}；未配置的模型费用记为 0
+AI_MODEL_PRICES = json.loads(os.getenv('AI_MODEL_PRICES', '{}'))
+
+# 感知哈希近似重复检索配置
+# 由 build_phash_index 命令生成的索引文件，各进程启动后加载
+# 默认放在项目目录下（不要放在所有用户可写的 /tmp 中）
+PHASH_INDEX_PATH = os.getenv('PHASH_INDEX_PATH', os.path.join(BASE_DIR, 'var', 'phash_index.json'))
+# 视为相似图片的最大汉明距离（64 位哈希）
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', '6'))
+# 上传时是否检查当前用户已有的近似重复图片并在响应中提示
+IMAGE_NEAR_DUPLICATE_WARNING = os.getenv('IMAGE_NEAR_DUPLICATE_WARNING', 'false').lower() == 'true'
+
+# 缓存配置：默认与 Django 一致使用进程内缓存（locmem），只在单进程内共享。
+# 目前没有依赖缓存在 worker 进程间共享的状态：AI 分析并发合并的租约（AIAnalysisLease）、分类词表版本号（VocabularyVersion）、
+# AI 结果缓存及其命中计数（AIResultCache、AIResultCacheStat）都保存在数据库中；
+# 熔断状态、重试/对冲统计和分类级联计数按设计只属于当前 worker 进程，保存在进程内存中，不经过缓存。
+# 以后新增需要跨进程共享的缓存数据时，改为共享缓存（Redis 或 Memcached），例如
+# DJANGO_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache DJANGO_CACHE_LOCATION=redis://127.0.0.1:6379/1
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', ''),
+    }
+}
 
 # 如果需要使用 .env 文件，确保在项目根目录创建 .env 文件并写入类似内容:
 # DJANGO_SECRET_KEY=your_strong_secret_key
@@ -1,9 +1,22 @@
 # images/admin.py
 from django.contrib import admin
-from .models import Image  # ✅ 这是你定义的模型
+from .models import Image, AICallRecord, AIUsageDaily  # ✅ 这是你定义的模型
 
 @admin.register(Image)
 class ImageAdmin(admin.ModelAdmin):
     list_display = ('id', 'title', 'user', 'created_at', 'is_public')
     search_fields = ('title', 'tags')
     list_filter = ('is_public', 'created_at')
+
+
+@admin.register(AICallRecord)
+class AICallRecordAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'kind', 'model_name', 'image_id', 'outcome', 'latency_ms', 'prompt_tokens', 'completion_tokens')
+    list_filter = ('kind', 'model_name', 'outcome')
+    search_fields = ('model_name', 'image_id')
+
+
+@admin.register(AIUsageDaily)
+class AIUsageDailyAdmin(admin.ModelAdmin):
+    list_display = ('date', 'model_name', 'calls', 'failures', 'latency_p50_ms', 'latency_p95_ms', 'cost')
+    list_filter = ('model_name',)
@@ -1,8 +1,6 @@
 import requests
 import base64
 import re
-from PIL import Image
-import io
 import os
 import json
 import logging
@@ -27,6 +25,13 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 
+# 分类使用的视觉模型
+CLASSIFY_MODEL = "qwen-vl-max-latest"
+# 分类前图片预处理参数（最长边、JPEG 质量），与 process_image 的默认值一致
+CLASSIFY_MAX_SIZE = 1024
+CLASSIFY_QUALITY = 85
+
+
 def load_category_map(file_path="classes.txt"):
     """从文件加载类别映射"""
     category_map = {}
@@ -95,37 +100,29 @@ def load_model_map(file_path="model.txt"):
 
 
 def process_image(image_path, max_size=1024, quality=85):
-    """优化的图片预处理函数"""
+    """优化的图片预处理函数（缩小解码、摆正方向后编码为 JPEG，见 decode.prepare_payload）"""
+    from .decode import prepare_payload
     try:
-        img = Image.open(image_path)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-
-        # 快速缩放
-        width, height = img.size
-        if max(width, height) > max_size:
-            ratio = max_size / max(width, height)
-            img = img.resize((int(width * ratio), int(height * ratio)), Image.Resampling.NEAREST)
-
-        # 优化存储
-        byte_arr = io.BytesIO()
-        img.save(byte_arr, format='JPEG', quality=quality, optimize=True)
-        return byte_arr.getvalue()
+        return prepare_payload(image_path, max_size, quality)
     except Exception as e:
         logger.error(f"图片处理失败: {e}")
         return None
 
 
-def get_tags_from_database():
-    """从数据库获取所有标签信息"""
+def get_tags_from_database(with_source=False):
+    """
+    从数据库获取所有标签信息
+    :param with_source: 为 True 时额外返回是否真正读到了数据库（失败时为默认标签集）
+    """
     try:
-        tags = Tag.objects.all()
-        # 创建标签ID到名称的映射
-        tag_map = {tag.id: tag.name for tag in tags}
+        # 只取需要的两列
+        tag_map = dict(Tag.objects.order_by('id').values_list('id', 'name'))
 
         # 创建标签列表的字符串表示
         tag_list_str = "\n".join([f"{tag_id}: {name}" for tag_id, name in tag_map.items()])
 
+        if with_source:
+            return tag_map, tag_list_str, True
         return tag_map, tag_list_str
     except Exception as e:
         logger.error(f"从数据库获取标签失败: {e}")
@@ -135,9 +132,25 @@ def get_tags_from_database():
             6: "宠物", 7: "风景", 8: "海滩", 9: "山脉", 10: "城市景观"
         }
         tag_list_str = "\n".join([f"{tag_id}: {name}" for tag_id, name in default_tags.items()])
+        if with_source:
+            return default_tags, tag_list_str, False
         return default_tags, tag_list_str
 
 
+def build_classification_prompt(category_map, tag_list_str):
+    """构建分类系统提示词 - 要求返回分类和标签"""
+    return (
+        f"你是一个专业的图像内容分析AI。请根据提供的图像，完成以下任务：\n"
+        f"1. 从以下分类中选择最合适的一个分类ID（必须是下列分类ID之一的整数），如果不是非常确定分入其他：\n"
+        f"{json.dumps(category_map, indent=2, ensure_ascii=False)}\n"
+        f"2. 从以下标签中选择4-6个最相关的标签（必须返回标签ID，即数字）,要求只输出最准确最确定的标签，"
+        f"并且如果不是非常确定可以减少输出的标签，需要尽量避免错误：\n"
+        f"{tag_list_str}\n"
+        f"返回格式必须是纯JSON：{{\"category_id\": 分类ID, \"tag_ids\": [标签ID1, 标签ID2, ...]}}"
+        f"注意：只能返回数字ID，不要返回标签名称！"
+    )
+
+
 # def image_classification(image_path, api_key, model_id=1, classes_file="classes.txt", model_file="model.txt"):
 #     """图像分类主函数，返回分类和标签信息"""
 #     # 加载类别映射
@@ -289,18 +302,23 @@ def get_tags_from_database():
 #             "model_used": model_name
 #         }
 
-def image_classification(image_path, api_key,  classes_file="classes.txt"):
-    """图像分类主函数，返回分类和标签信息"""
-    # 加载类别映射
-    category_map = load_category_map(classes_file)
+def image_classification(image_path, api_key,  classes_file="classes.txt", image_bytes=None, shortlist=None):
+    """
+    图像分类主函数，返回分类和标签信息
+    :param image_bytes: 已预处理好的 JPEG 字节（如 DecodedImage.ai_jpeg()），传入时跳过读取和预处理 image_path
+    :param shortlist: 本地模型预筛选出的候选（shortlist.Shortlist），传入时提示词只包含候选类别和标签
+    """
+    # 类别映射、标签映射和提示词来自进程内词表缓存，词表版本变化时才重新构建
+    from .vocabulary import get_vocabulary
+    vocabulary = get_vocabulary(classes_file)
+    category_map = vocabulary.category_map
+    tag_map = vocabulary.tag_map
 
-    # 从数据库获取标签信息
-    tag_map, tag_list_str = get_tags_from_database()
 
-
-    model_name="qwen-vl-max-latest"
+    model_name = CLASSIFY_MODEL
     # 预处理图片
-    image_bytes = process_image(image_path)
+    if image_bytes is None:
+        image_bytes = process_image(image_path)
     if not image_bytes:
         return {
             "category_id": 0,
@@ -313,17 +331,8 @@ def image_classification(image_path, api_key,  classes_file="classes.txt"):
     encoded_image = base64.b64encode(image_bytes).decode("utf-8")
     image_data_url = f"data:image/jpeg;base64,{encoded_image}"
 
-    # 构建系统提示词 - 要求返回分类和标签
-    system_prompt = (
-        f"你是一个专业的图像内容分析AI。请根据提供的图像，完成以下任务：\n"
-        f"1. 从以下分类中选择最合适的一个分类ID（必须是0-{len(category_map) - 1}之间的整数），如果不是非常确定分入其他：\n"
-        f"{json.dumps(category_map, indent=2, ensure_ascii=False)}\n"
-        f"2. 从以下标签中选择4-6个最相关的标签（必须返回标签ID，即数字）,要求只输出最准确最确定的标签，"
-        f"并且如果不是非常确定可以减少输出的标签，需要尽量避免错误：\n"
-        f"{tag_list_str}\n"
-        f"返回格式必须是纯JSON：{{\"category_id\": 分类ID, \"tag_ids\": [标签ID1, 标签ID2, ...]}}"
-        f"注意：只能返回数字ID，不要返回标签名称！"
-    )
+    # 完整词表的系统提示词在同一词表版本内只渲染一次
+    system_prompt = vocabulary.prompt_for(shortlist)
 
     # 构建请求载荷
     payload = {
@@ -344,15 +353,10 @@ def image_classification(image_path, api_key,  classes_file="classes.txt"):
         ]
     }
 
-    # 发送请求
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    # 发送请求（复用连接池中的 keep-alive 连接）
+    from . import client
     try:
-        response = requests.post(
-            "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
-            json=payload,
-            headers=headers,
-            timeout=30  # 延长超时时间
-        )
+        response = client.post_chat(client.dashscope_chat_url(), api_key, payload, kind='classify')
 
         if response.status_code == 200:
             try:
@@ -410,8 +414,9 @@ def image_classification(image_path, api_key,  classes_file="classes.txt"):
                 return {
                     "category_id": 0,
                     "category_name": category_map.get(0, "其他"),
-                    "tags": [{"id": 0, "name": "解析错误"}],
-                    "model_used": model_name
+                    "tags": [],
+                    "model_used": model_name,
+                    "error": "解析错误"
                 }
 
         else:
@@ -419,8 +424,9 @@ def image_classification(image_path, api_key,  classes_file="classes.txt"):
             return {
                 "category_id": 0,
                 "category_name": category_map.get(0, "其他"),
-                "tags": [{"id": 0, "name": "API错误"}],
-                "model_used": model_name
+                "tags": [],
+                "model_used": model_name,
+                "error": "API错误"
             }
 
     except Exception as e:
@@ -428,8 +434,9 @@ def image_classification(image_path, api_key,  classes_file="classes.txt"):
         return {
             "category_id": 0,
             "category_name": category_map.get(0, "其他"),
-            "tags": [{"id": 0, "name": "请求异常"}],
-            "model_used": model_name
+            "tags": [],
+            "model_used": model_name,
+            "error": "请求异常"
         }
 
 
@@ -0,0 +1,99 @@
+"""
+本地模型的 CPU 推理后端
+
+AI_LOCAL_MODEL_BACKEND 选择 local_model.LocalModel 实际运行的模型：
+- eager：torchvision 原始 float32 模型（默认）；
+- quantized：加载时对全连接层做动态 int8 量化（卷积层不变，主要减少分类头的内存和计算）；
+- torchscript：export_local_model 命令导出的 TorchScript 文件，不再需要构建 Python 模块；
+- quantized_torchscript：export_local_model --quantize 导出的动态 int8 量化 TorchScript 文件，与 float 版本分开保存；
+- onnx：export_local_model 命令导出的 ONNX 文件，用 onnxruntime 推理（可选依赖 onnx、onnxruntime）。
+导出文件保存在 AI_LOCAL_MODEL_EXPORT_DIR，文件名包含模型名和权重版本；文件不存在或加载失败时回退到 eager。
+"""
+import inspect
+import logging
+import os
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('eager', 'quantized', 'torchscript', 'quantized_torchscript', 'onnx')
+# 需要事先导出文件的后端及其文件名后缀
+EXPORTED = {'torchscript': '.pt', 'quantized_torchscript': '-int8.pt', 'onnx': '.onnx'}
+TORCHSCRIPT_BACKENDS = ('torchscript', 'quantized_torchscript')
+
+
+def artifact_path(model_name, weights_name, backend):
+    return os.path.join(settings.AI_LOCAL_MODEL_EXPORT_DIR, f"{model_name}-{weights_name}{EXPORTED[backend]}")
+
+
+def input_size(weights):
+    """权重预处理输出的图片边长（导出时的示例输入尺寸）"""
+    crop_size = getattr(weights.transforms(), 'crop_size', [224])
+    return crop_size[0] if isinstance(crop_size, (list, tuple)) else crop_size
+
+
+def quantize(model):
+    """对全连接层做动态 int8 量化"""
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export(model, weights, backend, path):
+    """把 eager 模型导出为 TorchScript 或 ONNX 文件（先写临时文件再替换）"""
+    import torch
+
+    size = input_size(weights)
+    example = torch.randn(1, 3, size, size)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with torch.inference_mode():
+        if backend in TORCHSCRIPT_BACKENDS:
+            traced = torch.jit.trace(model, example)
+            torch.jit.save(torch.jit.freeze(traced), tmp_path)
+        elif backend == 'onnx':
+            import onnx  # noqa: F401  导出依赖 onnx 包，缺少时尽早报错
+
+            kwargs = {}
+            # 新版 torch 默认使用依赖 onnxscript 的 dynamo 导出器，这里固定使用 TorchScript 导出器
+            if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+                kwargs['dynamo'] = False
+            torch.onnx.export(
+                model, (example,), tmp_path, input_names=['input'], output_names=['logits'],
+                dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}}, **kwargs
+            )
+        else:
+            raise ValueError(f"后端 {backend} 不需要导出，可导出: {', '.join(EXPORTED)}")
+    os.replace(tmp_path, path)
+    return path
+
+
+class OnnxRunner:
+    """用 onnxruntime 执行 ONNX 模型，输入输出与 torch 模型一致（批量图片张量 -> logits 张量）"""
+
+    def __init__(self, path):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if settings.AI_LOCAL_MODEL_THREADS > 0:
+            options.intra_op_num_threads = settings.AI_LOCAL_MODEL_THREADS
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        import torch
+
+        return torch.from_numpy(self.session.run(None, {self.input_name: batch.numpy()})[0])
+
+
+def load_exported(model_name, weights_name, backend):
+    """加载导出文件，返回可调用的模型；文件不存在时抛出 FileNotFoundError"""
+    path = artifact_path(model_name, weights_name, backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"导出文件不存在: {path}（先运行 export_local_model --backend {backend}）")
+    if backend == 'onnx':
+        return OnnxRunner(path)
+    import torch
+
+    return torch.jit.load(path).eval()
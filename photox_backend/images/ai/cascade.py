@@ -0,0 +1,121 @@
+"""
+分类级联：本地模型优先，只有不确定时才调用大模型
+
+开启 AI_CASCADE_ENABLED 后，入库分类先运行本地 ImageNet 模型（local_model.py）：
+top-1 置信度达到 AI_CASCADE_CONFIDENCE_THRESHOLD、top-1 标签能通过 shortlist.py 的映射对应到具体类别，
+且有标签得分达到 AI_CASCADE_MIN_TAG_SCORE 时直接返回本地结果；否则升级到远程的 image_classification。
+各层的命中次数和累计耗时是进程内计数（每个 worker 各自一份，重启后清零），
+/api/v1/images/ai-health/ 返回的是处理该请求的 worker 的数字（带 pid），只能作为抽样参考，不是全站汇总。
+调整阈值时以数据库中的全站数据为准：升级率约为 AICallRecord 中 kind=classify 的调用数与同期新增图片数之比，
+远程层耗时看这些记录的延迟分布（见 metering.py）；本地层耗时用 benchmark_local_model 命令单独测量。
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from . import local_model, shortlist
+
+logger = logging.getLogger(__name__)
+
+# local_runs/local_ms：本地模型运行次数和累计耗时；accepted：本地结果直接采用；escalated：升级到大模型
+# remote_calls/remote_ms：大模型调用次数和累计耗时；local_errors：本地模型出错
+COUNTERS = ['local_runs', 'local_ms', 'local_errors', 'accepted', 'escalated', 'remote_calls', 'remote_ms']
+
+_counts = dict.fromkeys(COUNTERS, 0)
+_counts_lock = threading.Lock()
+
+
+def enabled():
+    return settings.AI_CASCADE_ENABLED
+
+
+def config_fingerprint():
+    """影响级联结果的配置，作为分类结果缓存键的一部分；未开启时返回 None"""
+    if not enabled():
+        return None
+    return (f"{local_model.fingerprint()}:{settings.AI_CASCADE_CONFIDENCE_THRESHOLD}:"
+            f"{settings.AI_CASCADE_MAX_TAGS}:{settings.AI_CASCADE_MIN_TAG_SCORE}")
+
+
+def _count(name, amount=1):
+    with _counts_lock:
+        _counts[name] += amount
+
+
+def local_predictions(image, top_k=5):
+    """运行本地模型并计时，失败时返回 None"""
+    started = time.monotonic()
+    try:
+        predictions = local_model.predict(image, top_k=top_k)
+    except Exception as e:
+        logger.error(f"本地模型预测失败: {str(e)}")
+        _count('local_errors')
+        return None
+    _count('local_runs')
+    _count('local_ms', round((time.monotonic() - started) * 1000))
+    return predictions
+
+
+def local_result(predictions, vocabulary):
+    """
+    top-1 置信度足够、top-1 标签本身能映射到具体类别，且至少有一个标签得分达到 AI_CASCADE_MIN_TAG_SCORE 时，
+    把本地预测转换为与 image_classification 相同结构的结果；否则返回 None（需要升级到大模型）。
+    类别只取 top-1 标签对应的类别，不由低置信度的其他预测凑出。
+    """
+    if not predictions or predictions[0][1] < settings.AI_CASCADE_CONFIDENCE_THRESHOLD:
+        return None
+    fallback_id = min(vocabulary.category_map) if vocabulary.category_map else 0
+    top_categories, _ = shortlist.score_candidates(predictions[:1], vocabulary)
+    top_categories = [(category_id, score) for category_id, score in top_categories if category_id != fallback_id]
+    if not top_categories:
+        return None
+
+    category_id = top_categories[0][0]
+    _, tags = shortlist.score_candidates(predictions, vocabulary)
+    selected = [tag_id for tag_id, score in tags if score >= settings.AI_CASCADE_MIN_TAG_SCORE]
+    if not selected:
+        return None
+    return {
+        "category_id": category_id,
+        "category_name": vocabulary.category_map[category_id],
+        "tags": [{"id": tag_id, "name": vocabulary.tag_map[tag_id]} for tag_id in selected[:settings.AI_CASCADE_MAX_TAGS]],
+        "model_used": f"local:{settings.AI_LOCAL_MODEL}",
+        "confidence": round(predictions[0][1], 4),
+    }
+
+
+def record_decision(accepted):
+    _count('accepted' if accepted else 'escalated')
+
+
+def timed_remote(func):
+    """调用大模型并记录耗时（只在开启级联时统计，便于与本地层比较）"""
+    started = time.monotonic()
+    try:
+        return func()
+    finally:
+        if enabled():
+            _count('remote_calls')
+            _count('remote_ms', round((time.monotonic() - started) * 1000))
+
+
+def stats():
+    """当前 worker 进程的级联命中率和各层平均耗时"""
+    with _counts_lock:
+        counts = dict(_counts)
+    decided = counts['accepted'] + counts['escalated']
+    return {
+        "pid": os.getpid(),
+        **counts,
+        "hit_rate": round(counts['accepted'] / decided, 3) if decided else 0,
+        "local_avg_ms": round(counts['local_ms'] / counts['local_runs']) if counts['local_runs'] else None,
+        "remote_avg_ms": round(counts['remote_ms'] / counts['remote_calls']) if counts['remote_calls'] else None,
+    }
+
+
+def reset_stats():
+    with _counts_lock:
+        _counts.update(dict.fromkeys(COUNTERS, 0))
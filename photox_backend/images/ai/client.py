@@ -0,0 +1,156 @@
+"""
+视觉大模型的 HTTP 客户端
+
+所有模型调用（分类、描述、风格、情感）共用一个带连接池的 requests.Session：
+同一主机的连接保持 keep-alive 复用，不再每次调用都重新做 TCP/TLS 握手。
+每个进程（gunicorn/uwsgi worker）各自持有一个 Session，fork 后在子进程中重新创建。
+两个模型服务的接口地址由 AI_DASHSCOPE_BASE_URL、AI_QNAIGC_BASE_URL 配置，
+压测时可指向 mock_vision_server 命令启动的本地模拟服务。
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metering, resilience
+
+logger = logging.getLogger(__name__)
+
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+
+def build_session():
+    """
+    创建带连接池的 Session：每个主机保持最多 AI_HTTP_POOL_MAXSIZE 个空闲连接复用。
+    并发超出时临时新建连接、用完即关闭，不排队等待空闲连接（连接未被及时归还时也不会卡住调用方）。
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=settings.AI_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.AI_HTTP_POOL_MAXSIZE,
+        pool_block=False,
+        # 只重试建立连接失败（如复用了已被服务端关闭的空闲连接），不重试已发出的请求
+        max_retries=Retry(total=1, connect=1, read=0, status=0, redirect=0),
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    return session
+
+
+def get_session():
+    """当前进程共用的 Session"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = build_session()
+                _session_pid = pid
+                logger.info(f"创建 AI HTTP 连接池: 进程 {pid}")
+    return _session
+
+
+def chat_url(base_url):
+    return f"{base_url.rstrip('/')}/chat/completions"
+
+
+def dashscope_chat_url():
+    """通义千问（分类）的 chat/completions 地址"""
+    return chat_url(settings.AI_DASHSCOPE_BASE_URL)
+
+
+def qnaigc_chat_url():
+    """七牛 AI（描述、风格、情感）的 chat/completions 地址"""
+    return chat_url(settings.AI_QNAIGC_BASE_URL)
+
+
+def default_timeout():
+    """(连接超时, 读取超时)，单位秒"""
+    return (settings.AI_HTTP_CONNECT_TIMEOUT, settings.AI_HTTP_READ_TIMEOUT)
+
+
+def post_chat(url, api_key, payload, timeout=None, kind=''):
+    """
+    调用 OpenAI 兼容的 chat/completions 接口，返回 requests.Response。
+    经过熔断、重试和对冲（见 resilience.py）；端点熔断时抛出 CircuitOpenError，网络错误时抛出 requests 异常。
+    每次调用按 kind（分类、描述、风格等）记录模型、token 用量、延迟和结果（见 metering.py）。
+    """
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    session = get_session()
+    started = time.monotonic()
+    endpoint = resilience.endpoint_name(url)
+    try:
+        response = resilience.call(
+            url,
+            lambda attempt_timeout: session.post(url, json=payload, headers=headers, timeout=attempt_timeout),
+            timeout=timeout or default_timeout(),
+        )
+    except Exception as e:
+        metering.record(kind, payload.get('model'), endpoint, started, metering.outcome_of(error=e))
+        raise
+    usage = metering.response_usage(response) if response.status_code == 200 else None
+    metering.record(kind, payload.get('model'), endpoint, started, metering.outcome_of(response),
+                    response.status_code, usage)
+    return response
+
+
+def stream_chat(url, api_key, payload, timeout=None):
+    """
+    以 stream=true 调用 chat/completions，收到响应头后即返回 requests.Response（响应体尚未读取）。
+    熔断和重试只覆盖建立连接和响应状态，读取流的过程不再重试；调用方负责关闭响应并记录计量
+    （请求最后一个分片带上 usage）。
+    """
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    session = get_session()
+    return resilience.call(
+        url,
+        lambda attempt_timeout: session.post(
+            url, json={**payload, "stream": True, "stream_options": {"include_usage": True}},
+            headers=headers, timeout=attempt_timeout, stream=True,
+        ),
+        timeout=timeout or default_timeout(),
+    )
+
+
+def iter_stream_deltas(response, usage=None):
+    """
+    逐条解析流式响应（Server-Sent Events）中 choices[0].delta.content 的文本片段，遇到 [DONE] 结束。
+    传入 usage 字典时，把分片中的 usage 写入其中。
+    """
+    for line in response.iter_lines():
+        if not line:
+            continue
+        line = line.decode('utf-8') if isinstance(line, bytes) else line
+        if not line.startswith('data:'):
+            continue
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            logger.warning(f"无法解析的流式数据: {data[:200]}")
+            continue
+        if usage is not None and chunk.get('usage'):
+            usage.update(chunk['usage'])
+        choices = chunk.get('choices') or [{}]
+        content = (choices[0].get('delta') or {}).get('content')
+        if content:
+            yield content
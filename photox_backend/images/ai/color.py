@@ -6,6 +6,14 @@ def extract_colors_with_colorthief(image_path, num_colors=5):
     palette = color_thief.get_palette(color_count=num_colors)
     return palette
 
+
+def extract_colors_from_image(image, num_colors=5):
+    """对已解码的 PIL 图片提取主色，避免 ColorThief 再次打开和解码文件"""
+    color_thief = ColorThief.__new__(ColorThief)
+    color_thief.image = image
+    palette = color_thief.get_palette(color_count=num_colors)
+    return palette
+
 # def show_colors(colors):
 #     fig, ax = plt.subplots(1, len(colors), figsize=(10, 2))
 #     for i, color in enumerate(colors):
@@ -0,0 +1,149 @@
+import hashlib
+import io
+import logging
+
+from PIL import Image, ImageOps
+
+from .color import extract_colors_from_image
+from .exif import extract_exif
+
+logger = logging.getLogger(__name__)
+
+# 发给模型的图片预处理方式的版本，缩放或方向处理改变时递增，使旧的 AI 结果缓存失效
+PAYLOAD_VERSION = 2
+
+# 缩放时先用 reduce() 做整数倍缩小，剩余不超过该倍数的部分再用 LANCZOS 重采样
+REDUCING_GAP = 2.0
+
+
+def fit_size(size, max_size):
+    """按最长边等比缩放后的尺寸（不放大）"""
+    width, height = size
+    if max(width, height) <= max_size:
+        return width, height
+    ratio = max_size / max(width, height)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def downscale(img, max_size):
+    """把已解码的图片按最长边缩小（先整数倍 reduce 再 LANCZOS 重采样），不修改原图"""
+    target = fit_size(img.size, max_size)
+    if target == img.size:
+        return img
+    return img.resize(target, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def open_reduced(source, max_size=1024):
+    """
+    打开图片并缩小到最长边不超过 max_size，返回按 EXIF 方向摆正的 RGB 图片。
+    JPEG 用 draft() 在 DCT 域按 1/2、1/4、1/8 缩小解码，不需要先解码全尺寸像素；
+    其他格式解码后先整数倍 reduce 再重采样。source 可以是路径、文件对象或字节。
+    """
+    img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    if img.format == 'JPEG':
+        # 请求的尺寸不小于目标尺寸，解码结果再用 LANCZOS 精确缩放
+        img.draft(None, fit_size(img.size, max_size))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return downscale(img, max_size)
+
+
+def encode_jpeg(img, quality=85):
+    byte_arr = io.BytesIO()
+    img.save(byte_arr, format='JPEG', quality=quality, optimize=True)
+    return byte_arr.getvalue()
+
+
+def prepare_payload(source, max_size=1024, quality=85):
+    """发给视觉模型的 JPEG 字节：缩小解码、摆正方向、按最长边缩放后编码"""
+    return encode_jpeg(open_reduced(source, max_size), quality)
+
+
+class DecodedImage:
+    """
+    上传图片的内存表示：原始字节只读取一次、解码一次，
+    调色板、发给 AI 的缩小 JPEG 和上传到云存储的数据都从这里派生。
+    """
+
+    def __init__(self, data, filename='', content_hash=None):
+        self.data = data  # 原始文件字节，原样上传到云存储
+        self.filename = filename
+        # 原始字节的 SHA-256，用于去重
+        self.content_hash = content_hash or hashlib.sha256(data).hexdigest()
+        self._image = None
+        self._resized = {}
+        self._ai_jpeg = {}
+        self._exif = None
+
+    @classmethod
+    def from_upload(cls, uploaded_file):
+        """从 Django 的 UploadedFile 读取全部字节，读取的同时计算 SHA-256"""
+        sha256 = hashlib.sha256()
+        chunks = []
+        for chunk in uploaded_file.chunks():
+            sha256.update(chunk)
+            chunks.append(chunk)
+        return cls(b''.join(chunks), filename=uploaded_file.name, content_hash=sha256.hexdigest())
+
+    @classmethod
+    def from_path(cls, path):
+        """从本地文件读取全部字节"""
+        with open(path, 'rb') as f:
+            return cls(f.read(), filename=path)
+
+    @property
+    def size_bytes(self):
+        return len(self.data)
+
+    @property
+    def image(self):
+        """解码后的 RGB 图片（惰性解码，只解码一次）"""
+        if self._image is None:
+            img = Image.open(io.BytesIO(self.data))
+            img.load()
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            self._image = img
+        return self._image
+
+    def resized(self, max_size=1024):
+        """
+        按最长边缩放并按 EXIF 方向摆正的图片，同一尺寸只计算一次。
+        已解码全尺寸图片（如生成派生图）时从它缩小，否则直接缩小解码原始字节。
+        """
+        if max_size not in self._resized:
+            if self._image is not None:
+                # convert() 保留了 info 中的 EXIF，可以直接按方向摆正
+                self._resized[max_size] = downscale(ImageOps.exif_transpose(self._image), max_size)
+            else:
+                self._resized[max_size] = open_reduced(self.data, max_size)
+        return self._resized[max_size]
+
+    def ai_jpeg(self, max_size=1024, quality=85):
+        """发给视觉模型的 JPEG 字节，与 prepare_payload 的输出一致"""
+        key = (max_size, quality)
+        if key not in self._ai_jpeg:
+            self._ai_jpeg[key] = encode_jpeg(self.resized(max_size), quality)
+        return self._ai_jpeg[key]
+
+    @property
+    def exif(self):
+        """EXIF 中的拍摄参数，只读取文件头，不依赖像素解码"""
+        if self._exif is None:
+            try:
+                self._exif = extract_exif(Image.open(io.BytesIO(self.data)))
+            except Exception as e:
+                logger.warning(f"读取 EXIF 失败: {str(e)}")
+                self._exif = {}
+        return self._exif
+
+    @property
+    def perceptual_hash(self):
+        """64 位 dHash 的十六进制字符串（在缩小后的图片上计算）"""
+        from ..phash import dhash, to_hex
+        return to_hex(dhash(self.resized()))
+
+    def palette(self, num_colors=2):
+        """提取主色（在缩小后的图片上计算，结果与原图基本一致且更快）"""
+        return extract_colors_from_image(self.resized(), num_colors=num_colors)
@@ -1,59 +1,50 @@
-from .ai_classify import load_model_map, process_image, logger
+from .ai_classify import process_image, logger
+from .vocabulary import get_model_map
+from . import client, metering, resilience
 import base64
+import time
 import requests
 
-def generate_image_description(image_path, api_key, model_id=1, model_file="model.txt"):
-    """生成图片的一句话描述"""
-    # 加载模型映射
-    model_map = load_model_map(model_file)
-
-    # 获取模型名称
+# 描述生成的系统提示词 - 要求生成自然语言描述
+DESCRIPTION_PROMPT = (
+    "1. 直接输出描述文本，不要包含任何冗余的格式或标记。"
+    "2. 身份定位：资深摄影师，具有10年以上的拍摄经验，擅长多种摄影风格（如人像、风景、街拍、艺术摄影等）。"
+    "如果是风景照片，你要告诉我这是哪个地点（如果可以识别的话），放在这段回复的最前端。"
+    "3. 分析角度：从构图、光影、色彩、焦距、景深、曝光、质感、拍摄角度等专业技术层面进行深度分析。"
+    "4. 深入探讨光线的使用与光影效果，分析如何通过自然光、人工光源或混合光来塑造画面的氛围与情感表达。"
+    "5. 色彩搭配：分析色调、饱和度、对比度等色彩元素的运用，以及色彩如何影响整体的视觉效果与情感传达。"
+    "6. 分析焦点与景深的控制，探讨如何通过焦外效果（如背景虚化）来引导观众的视线，突出主要元素。"
+    "7. 构图技巧：分析拍摄角度、构图法则（如三分法、对称性、引导线等）的运用，以及这些手法如何提升画面的视觉冲击力。"
+    "8. 如果照片包含人物，深入剖析人物的表情、姿态、肢体语言与镜头之间的互动，如何通过这些元素传达情感与故事。"
+    "9. 深度分析图像中的纹理、细节与层次感，探讨如何通过镜头捕捉到细腻的质感，增强画面的沉浸感。"
+    "10. 如果有后期处理，分析其对照片的影响，尤其是在锐度、色彩修正、对比度调整等方面的作用与效果。"
+    "11. 根据不同的拍摄环境与场景，提供相应的改进建议，例如如何利用环境光、反射光、背景的选择等来增强照片的表达力。"
+    "12. 如果有特定摄影风格（如黑白摄影、复古风格、极简主义等），分析该风格的体现方法及其独特的视觉语言。"
+    "13. 如果适用，提出如何通过不同设备（如镜头、滤镜、相机设置等）来优化拍摄效果，提升画质与表现力。"
+    "14. 针对摄影作品的市场需求与观众心理，提出与摄影目标相符的视觉传达策略。"
+)
+
+
+def resolve_model_name(model_id=1, model_file="model.txt"):
+    """按模型编号查找模型名称，无效编号使用第一个模型"""
+    model_map = get_model_map(model_file)
     if model_id in model_map:
-        model_name = model_map[model_id]
-        logger.info(f"使用模型: {model_name} (ID: {model_id})")
-    else:
-        model_name = model_map.get(1, "qwen2.5-vl-7b-instruct")
-        logger.warning(f"无效模型ID {model_id}，使用默认模型: {model_name}")
+        return model_map[model_id]
+    model_name = model_map.get(1, "qwen2.5-vl-7b-instruct")
+    logger.warning(f"无效模型ID {model_id}，使用默认模型: {model_name}")
+    return model_name
 
-    # 预处理图片
-    image_bytes = process_image(image_path)
-    if not image_bytes:
-        return {
-            "description": "图片处理失败",
-            "model_used": model_name
-        }
 
-    # 构建Data URL
+def build_payload(model_name, image_bytes):
+    """描述请求的载荷（图片以 Data URL 内联）"""
     encoded_image = base64.b64encode(image_bytes).decode("utf-8")
     image_data_url = f"data:image/jpeg;base64,{encoded_image}"
-
-    # 构建系统提示词 - 要求生成自然语言描述
-    system_prompt = (
-        "1. 直接输出描述文本，不要包含任何冗余的格式或标记。"
-        "2. 身份定位：资深摄影师，具有10年以上的拍摄经验，擅长多种摄影风格（如人像、风景、街拍、艺术摄影等）。"
-        "如果是风景照片，你要告诉我这是哪个地点（如果可以识别的话），放在这段回复的最前端。"
-        "3. 分析角度：从构图、光影、色彩、焦距、景深、曝光、质感、拍摄角度等专业技术层面进行深度分析。"
-        "4. 深入探讨光线的使用与光影效果，分析如何通过自然光、人工光源或混合光来塑造画面的氛围与情感表达。"
-        "5. 色彩搭配：分析色调、饱和度、对比度等色彩元素的运用，以及色彩如何影响整体的视觉效果与情感传达。"
-        "6. 分析焦点与景深的控制，探讨如何通过焦外效果（如背景虚化）来引导观众的视线，突出主要元素。"
-        "7. 构图技巧：分析拍摄角度、构图法则（如三分法、对称性、引导线等）的运用，以及这些手法如何提升画面的视觉冲击力。"
-        "8. 如果照片包含人物，深入剖析人物的表情、姿态、肢体语言与镜头之间的互动，如何通过这些元素传达情感与故事。"
-        "9. 深度分析图像中的纹理、细节与层次感，探讨如何通过镜头捕捉到细腻的质感，增强画面的沉浸感。"
-        "10. 如果有后期处理，分析其对照片的影响，尤其是在锐度、色彩修正、对比度调整等方面的作用与效果。"
-        "11. 根据不同的拍摄环境与场景，提供相应的改进建议，例如如何利用环境光、反射光、背景的选择等来增强照片的表达力。"
-        "12. 如果有特定摄影风格（如黑白摄影、复古风格、极简主义等），分析该风格的体现方法及其独特的视觉语言。"
-        "13. 如果适用，提出如何通过不同设备（如镜头、滤镜、相机设置等）来优化拍摄效果，提升画质与表现力。"
-        "14. 针对摄影作品的市场需求与观众心理，提出与摄影目标相符的视觉传达策略。"
-
-    )
-
-    # 构建请求载荷
-    payload = {
+    return {
         "model": model_name,
         "messages": [
             {
                 "role": "system",
-                "content": system_prompt
+                "content": DESCRIPTION_PROMPT
             },
             {
                 "role": "user",
@@ -65,23 +56,44 @@ def generate_image_description(image_path, api_key, model_id=1, model_file="mode
         ]
     }
 
-    # 发送请求
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+def clean_description(text):
+    """去掉首尾空白和可能存在的引号"""
+    return text.strip().strip('"').strip('“').strip('”')
+
+
+def generate_image_description(image_path, api_key, model_id=1, model_file="model.txt", image_bytes=None):
+    """
+    生成图片的一句话描述
+    :param image_path: 本地路径或文件对象（如内存中的 BytesIO）
+    :param image_bytes: 已预处理好的 JPEG 字节，传入时跳过读取和预处理 image_path
+    """
+    # 获取模型名称
+    model_name = resolve_model_name(model_id, model_file)
+    logger.info(f"使用模型: {model_name} (ID: {model_id})")
+
+    # 预处理图片
+    if image_bytes is None:
+        image_bytes = process_image(image_path)
+    if not image_bytes:
+        return {
+            "description": "图片处理失败",
+            "model_used": model_name,
+            "error": "图片处理失败"
+        }
+
+    payload = build_payload(model_name, image_bytes)
+
+    # 发送请求（复用连接池中的 keep-alive 连接）
     try:
-        response = requests.post(
-            "https://api.qnaigc.com/v1/chat/completions",
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
+        response = client.post_chat(client.qnaigc_chat_url(), api_key, payload, kind='description')
 
         if response.status_code == 200:
             try:
                 # 获取描述文本
                 description = response.json()['choices'][0]['message']['content'].strip()
 
-                # 清理可能存在的引号
-                description = description.strip('"').strip('“').strip('”')
+                description = clean_description(description)
 
                 logger.info(f"生成描述: {description}")
                 return {
@@ -92,22 +104,61 @@ def generate_image_description(image_path, api_key, model_id=1, model_file="mode
                 logger.error(f"响应解析错误: {e}")
                 return {
                     "description": "描述解析失败",
-                    "model_used": model_name
+                    "model_used": model_name,
+                    "error": "描述解析失败"
                 }
         else:
             logger.error(f"API错误: {response.status_code}, {response.text}")
             return {
                 "description": "API请求失败",
-                "model_used": model_name
+                "model_used": model_name,
+                "error": "API请求失败"
             }
     except Exception as e:
         logger.error(f"请求异常: {e}")
         return {
             "description": "请求异常",
-            "model_used": model_name
+            "model_used": model_name,
+            "error": "请求异常"
         }
 
 
+def stream_image_description(image_bytes, api_key, model_id=1, model_file="model.txt"):
+    """
+    以流式调用生成描述，逐个返回模型输出的文本片段（未清理引号，完整文本由调用方用 clean_description 处理）。
+    请求失败时抛出异常：熔断时为 CircuitOpenError，非 200 响应为 requests.HTTPError。
+    """
+    model_name = resolve_model_name(model_id, model_file)
+    logger.info(f"流式生成描述，使用模型: {model_name} (ID: {model_id})")
+    url = client.qnaigc_chat_url()
+    endpoint = resilience.endpoint_name(url)
+    started = time.monotonic()
+    try:
+        response = client.stream_chat(url, api_key, build_payload(model_name, image_bytes))
+    except Exception as e:
+        metering.record('description', model_name, endpoint, started, metering.outcome_of(error=e))
+        raise
+    usage = {}
+    error = None
+    try:
+        if response.status_code != 200:
+            logger.error(f"API错误: {response.status_code}, {response.text[:200]}")
+            response.raise_for_status()
+            raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+        yield from client.iter_stream_deltas(response, usage)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        response.close()
+        # 客户端中途断开时也记录，延迟为到此为止的时间
+        if error is not None and response.status_code == 200:
+            outcome = metering.outcome_of(error=error)
+        else:
+            outcome = metering.outcome_of(response)
+        metering.record('description', model_name, endpoint, started, outcome, response.status_code, usage)
+
+
 if __name__ == "__main__":
     # 测试描述生成
     api_key = "sk-ff8f03a8cfbc03d7df75b7ddb6b1fb7f0bfc8116e02986306865aa9149741301"
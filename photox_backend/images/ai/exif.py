@@ -0,0 +1,128 @@
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+from PIL.ExifTags import Base, GPS, IFD
+
+logger = logging.getLogger(__name__)
+
+# Image 模型上由 EXIF 填充的字段
+EXIF_FIELDS = (
+    'taken_at', 'camera_make', 'camera_model', 'lens_model', 'focal_length',
+    'iso', 'exposure_time', 'f_number', 'orientation', 'gps_latitude', 'gps_longitude',
+)
+
+
+def _text(value, max_length):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='ignore')
+    if not isinstance(value, str):
+        return ''
+    return value.replace('\x00', '').strip()[:max_length]
+
+
+def _number(value):
+    """EXIF 中的有理数（IFDRational/元组）转为 float，无效值返回 None"""
+    if isinstance(value, (tuple, list)):
+        value = value[0] if value else None
+    try:
+        number = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    if number != number or number in (float('inf'), float('-inf')):
+        return None
+    return number
+
+
+def _taken_at(exif_ifd, base):
+    """拍摄时间：优先 DateTimeOriginal，带时区偏移时按偏移换算，否则按服务器时区解释"""
+    raw = _text(exif_ifd.get(Base.DateTimeOriginal) or base.get(Base.DateTime), 32)
+    if not raw:
+        return None
+    try:
+        value = datetime.strptime(raw[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+
+    offset = _text(exif_ifd.get(Base.OffsetTimeOriginal) or exif_ifd.get(Base.OffsetTime), 8)
+    if len(offset) == 6 and offset[0] in '+-' and offset[3] == ':':
+        try:
+            delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6]))
+            return value.replace(tzinfo=dt_timezone(delta if offset[0] == '+' else -delta))
+        except ValueError:
+            pass
+    return timezone.make_aware(value)
+
+
+def _coordinate(values, ref, positive_ref):
+    """度/分/秒三元组转为十进制度数，南纬/西经为负"""
+    if not isinstance(values, (tuple, list)) or len(values) != 3:
+        return None
+    parts = [_number(v) for v in values]
+    if None in parts:
+        return None
+    degrees = parts[0] + parts[1] / 60 + parts[2] / 3600
+    if _text(ref, 1).upper() not in ('', positive_ref):
+        degrees = -degrees
+    return round(degrees, 7)
+
+
+def parse_exif(exif):
+    """
+    把 PIL 的 Image.Exif 解析为 Image 模型字段的字典（只包含能解析出的字段）。
+    任何字段解析失败都只跳过该字段，不影响上传。
+    """
+    fields = {}
+    if not exif:
+        return fields
+
+    exif_ifd = exif.get_ifd(IFD.Exif)
+    gps_ifd = exif.get_ifd(IFD.GPSInfo)
+
+    taken_at = _taken_at(exif_ifd, exif)
+    if taken_at:
+        fields['taken_at'] = taken_at
+
+    for field, value, max_length in (
+        ('camera_make', exif.get(Base.Make), 100),
+        ('camera_model', exif.get(Base.Model), 100),
+        ('lens_model', exif_ifd.get(Base.LensModel), 255),
+    ):
+        text = _text(value, max_length)
+        if text:
+            fields[field] = text
+
+    for field, value in (
+        ('focal_length', exif_ifd.get(Base.FocalLength)),
+        ('exposure_time', exif_ifd.get(Base.ExposureTime)),
+        ('f_number', exif_ifd.get(Base.FNumber)),
+    ):
+        number = _number(value)
+        if number is not None and number > 0:
+            fields[field] = round(number, 6)
+
+    iso = _number(exif_ifd.get(Base.ISOSpeedRatings))
+    if iso is not None and iso > 0:
+        fields['iso'] = int(iso)
+
+    orientation = _number(exif.get(Base.Orientation))
+    if orientation is not None and 1 <= orientation <= 8:
+        fields['orientation'] = int(orientation)
+
+    if gps_ifd:
+        latitude = _coordinate(gps_ifd.get(GPS.GPSLatitude), gps_ifd.get(GPS.GPSLatitudeRef), 'N')
+        longitude = _coordinate(gps_ifd.get(GPS.GPSLongitude), gps_ifd.get(GPS.GPSLongitudeRef), 'E')
+        if latitude is not None and longitude is not None and abs(latitude) <= 90 and abs(longitude) <= 180:
+            fields['gps_latitude'] = latitude
+            fields['gps_longitude'] = longitude
+
+    return fields
+
+
+def extract_exif(image):
+    """从 PIL 图片（只需打开文件头，无需解码像素）中提取 EXIF 字段"""
+    try:
+        return parse_exif(image.getexif())
+    except Exception as e:
+        logger.warning(f"解析 EXIF 失败: {str(e)}")
+        return {}
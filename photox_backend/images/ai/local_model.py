@@ -0,0 +1,300 @@
+"""
+本地 ImageNet 分类模型（torchvision）
+
+在调用视觉大模型前做低成本的预测，例如为分类提示词预筛选候选标签、分类级联。
+模型由进程内的 ModelRegistry 按 (模型名, 权重, 后端) 共享，每个组合只加载一次；
+已加载模型的常驻内存总和超过 AI_LOCAL_MODEL_MEMORY_BUDGET_MB 时按最近最少使用淘汰。
+类别名称和预处理直接取自权重元数据，不再读取 imagenet_classes.txt 或联网下载标签文件。
+
+predict() 会把并发调用（如批量上传的多个线程）合并成一个批次做一次前向计算：
+正在推理时到达的请求排队，下一个取得推理锁的线程把队列中的请求一起处理。
+回填类任务可直接调用 predict_batch()。
+开启 AI_LOCAL_MODEL_PRELOAD 并以 gunicorn --preload 启动时，模型在 fork 前加载，各 worker 共享权重内存。
+实际执行推理的后端（eager / 量化 / TorchScript / ONNX）由 AI_LOCAL_MODEL_BACKEND 选择，见 backends.py。
+"""
+import gc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import backends
+
+logger = logging.getLogger(__name__)
+
+# 等待合并推理的请求，以及同一时间只允许一个批次占用模型的推理锁
+_pending = []
+_pending_lock = threading.Lock()
+_infer_lock = threading.Lock()
+
+_threads_configured = False
+
+
+def configure_threads():
+    """按 AI_LOCAL_MODEL_THREADS 限制 torch 的算子内线程数，避免多个 worker 进程争抢 CPU"""
+    global _threads_configured
+    if _threads_configured:
+        return
+    import torch
+
+    if settings.AI_LOCAL_MODEL_THREADS > 0:
+        torch.set_num_threads(settings.AI_LOCAL_MODEL_THREADS)
+    _threads_configured = True
+
+
+def resident_bytes():
+    """当前进程的常驻内存（字节）；无法读取 /proc 时返回进程的峰值常驻内存"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LocalModel:
+    """一个 torchvision 分类模型及其预处理和类别名称"""
+
+    def __init__(self, model_name, weights="DEFAULT", backend=None):
+        import torch
+        from torchvision import models
+
+        configure_threads()
+        started = time.monotonic()
+        weights_enum = models.get_model_weights(model_name)
+        self.weights = weights_enum.DEFAULT if weights == "DEFAULT" else weights_enum[weights]
+        self.model_name = model_name
+        self.backend = backend or settings.AI_LOCAL_MODEL_BACKEND
+        self.model = self._load_model(models)
+        # 类别名称和预处理取自权重元数据，与后端无关
+        self.preprocess = self.weights.transforms()
+        self.categories = self.weights.meta["categories"]
+        self.torch = torch
+        logger.info(f"本地模型 {model_name}（{self.backend}）加载完成: {time.monotonic() - started:.2f}s")
+
+    def _load_model(self, models):
+        if self.backend in backends.EXPORTED:
+            try:
+                return backends.load_exported(self.model_name, self.weights.name, self.backend)
+            except Exception as e:
+                logger.error(f"加载本地模型 {self.backend} 后端失败，回退到 eager: {str(e)}")
+                self.backend = 'eager'
+        model = models.get_model(self.model_name, weights=self.weights).eval()
+        if self.backend == 'quantized':
+            model = backends.quantize(model)
+        return model
+
+    def predict(self, image, top_k=5):
+        """对 PIL 图片做预测，返回 [(ImageNet 标签, 概率), ...]"""
+        return self.predict_batch([image], top_k=top_k)[0]
+
+    def predict_batch(self, images, top_k=5):
+        """对多张 PIL 图片做一次前向计算，按输入顺序返回每张图片的预测结果"""
+        if not images:
+            return []
+        batch = self.torch.stack([
+            self.preprocess(image if image.mode == 'RGB' else image.convert('RGB')) for image in images
+        ])
+        with self.torch.inference_mode():
+            output = self.model(batch)
+        probs = self.torch.nn.functional.softmax(output, dim=1)
+        top_probs, top_indices = self.torch.topk(probs, top_k, dim=1)
+        return [
+            [(self.categories[i], float(p)) for i, p in zip(indices, row)]
+            for indices, row in zip(top_indices.tolist(), top_probs.tolist())
+        ]
+
+
+def model_bytes(model):
+    """模型参数和缓冲区占用的字节数（无法取得时为 0，如 ONNX 会话）"""
+    try:
+        tensors = list(model.parameters()) + list(model.buffers())
+    except AttributeError:
+        return 0
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class RegistryEntry:
+    """已加载的模型及其加载耗时、常驻内存和使用情况"""
+
+    def __init__(self, model, load_seconds, size_bytes):
+        self.model = model
+        self.load_seconds = load_seconds
+        self.size_bytes = size_bytes
+        self.hits = 1
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    """进程内共享的本地模型，按 (模型名, 权重, 后端) 区分，总内存受预算限制，超出时淘汰最久未使用的模型"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 加载在单独的锁内串行进行：避免同一模型重复加载，也使按常驻内存差值估算的模型大小更准确
+        self._load_lock = threading.Lock()
+        self.evictions = 0
+
+    def _touch(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                entry.last_used = time.time()
+            return entry
+
+    def get(self, model_name=None, weights="DEFAULT", backend=None):
+        key = (model_name or settings.AI_LOCAL_MODEL, weights, backend or settings.AI_LOCAL_MODEL_BACKEND)
+        entry = self._touch(key)
+        if entry is not None:
+            return entry.model
+        with self._load_lock:
+            entry = self._touch(key)
+            if entry is not None:
+                return entry.model
+            before = resident_bytes()
+            started = time.monotonic()
+            model = LocalModel(*key)
+            load_seconds = time.monotonic() - started
+            # 常驻内存差值可能因复用已释放的内存而偏小，此时以参数大小估算
+            size_bytes = max(resident_bytes() - before, model_bytes(model.model))
+            with self._lock:
+                self._entries[key] = RegistryEntry(model, load_seconds, size_bytes)
+                evicted = self._evict(keep=key)
+            logger.info(f"本地模型 {key} 已加入注册表: {size_bytes / 1024 / 1024:.0f} MB, 加载 {load_seconds:.2f}s")
+        if evicted:
+            gc.collect()
+        return model
+
+    def _evict(self, keep):
+        """持有 self._lock 时调用：总内存超出预算时按最近最少使用淘汰，刚加载的模型除外"""
+        budget = settings.AI_LOCAL_MODEL_MEMORY_BUDGET_MB * 1024 * 1024
+        evicted = []
+        while budget > 0 and sum(entry.size_bytes for entry in self._entries.values()) > budget:
+            key = next((key for key in self._entries if key != keep), None)
+            if key is None:
+                break
+            self._entries.pop(key)
+            evicted.append(key)
+            self.evictions += 1
+            logger.info(f"本地模型 {key} 超出内存预算，已从注册表淘汰")
+        return evicted
+
+    def snapshot(self):
+        """已加载模型的加载耗时、常驻内存和使用次数，按最近使用排序"""
+        with self._lock:
+            entries = list(self._entries.items())
+        return {
+            "budget_mb": settings.AI_LOCAL_MODEL_MEMORY_BUDGET_MB,
+            "resident_mb": round(sum(entry.size_bytes for _, entry in entries) / 1024 / 1024, 1),
+            "evictions": self.evictions,
+            "models": [
+                {
+                    "model": model_name,
+                    "weights": weights,
+                    "backend": backend,
+                    "load_seconds": round(entry.load_seconds, 2),
+                    "size_mb": round(entry.size_bytes / 1024 / 1024, 1),
+                    "hits": entry.hits,
+                    "last_used": entry.last_used,
+                }
+                for (model_name, weights, backend), entry in reversed(entries)
+            ],
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        gc.collect()
+
+
+registry = ModelRegistry()
+
+
+def get_local_model(model_name=None, weights="DEFAULT", backend=None):
+    """当前进程共用的本地模型，首次调用时加载"""
+    return registry.get(model_name, weights, backend)
+
+
+def warmup_specs():
+    """AI_LOCAL_MODEL_WARMUP 中的模型，格式为逗号分隔的 模型名[:权重]"""
+    specs = []
+    for item in settings.AI_LOCAL_MODEL_WARMUP.split(','):
+        model_name, _, weights = item.strip().partition(':')
+        if model_name:
+            specs.append((model_name, weights or "DEFAULT"))
+    return specs
+
+
+def preload():
+    """
+    启动时加载默认模型和 AI_LOCAL_MODEL_WARMUP 中的模型
+    （只加载权重，不做推理，避免 fork 前启动 torch 线程池）
+    """
+    for model_name, weights in [(settings.AI_LOCAL_MODEL, "DEFAULT")] + warmup_specs():
+        try:
+            get_local_model(model_name, weights)
+        except Exception as e:
+            logger.error(f"预加载本地模型 {model_name}:{weights} 失败: {str(e)}")
+
+
+class _Request:
+    def __init__(self, image, top_k):
+        self.image = image
+        self.top_k = top_k
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _run_pending(model):
+    """持有推理锁时调用：取出排队的请求（最多 AI_LOCAL_MODEL_BATCH_SIZE 个）做一次前向计算"""
+    with _pending_lock:
+        batch = _pending[:settings.AI_LOCAL_MODEL_BATCH_SIZE]
+        del _pending[:len(batch)]
+    if not batch:
+        return
+    top_k = max(request.top_k for request in batch)
+    try:
+        results = model.predict_batch([request.image for request in batch], top_k=top_k)
+    except Exception as e:
+        for request in batch:
+            request.error = e
+            request.done.set()
+        return
+    for request, result in zip(batch, results):
+        request.result = result[:request.top_k]
+        request.done.set()
+
+
+def predict(image, top_k=5):
+    """对单张图片预测；与其他线程的并发调用合并为一个批次"""
+    model = get_local_model()
+    request = _Request(image, top_k)
+    with _pending_lock:
+        _pending.append(request)
+    while not request.done.is_set():
+        if _infer_lock.acquire(blocking=False):
+            try:
+                _run_pending(model)
+            finally:
+                _infer_lock.release()
+        else:
+            # 其他线程正在推理，本请求会被它之后的批次处理
+            request.done.wait(0.005)
+    if request.error is not None:
+        raise request.error
+    return request.result
+
+
+def predict_batch(images, top_k=5):
+    return get_local_model().predict_batch(images, top_k=top_k)
+
+
+def fingerprint():
+    """影响本地预测结果的配置（模型和后端，量化与否是不同的后端），用于依赖本地预测的缓存键"""
+    return f"{settings.AI_LOCAL_MODEL}:{settings.AI_LOCAL_MODEL_BACKEND}"
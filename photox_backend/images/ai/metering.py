@@ -0,0 +1,251 @@
+"""
+视觉大模型调用计量
+
+每次调用（client.post_chat / stream_chat）记录模型、端点、调用类型、图片 ID、
+响应 usage 中的 prompt/completion token 数、延迟（含重试）和结果。
+记录先进入进程内缓冲区（调用可能发生在只做 HTTP 的工作线程中），
+在请求结束（request_finished 信号）、后台入库任务结束和进程退出（管理命令执行完毕）时批量写入只追加的 AICallRecord 表；
+缓冲区超过 AI_METERING_BUFFER_SIZE 条时丢弃最旧的记录。
+同步上传在图片记录创建前就完成分类，用 collect 收集这些调用，建档后由 attach_image 补上图片 ID。
+rollup_ai_usage 命令按天、按模型汇总为 AIUsageDaily（调用数、失败数、token、p50/p95 延迟、费用），
+管理后台的 AI 用量页面展示汇总结果。
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from . import resilience
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_OK = 'ok'
+OUTCOME_HTTP_ERROR = 'http_error'
+OUTCOME_CIRCUIT_OPEN = 'circuit_open'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_ERROR = 'error'
+
+_buffer = deque()
+_buffer_lock = threading.Lock()
+# 写库期间持有，attach_image 据此判断记录是仍在缓冲区中还是已经写入数据库
+_flush_lock = threading.Lock()
+_dropped = 0
+_context = threading.local()
+
+
+@contextmanager
+def image_scope(image_id):
+    """在当前线程内把模型调用记录关联到图片"""
+    previous = getattr(_context, 'image_id', None)
+    _context.image_id = image_id
+    try:
+        yield
+    finally:
+        _context.image_id = previous
+
+
+@contextmanager
+def collect(calls):
+    """在当前线程内把产生的调用记录同时追加到 calls 列表（记录照常进入缓冲区），供之后 attach_image 使用"""
+    previous = getattr(_context, 'collected', None)
+    _context.collected = calls
+    try:
+        yield calls
+    finally:
+        _context.collected = previous
+
+
+def attach_image(calls, image_id):
+    """图片记录创建后，把 collect 收集到的调用记录关联到该图片（已写入数据库的记录直接更新）"""
+    from ..models import AICallRecord
+
+    if not calls:
+        return
+    with _flush_lock:
+        with _buffer_lock:
+            flushed = [entry for entry in calls if entry.get('_flushed')]
+            for entry in calls:
+                entry['image_id'] = image_id
+        if flushed:
+            try:
+                AICallRecord.objects.filter(
+                    image_id=None, created_at__in=[entry['created_at'] for entry in flushed],
+                ).update(image_id=image_id)
+            except DatabaseError as e:
+                logger.error(f"关联 AI 调用记录与图片 {image_id} 失败: {str(e)}")
+
+
+def bind(image_id, func):
+    """包装提交到线程池的函数，使其中的模型调用记录关联到图片"""
+    def run(*args, **kwargs):
+        with image_scope(image_id):
+            return func(*args, **kwargs)
+    return run
+
+
+def usage_tokens(usage):
+    """从响应的 usage 中取 (prompt_tokens, completion_tokens)，兼容 input_tokens/output_tokens 命名；格式不对时为 0"""
+    if not isinstance(usage, dict):
+        return 0, 0
+    try:
+        prompt = int(usage.get('prompt_tokens', usage.get('input_tokens')) or 0)
+        completion = int(usage.get('completion_tokens', usage.get('output_tokens')) or 0)
+    except (TypeError, ValueError):
+        return 0, 0
+    return prompt, completion
+
+
+def response_usage(response):
+    """非流式响应中的 usage，无法解析时返回 None"""
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    return data.get('usage') if isinstance(data, dict) else None
+
+
+def outcome_of(response=None, error=None):
+    """按响应状态或异常归类调用结果"""
+    if error is not None:
+        if isinstance(error, resilience.CircuitOpenError):
+            return OUTCOME_CIRCUIT_OPEN
+        if isinstance(error, requests.Timeout):
+            return OUTCOME_TIMEOUT
+        return OUTCOME_ERROR
+    return OUTCOME_OK if response.status_code == 200 else OUTCOME_HTTP_ERROR
+
+
+def record(kind, model_name, endpoint, started, outcome, status_code=None, usage=None):
+    """记录一次调用（started 为 time.monotonic() 的开始时间）"""
+    global _dropped
+    if not settings.AI_METERING_ENABLED:
+        return
+    prompt_tokens, completion_tokens = usage_tokens(usage)
+    entry = {
+        "created_at": timezone.now(),
+        "kind": kind or '',
+        "model_name": model_name or '',
+        "endpoint": endpoint,
+        "image_id": getattr(_context, 'image_id', None),
+        "outcome": outcome,
+        "status_code": status_code,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "latency_ms": round((time.monotonic() - started) * 1000),
+    }
+    with _buffer_lock:
+        if len(_buffer) >= settings.AI_METERING_BUFFER_SIZE:
+            _buffer.popleft()
+            _dropped += 1
+        _buffer.append(entry)
+    collected = getattr(_context, 'collected', None)
+    if collected is not None:
+        collected.append(entry)
+
+
+def flush():
+    """把缓冲区中的记录写入数据库，返回写入条数；写入失败时记录放回缓冲区等待下次写入"""
+    global _dropped
+    from ..models import AICallRecord
+
+    with _flush_lock:
+        with _buffer_lock:
+            entries = list(_buffer)
+            _buffer.clear()
+            dropped, _dropped = _dropped, 0
+            for entry in entries:
+                entry['_flushed'] = True
+            records = [AICallRecord(**{key: value for key, value in entry.items() if key != '_flushed'})
+                       for entry in entries]
+        if dropped:
+            logger.warning(f"AI 调用计量缓冲区已满，丢弃了 {dropped} 条记录")
+        if not entries:
+            return 0
+        try:
+            AICallRecord.objects.bulk_create(records)
+        except DatabaseError as e:
+            logger.error(f"写入 AI 调用记录失败: {str(e)}")
+            with _buffer_lock:
+                room = settings.AI_METERING_BUFFER_SIZE - len(_buffer)
+                if room > 0:
+                    for entry in entries[-room:]:
+                        entry['_flushed'] = False
+                    _buffer.extendleft(reversed(entries[-room:]))
+            return 0
+        return len(entries)
+
+
+def flush_on_request_finished(sender, **kwargs):
+    """request_finished 信号处理：请求线程结束时写入本进程缓冲的记录"""
+    if _buffer:
+        flush()
+
+
+def flush_at_exit():
+    """进程退出时写入剩余的记录：管理命令（重新分类、基准测试、补算等）中的调用不经过请求结束信号"""
+    if not _buffer:
+        return
+    try:
+        flush()
+    except Exception as e:
+        logger.error(f"进程退出时写入 AI 调用记录失败: {str(e)}")
+
+
+def percentile(values, ratio):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+def cost(model_name, prompt_tokens, completion_tokens):
+    """按 AI_MODEL_PRICES（元/百万 token）计算费用，未配置价格的模型为 0"""
+    price = settings.AI_MODEL_PRICES.get(model_name) or {}
+    return (prompt_tokens * price.get('prompt', 0) + completion_tokens * price.get('completion', 0)) / 1_000_000
+
+
+def summarize(day):
+    """某一天各模型的调用汇总（按 AICallRecord 实时计算）"""
+    from ..models import AICallRecord
+
+    by_model = {}
+    rows = AICallRecord.objects.filter(created_at__date=day).values_list(
+        'model_name', 'outcome', 'latency_ms', 'prompt_tokens', 'completion_tokens'
+    )
+    for model_name, outcome, latency_ms, prompt_tokens, completion_tokens in rows.iterator():
+        item = by_model.setdefault(model_name, {
+            "calls": 0, "failures": 0, "prompt_tokens": 0, "completion_tokens": 0, "latencies": [],
+        })
+        item["calls"] += 1
+        item["failures"] += outcome != OUTCOME_OK
+        item["prompt_tokens"] += prompt_tokens
+        item["completion_tokens"] += completion_tokens
+        item["latencies"].append(latency_ms)
+
+    summary = []
+    for model_name, item in sorted(by_model.items()):
+        latencies = item.pop("latencies")
+        summary.append({
+            "date": day,
+            "model_name": model_name,
+            **item,
+            "latency_p50_ms": percentile(latencies, 0.5),
+            "latency_p95_ms": percentile(latencies, 0.95),
+            "cost": round(cost(model_name, item["prompt_tokens"], item["completion_tokens"]), 4),
+        })
+    return summary
+
+
+def rollup(day):
+    """把某一天的汇总写入 AIUsageDaily（重复执行时覆盖），返回汇总行"""
+    from ..models import AIUsageDaily
+
+    summary = summarize(day)
+    for row in summary:
+        fields = {key: value for key, value in row.items() if key not in ('date', 'model_name')}
+        AIUsageDaily.objects.update_or_create(date=day, model_name=row["model_name"], defaults=fields)
+    return summary
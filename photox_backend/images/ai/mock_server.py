@@ -0,0 +1,249 @@
+"""
+本地模拟的视觉大模型服务
+
+实现分类、描述、风格、情感调用使用的 OpenAI 兼容 POST .../chat/completions 接口，
+按配置的延迟分布等待后返回预设的 JSON，并按比例注入错误，用于在不产生费用的情况下压测上传和分析链路。
+请求带 stream=true 时以 Server-Sent Events 分片返回内容，首个分片在延迟的 STREAM_FIRST_CHUNK_RATIO 处发送。
+由 mock_vision_server 命令启动；把 AI_DASHSCOPE_BASE_URL、AI_QNAIGC_BASE_URL 指向它即可。
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .style_analysis import COMBINED_SYSTEM_PROMPT, EMOTION_SYSTEM_PROMPT, STYLE_SYSTEM_PROMPT
+
+logger = logging.getLogger(__name__)
+
+KIND_CLASSIFY = 'classify'
+KIND_DESCRIPTION = 'description'
+KIND_STYLE = 'style'
+KIND_EMOTION = 'emotion'
+KIND_STYLE_EMOTION = 'style_emotion'
+
+# 流式返回时每个分片的字符数，以及首个分片在总延迟中的位置
+STREAM_CHUNK_CHARS = 8
+STREAM_FIRST_CHUNK_RATIO = 0.2
+
+# 默认返回内容（分类结果按提示词中的 ID 随机生成，见 classification_content；合并调用返回风格和情感两部分）
+DEFAULT_RESPONSES = {
+    KIND_DESCRIPTION: "这是一张构图均衡、光线柔和的照片，主体清晰，背景简洁。",
+    KIND_STYLE: {
+        "art_style": "写实主义",
+        "photography_style": "风景摄影",
+        "color_style": "暖色调",
+        "composition": "三分法",
+        "mood": "宁静",
+        "technique_features": ["浅景深", "自然光"],
+    },
+    KIND_EMOTION: {
+        "primary_emotion": "平静",
+        "secondary_emotions": ["温暖", "怀旧"],
+        "atmosphere": "安静而温暖",
+        "story_hint": "一个慵懒的午后",
+        "viewer_feeling": "放松",
+        "symbolic_elements": ["阳光", "远方"],
+    },
+}
+
+
+class LatencyModel:
+    """
+    响应延迟分布（秒），格式：
+    fixed:0.8、uniform:0.5,2、normal:1.5,0.3（均值, 标准差）、lognormal:1.2,0.5（中位数, 形状参数 sigma）
+    """
+
+    def __init__(self, kind, params, rng=None):
+        self.kind = kind
+        self.params = params
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def parse(cls, spec, rng=None):
+        kind, _, raw = spec.partition(':')
+        try:
+            params = [float(value) for value in raw.split(',') if value.strip()]
+        except ValueError:
+            raise ValueError(f"无效的延迟分布: {spec}")
+        expected = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"无效的延迟分布: {spec}（可用: fixed:s, uniform:a,b, normal:mean,std, lognormal:median,sigma）")
+        return cls(kind, params, rng)
+
+    def sample(self):
+        if self.kind == 'fixed':
+            value = self.params[0]
+        elif self.kind == 'uniform':
+            value = self.rng.uniform(*self.params)
+        elif self.kind == 'normal':
+            value = self.rng.gauss(*self.params)
+        else:
+            median, sigma = self.params
+            value = self.rng.lognormvariate(0, sigma) * median
+        return max(0.0, value)
+
+
+def request_kind(payload):
+    """按系统提示词判断调用类型"""
+    system = next((m.get('content') for m in payload.get('messages', []) if m.get('role') == 'system'), '') or ''
+    if not isinstance(system, str):
+        system = json.dumps(system, ensure_ascii=False)
+    if system == STYLE_SYSTEM_PROMPT:
+        return KIND_STYLE
+    if system == EMOTION_SYSTEM_PROMPT:
+        return KIND_EMOTION
+    if system == COMBINED_SYSTEM_PROMPT:
+        return KIND_STYLE_EMOTION
+    if '分类ID' in system:
+        return KIND_CLASSIFY
+    return KIND_DESCRIPTION
+
+
+def classification_content(system_prompt, rng):
+    """从分类提示词中的类别表和标签表随机选择合法的 ID"""
+    category_ids = [int(i) for i in re.findall(r'^\s*"(\d+)":', system_prompt, re.M)]
+    tag_ids = [int(i) for i in re.findall(r'^(\d+): ', system_prompt, re.M)]
+    return {
+        "category_id": rng.choice(category_ids) if category_ids else 0,
+        "tag_ids": rng.sample(tag_ids, min(len(tag_ids), rng.randint(4, 6))),
+    }
+
+
+class MockVisionServer:
+    """
+    线程化的模拟服务。
+    responses 按调用类型覆盖默认返回内容（字符串原样作为 content，其他值序列化为 JSON）；
+    error_rate 比例的请求返回 error_status。
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, latency=None, error_rate=0.0, error_status=503,
+                 responses=None, seed=None):
+        self.rng = random.Random(seed)
+        self.latency = latency or LatencyModel('fixed', [0.0])
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.responses = {**DEFAULT_RESPONSES, **(responses or {})}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def respond(self, payload):
+        """返回 (状态码, 响应体, 延迟秒数)"""
+        with self._lock:
+            delay = self.latency.sample()
+            failed = self.rng.random() < self.error_rate
+        kind = request_kind(payload)
+        self._count(kind)
+        if failed:
+            self._count('errors')
+            return self.error_status, {"error": {"message": "模拟错误", "type": "mock_error"}}, delay
+
+        content = self.responses.get(kind)
+        if kind == KIND_STYLE_EMOTION and content is None:
+            content = {"style": self.responses[KIND_STYLE], "emotion": self.responses[KIND_EMOTION]}
+        if kind == KIND_CLASSIFY and content is None:
+            system = payload['messages'][0].get('content', '')
+            with self._lock:
+                content = classification_content(system, self.rng)
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        # 粗略估算 token 数（约 4 字节一个 token），供计量和费用统计使用
+        prompt_tokens = len(json.dumps(payload.get('messages', []))) // 4
+        return 200, {
+            "id": f"mock-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get('model', 'mock'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content),
+                      "total_tokens": prompt_tokens + len(content)},
+        }, delay
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    return self._send(404, {"error": {"message": "not found"}})
+                try:
+                    payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                except ValueError:
+                    return self._send(400, {"error": {"message": "invalid json"}})
+                code, body, delay = server.respond(payload)
+                if payload.get('stream') and code == 200:
+                    include_usage = (payload.get('stream_options') or {}).get('include_usage', False)
+                    return self._send_stream(body, delay, include_usage)
+                time.sleep(delay)
+                self._send(code, body)
+
+            def do_GET(self):
+                # 查看各类型的请求数
+                with server._lock:
+                    counts = dict(server.counts)
+                self._send(200, counts)
+
+            def _send(self, code, body):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, body, delay, include_usage=False):
+                content = body['choices'][0]['message']['content']
+                chunks = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                time.sleep(delay * STREAM_FIRST_CHUNK_RATIO)
+                interval = delay * (1 - STREAM_FIRST_CHUNK_RATIO) / max(1, len(chunks) - 1)
+                for index, chunk in enumerate(chunks):
+                    if index:
+                        time.sleep(interval)
+                    event = {"id": body['id'], "object": "chat.completion.chunk", "model": body['model'],
+                             "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                if include_usage:
+                    event = {"id": body['id'], "object": "chat.completion.chunk", "model": body['model'],
+                             "choices": [], "usage": body['usage']}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """在后台线程中运行（测试和进程内压测使用）"""
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
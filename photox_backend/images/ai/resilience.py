@@ -0,0 +1,324 @@
+"""
+视觉大模型调用的容错层
+
+- 熔断：同一端点连续失败 AI_BREAKER_FAILURE_THRESHOLD 次后熔断 AI_BREAKER_RESET_SECONDS 秒，
+  期间直接抛出 CircuitOpenError，不再占用 worker 等待超时；冷却后放行一个探测请求（半开），成功则恢复。
+- 重试：超时、连接错误、429 和 5xx 按指数退避加随机抖动重试，所有尝试共享 AI_CALL_BUDGET_SECONDS 的总时间预算。
+- 对冲：最近延迟样本足够时，请求超过 p95 仍未返回就再发一个相同请求，取先返回的结果，削减长尾延迟；
+  对冲请求在容量为 AI_HTTP_POOL_MAXSIZE 的线程池中排队，主请求总是立即发出。
+
+熔断状态和延迟统计保存在进程内，可通过 /api/v1/images/ai-health/ 查看当前进程的快照。
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# 对冲至少需要的延迟样本数
+HEDGE_MIN_SAMPLES = 20
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+_hedge_pool = None
+
+
+class CircuitOpenError(requests.RequestException):
+    """端点处于熔断状态，请求未发出"""
+
+
+class RetryableStatus(requests.RequestException):
+    """429/5xx 等可重试的响应"""
+
+
+def endpoint_name(url):
+    return urlsplit(url).netloc or url
+
+
+def _percentile(samples, ratio):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+class EndpointHealth:
+    """单个端点的熔断状态和调用统计"""
+
+    def __init__(self, name):
+        self.name = name
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.latencies = deque(maxlen=200)
+        self.counters = {
+            'calls': 0, 'successes': 0, 'failures': 0, 'retries': 0, 'timeouts': 0,
+            'hedges': 0, 'hedge_wins': 0, 'short_circuits': 0, 'slo_violations': 0,
+        }
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """是否放行请求；熔断冷却结束后只放行一个探测请求"""
+        with self.lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= settings.AI_BREAKER_RESET_SECONDS:
+                self.state = STATE_HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == STATE_HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.counters['short_circuits'] += 1
+            return False
+
+    def is_open(self):
+        with self.lock:
+            return self.state == STATE_OPEN and time.monotonic() - self.opened_at < settings.AI_BREAKER_RESET_SECONDS
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def record_success(self, elapsed):
+        with self.lock:
+            self.counters['successes'] += 1
+            self.latencies.append(elapsed)
+            if elapsed > settings.AI_LATENCY_SLO_SECONDS:
+                self.counters['slo_violations'] += 1
+            if self.state != STATE_CLOSED:
+                logger.info(f"端点 {self.name} 探测成功，熔断恢复")
+            self.state = STATE_CLOSED
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self, elapsed, error):
+        with self.lock:
+            self.counters['failures'] += 1
+            if isinstance(error, requests.Timeout):
+                self.counters['timeouts'] += 1
+            self.latencies.append(elapsed)
+            self.consecutive_failures += 1
+            if self.state == STATE_HALF_OPEN or self.consecutive_failures >= settings.AI_BREAKER_FAILURE_THRESHOLD:
+                if self.state != STATE_OPEN:
+                    logger.error(f"端点 {self.name} 连续失败 {self.consecutive_failures} 次，熔断 "
+                                 f"{settings.AI_BREAKER_RESET_SECONDS}s: {str(error)}")
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+
+    def hedge_delay(self):
+        """发出对冲请求前等待的秒数，样本不足或关闭对冲时返回 None"""
+        if not settings.AI_HEDGE_ENABLED:
+            return None
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return max(settings.AI_HEDGE_MIN_DELAY, _percentile(self.latencies, 0.95))
+
+    def snapshot(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            opened_for = time.monotonic() - self.opened_at if self.state == STATE_OPEN else None
+            snapshot = {
+                "endpoint": self.name,
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "open_seconds": round(opened_for, 1) if opened_for is not None else None,
+                **self.counters,
+            }
+        if latencies:
+            snapshot["latency_ms"] = {
+                "p50": round(_percentile(latencies, 0.5) * 1000),
+                "p95": round(_percentile(latencies, 0.95) * 1000),
+                "max": round(max(latencies) * 1000),
+                "samples": len(latencies),
+            }
+        total = snapshot['successes']
+        snapshot["slo_violation_rate"] = round(snapshot['slo_violations'] / total, 3) if total else 0
+        return snapshot
+
+
+def get_health(url):
+    name = endpoint_name(url)
+    health = _endpoints.get(name)
+    if health is None:
+        with _endpoints_lock:
+            health = _endpoints.setdefault(name, EndpointHealth(name))
+    return health
+
+
+def is_open(url):
+    """端点当前是否处于熔断状态（批量任务可据此提前停止）"""
+    return get_health(url).is_open()
+
+
+def health_snapshot():
+    """当前进程所有端点的状态"""
+    return {
+        "pid": os.getpid(),
+        "endpoints": [health.snapshot() for health in list(_endpoints.values())],
+    }
+
+
+def reset():
+    """清空所有端点的状态（测试用）"""
+    with _endpoints_lock:
+        _endpoints.clear()
+
+
+def _get_hedge_pool():
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _endpoints_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=settings.AI_HTTP_POOL_MAXSIZE, thread_name_prefix='ai-hedge')
+    return _hedge_pool
+
+
+def _discard(response):
+    """关闭不再使用的响应，把连接归还连接池（流式响应不读完不会自动归还）"""
+    if response is not None:
+        response.close()
+
+
+def _discard_when_done(future):
+    """落后的请求完成后关闭其响应"""
+    def close(done):
+        if not done.cancelled() and done.exception() is None:
+            _discard(done.result())
+    future.add_done_callback(close)
+
+
+def _start_primary(send, timeout):
+    """
+    立即在单独的线程中发出主请求，返回其 Future。
+    主请求不进入容量有限的对冲线程池，不会排在其他请求的对冲请求后面迟迟发不出去。
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(send(timeout))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='ai-primary', daemon=True).start()
+    return future
+
+
+def _send_hedged(health, send, timeout, remaining):
+    """
+    发送请求；超过对冲延迟仍未返回时再把一个相同请求提交到对冲线程池，返回先成功的响应。
+    主请求有结果时取消尚未开始的对冲请求；对冲请求排队到开始执行时已有结果或已超出预算，则不再发送。
+    已发出的落后请求无法取消，会在后台完成后关闭响应并丢弃。
+    """
+    delay = health.hedge_delay()
+    if delay is None or delay >= remaining:
+        return send(timeout)
+
+    deadline = time.monotonic() + remaining
+    primary = _start_primary(send, timeout)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    settled = threading.Event()
+
+    def send_hedge(attempt_timeout):
+        if settled.is_set() or time.monotonic() >= deadline:
+            return None
+        return send(attempt_timeout)
+
+    health.count('hedges')
+    hedge = _get_hedge_pool().submit(send_hedge, timeout)
+    pending = {primary, hedge}
+    first_error = None
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    _discard_when_done(future)
+                raise requests.Timeout("对冲请求均未在时间预算内返回")
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    first_error = first_error or e
+                    continue
+                if response is None:
+                    # 对冲请求未发送
+                    continue
+                if future is hedge:
+                    health.count('hedge_wins')
+                for other in {primary, hedge} - {future}:
+                    _discard_when_done(other)
+                return response
+        raise first_error or requests.Timeout("对冲请求均未返回响应")
+    finally:
+        settled.set()
+        hedge.cancel()
+
+
+def call(url, send, timeout=None):
+    """
+    通过熔断、重试和对冲调用端点。
+    send(timeout) 发出一次请求并返回 requests.Response；所有重试用完后返回最后一个响应
+    （调用方按原逻辑处理非 200），网络错误时抛出最后一次的异常。
+    """
+    health = get_health(url)
+    connect_timeout, read_timeout = timeout or (settings.AI_HTTP_CONNECT_TIMEOUT, settings.AI_HTTP_READ_TIMEOUT)
+    deadline = time.monotonic() + settings.AI_CALL_BUDGET_SECONDS
+    last_response = None
+    last_error = None
+
+    for attempt in range(1, settings.AI_RETRY_MAX_ATTEMPTS + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not health.allow():
+            raise CircuitOpenError(f"端点 {health.name} 已熔断")
+        if attempt > 1:
+            health.count('retries')
+        health.count('calls')
+
+        started = time.monotonic()
+        try:
+            response = _send_hedged(health, send, (connect_timeout, min(read_timeout, remaining)), remaining)
+            if response.status_code == 429 or response.status_code >= 500:
+                # 只保留最后一个失败响应，之前的关闭以归还连接
+                _discard(last_response)
+                last_response = response
+                raise RetryableStatus(f"HTTP {response.status_code}")
+        except requests.RequestException as e:
+            health.record_failure(time.monotonic() - started, e)
+            last_error = e
+        else:
+            health.record_success(time.monotonic() - started)
+            _discard(last_response)
+            return response
+
+        if attempt == settings.AI_RETRY_MAX_ATTEMPTS:
+            break
+        # 指数退避加全随机抖动，退避后超出预算就不再重试
+        backoff = random.uniform(0, settings.AI_RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+        if time.monotonic() + backoff >= deadline:
+            break
+        logger.warning(f"调用 {health.name} 失败（第 {attempt} 次）: {str(last_error)}，{backoff:.2f}s 后重试")
+        time.sleep(backoff)
+
+    if last_response is not None:
+        return last_response
+    raise last_error or requests.Timeout(f"调用 {health.name} 超出时间预算")
@@ -0,0 +1,159 @@
+"""
+AI 调用结果缓存
+
+同一张图片（按原始字节的 SHA-256）、同一个模型、同一版提示词/词表和同样的预处理参数，
+模型的输出可以直接复用。结果持久化在 AIResultCache 表中，跨进程、跨重启有效；
+条目数超过 AI_RESULT_CACHE_MAX_ENTRIES 时按最近使用时间淘汰。
+命中/未命中次数按调用类型累计在 AIResultCacheStat 表中（多个 worker 进程共享），可用 ai_result_cache 命令查看。
+"""
+import hashlib
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+KIND_CLASSIFY = 'classify'
+KIND_DESCRIPTION = 'description'
+KIND_STYLE = 'style'
+KIND_EMOTION = 'emotion'
+KINDS = [KIND_CLASSIFY, KIND_DESCRIPTION, KIND_STYLE, KIND_EMOTION]
+
+_puts = 0
+_puts_lock = threading.Lock()
+
+
+def fingerprint(text):
+    """提示词等长文本的短指纹，用作缓存键的一部分"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def make_key(kind, content_hash, model_name, params):
+    raw = json.dumps([kind, content_hash, model_name, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _count(kind, name):
+    """累加命中/未命中计数；计数失败不影响缓存本身"""
+    from ..models import AIResultCacheStat
+
+    try:
+        if not AIResultCacheStat.objects.filter(kind=kind).update(**{name: F(name) + 1}):
+            try:
+                with transaction.atomic():
+                    AIResultCacheStat.objects.create(kind=kind, **{name: 1})
+            except IntegrityError:
+                # 并发创建同一类型的计数行
+                AIResultCacheStat.objects.filter(kind=kind).update(**{name: F(name) + 1})
+    except DatabaseError as e:
+        logger.warning(f"更新 AI 结果缓存计数失败: {str(e)}")
+
+
+def get(kind, content_hash, model_name, params=None):
+    """查找缓存结果，命中时更新最近使用时间，未命中返回 None"""
+    from ..models import AIResultCache
+
+    if not settings.AI_RESULT_CACHE_ENABLED or not content_hash:
+        return None
+    key = make_key(kind, content_hash, model_name, params or {})
+    try:
+        entry = AIResultCache.objects.filter(key=key).only('id', 'result').first()
+        if entry is not None:
+            AIResultCache.objects.filter(id=entry.id).update(hit_count=F('hit_count') + 1, last_used_at=timezone.now())
+    except DatabaseError as e:
+        # 缓存只是优化，数据库繁忙（如 SQLite 被锁）时按未命中处理
+        logger.warning(f"读取 AI 结果缓存失败: {str(e)}")
+        entry = None
+    if entry is None:
+        _count(kind, 'misses')
+        return None
+    _count(kind, 'hits')
+    logger.info(f"AI 结果缓存命中: {kind} {content_hash[:12]} ({model_name})")
+    return entry.result
+
+
+def put(kind, content_hash, model_name, result, params=None):
+    """保存结果；定期按 LRU 淘汰超出上限的条目"""
+    global _puts
+    from ..models import AIResultCache
+
+    if not settings.AI_RESULT_CACHE_ENABLED or not content_hash:
+        return
+    params = params or {}
+    key = make_key(kind, content_hash, model_name, params)
+    try:
+        AIResultCache.objects.update_or_create(
+            key=key,
+            defaults={
+                'kind': kind,
+                'content_hash': content_hash,
+                'model_name': model_name,
+                'params': params,
+                'result': result,
+                'last_used_at': timezone.now(),
+            },
+        )
+    except IntegrityError:
+        # 并发写入同一个键，保留先写入的结果
+        return
+    except DatabaseError as e:
+        logger.warning(f"写入 AI 结果缓存失败: {str(e)}")
+        return
+
+    with _puts_lock:
+        _puts += 1
+        should_evict = _puts % settings.AI_RESULT_CACHE_EVICT_EVERY == 0
+    if should_evict:
+        evict()
+
+
+def cached_call(kind, content_hash, model_name, func, params=None, cacheable=None):
+    """
+    先查缓存，未命中时调用 func() 并缓存结果。
+    cacheable(result) 为 False 的结果（如调用失败时的兜底值）不缓存，默认只排除 None。
+    """
+    result = get(kind, content_hash, model_name, params)
+    if result is not None:
+        return result
+    result = func()
+    if result is not None and (cacheable is None or cacheable(result)):
+        put(kind, content_hash, model_name, result, params)
+    return result
+
+
+def evict(max_entries=None):
+    """按最近使用时间淘汰，只保留 max_entries 条，返回删除的条目数"""
+    from ..models import AIResultCache
+
+    if max_entries is None:
+        max_entries = settings.AI_RESULT_CACHE_MAX_ENTRIES
+    stale_ids = list(
+        AIResultCache.objects.order_by('-last_used_at', '-id').values_list('id', flat=True)[max_entries:]
+    )
+    if not stale_ids:
+        return 0
+    deleted, _ = AIResultCache.objects.filter(id__in=stale_ids).delete()
+    logger.info(f"AI 结果缓存淘汰 {deleted} 条")
+    return deleted
+
+
+def stats():
+    """各调用类型的命中/未命中次数"""
+    from ..models import AIResultCacheStat
+
+    counts = {row['kind']: row for row in AIResultCacheStat.objects.values('kind', 'hits', 'misses')}
+    return {
+        kind: {name: counts.get(kind, {}).get(name, 0) for name in ('hits', 'misses')}
+        for kind in KINDS
+    }
+
+
+def reset_stats():
+    from ..models import AIResultCacheStat
+
+    AIResultCacheStat.objects.all().delete()
@@ -1,6 +1,7 @@
-from qiniu import Auth, put_file, BucketManager, urlsafe_base64_encode
+from qiniu import Auth, put_file, put_data, BucketManager, urlsafe_base64_encode
 import requests
 import time
+from django.conf import settings
 import hmac
 import hashlib
 from urllib.parse import quote
@@ -37,7 +38,19 @@ def upload_and_set_metadata(access_key,secret_key,bucket_name, file_path, key):
     if not ret or ret.get('key') != key:
         print("文件上传失败:", info.text_body)
         return None
-    base_url = 'http://syahnegzj.hn-bkt.clouddn.com'
+    base_url = settings.QINIU_IMAGE_DOMAIN
+    return f'{base_url}/{key}'
+
+
+def upload_data_and_set_metadata(access_key, secret_key, bucket_name, data, key):
+    """直接上传内存中的字节数据，无需先写入临时文件"""
+    q = Auth(access_key, secret_key)
+    token = q.upload_token(bucket_name, key, 3600)
+    ret, info = put_data(token, key, data)
+    if not ret or ret.get('key') != key:
+        print("文件上传失败:", info.text_body)
+        return None
+    base_url = settings.QINIU_IMAGE_DOMAIN
     return f'{base_url}/{key}'
 
 
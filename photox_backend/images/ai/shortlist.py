@@ -0,0 +1,156 @@
+"""
+分类提示词的候选标签预筛选
+
+image_classification 的系统提示词默认包含完整的类别表和 Tag 表，提示词长度（延迟和费用）随标签数线性增长。
+开启 AI_TAG_SHORTLIST_ENABLED 后，先用本地 ImageNet 模型（local_model.py）取 top-5 预测，
+再按以下两种映射给类别和标签打分，只把得分最高的候选放进提示词：
+- 种子映射：ai_image.GENERIC_CATEGORIES 的关键词把 ImageNet 标签归到通用类别，再对应到 classes.txt 的类别及相关标签；
+- 学习映射：build_tag_shortlist_map 命令根据已分类图片统计出的“ImageNet 标签 -> 类别/标签”共现概率。
+本地模型不可用或预测没有任何信号时不使用候选，调用方回退到完整词表。
+"""
+import json
+import logging
+import os
+from collections import Counter
+
+from django.conf import settings
+
+from . import local_model
+
+logger = logging.getLogger(__name__)
+
+# ai_image.GENERIC_CATEGORIES 中的通用类别 -> classes.txt 中的类别名称
+CATEGORY_ALIASES = {
+    '动物': '动物',
+    '人物': '人物肖像',
+    '风景': '风景',
+    '交通工具': '交通工具',
+    '植物': '植物花卉',
+    '电子设备': '电子产品',
+    '食物': '食品',
+}
+
+# 各类别相关的标签名称（只使用 Tag 表中存在的）
+CATEGORY_TAGS = {
+    '动物': ['动物', '宠物', '猫', '狗', '野生动物', '昆虫', '海洋生物', '宠物活动', '自然'],
+    '人物肖像': ['自拍', '团体', '婴儿', '儿童', '老人', '微笑', '家庭', '家庭聚会', '休闲'],
+    '风景': ['风景', '自然', '山脉', '海滩', '湖泊', '河流', '森林', '沙漠', '岛屿', '海洋', '天空', '云朵', '日落', '旅行'],
+    '交通工具': ['交通工具', '交通', '汽车', '自行车', '飞机', '火车', '船只', '公路旅行', '街道'],
+    '植物花卉': ['植物', '花', '森林', '公园', '自然', '落叶'],
+    '电子产品': ['电子设备', '办公室', '工作', '工作场景', '游戏场景'],
+    '食品': ['美食', '食物', '饮料', '餐厅', '派对', '野餐'],
+}
+
+# 与画面主体无关、ImageNet 标签无法提示的场景类标签，总是保留在候选中
+CONTEXT_TAGS = ['室内', '户外', '白天', '夜晚', '城市景观', '城市生活']
+
+# 种子映射相对学习映射的权重
+SEED_WEIGHT = 0.5
+
+_learned = {}
+
+
+class Shortlist:
+    """进入提示词的候选类别和标签 ID"""
+
+    def __init__(self, category_ids, tag_ids, predictions=None):
+        self.category_ids = category_ids
+        self.tag_ids = tag_ids
+        self.predictions = predictions or []
+
+    def __repr__(self):
+        return f"Shortlist({len(self.category_ids)} 个类别, {len(self.tag_ids)} 个标签)"
+
+
+def enabled():
+    return settings.AI_TAG_SHORTLIST_ENABLED
+
+
+def load_learned_map(path=None):
+    """学习映射 {"labels": {ImageNet 标签: {"categories": {名称: 概率}, "tags": {名称: 概率}}}}，文件未修改时复用"""
+    path = path or settings.AI_TAG_SHORTLIST_MAP_PATH
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    cached = _learned.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            labels = json.load(f).get('labels', {})
+    except (OSError, ValueError) as e:
+        logger.error(f"读取标签预筛选映射失败: {str(e)}")
+        labels = {}
+    _learned[path] = (mtime, labels)
+    return labels
+
+
+def config_fingerprint():
+    """影响预筛选结果的配置，作为分类结果缓存键的一部分；未开启时返回 None"""
+    if not enabled():
+        return None
+    try:
+        mtime = int(os.path.getmtime(settings.AI_TAG_SHORTLIST_MAP_PATH))
+    except OSError:
+        mtime = 0
+    return (f"{local_model.fingerprint()}:{settings.AI_CATEGORY_SHORTLIST_SIZE}:"
+            f"{settings.AI_TAG_SHORTLIST_SIZE}:{mtime}")
+
+
+def generic_category(label):
+    """按 ai_image.GENERIC_CATEGORIES 的关键词把 ImageNet 标签归到通用类别"""
+    from ai_image import get_generic_category
+    return get_generic_category(label)
+
+
+def score_candidates(predictions, vocabulary, learned=None):
+    """
+    按种子映射和学习映射给词表中的类别、标签打分。
+    返回 ([(类别ID, 得分), ...], [(标签ID, 得分), ...])，均按得分从高到低排列。
+    """
+    learned = load_learned_map() if learned is None else learned
+    category_scores = Counter()
+    tag_scores = Counter()
+    for label, prob in predictions:
+        entry = learned.get(label)
+        if entry:
+            for name, p in entry.get('categories', {}).items():
+                category_scores[name] += prob * p
+            for name, p in entry.get('tags', {}).items():
+                tag_scores[name] += prob * p
+        category = CATEGORY_ALIASES.get(generic_category(label))
+        if category:
+            category_scores[category] += prob * SEED_WEIGHT
+            for name in CATEGORY_TAGS.get(category, []):
+                tag_scores[name] += prob * SEED_WEIGHT
+
+    category_ids_by_name = {name: category_id for category_id, name in vocabulary.category_map.items()}
+    tag_ids_by_name = {name: tag_id for tag_id, name in vocabulary.tag_map.items()}
+    categories = [(category_ids_by_name[name], score) for name, score in category_scores.most_common()
+                  if name in category_ids_by_name]
+    tags = [(tag_ids_by_name[name], score) for name, score in tag_scores.most_common() if name in tag_ids_by_name]
+    return categories, tags
+
+
+def build_shortlist(predictions, vocabulary, category_k=None, tag_k=None, learned=None):
+    """根据本地模型的 [(ImageNet 标签, 概率), ...] 生成候选；没有任何信号时返回 None"""
+    category_k = category_k or settings.AI_CATEGORY_SHORTLIST_SIZE
+    tag_k = tag_k or settings.AI_TAG_SHORTLIST_SIZE
+    scored_categories, scored_tags = score_candidates(predictions, vocabulary, learned)
+    categories = [category_id for category_id, _ in scored_categories[:category_k]]
+    tags = [tag_id for tag_id, _ in scored_tags[:tag_k]]
+    if not categories and not tags:
+        return None
+
+    # “其他”类别和场景类标签总是保留
+    fallback_id = min(vocabulary.category_map) if vocabulary.category_map else 0
+    if fallback_id not in categories:
+        categories.append(fallback_id)
+    tag_ids_by_name = {name: tag_id for tag_id, name in vocabulary.tag_map.items()}
+    for name in CONTEXT_TAGS:
+        tag_id = tag_ids_by_name.get(name)
+        if tag_id is not None and tag_id not in tags:
+            tags.append(tag_id)
+    return Shortlist(sorted(categories), sorted(tags), predictions)
+
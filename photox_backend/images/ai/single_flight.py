@@ -0,0 +1,76 @@
+"""
+同一张图片同一种分析的并发请求合并（single-flight）
+
+多个请求同时对一张图片执行同一种分析时（如重复点击“分析”、多人同时打开新发布的公开图片），
+只有取得租约的请求（leader）下载原图并调用模型，其他请求（follower）等待 leader 的结果。
+租约保存在数据库的 AIAnalysisLease 表中，多个 worker 进程共享，不依赖缓存后端是否支持原子操作：
+- (image, kind) 唯一约束保证只有一个请求插入成功；已过期或已释放的租约用带条件的 UPDATE 接管，同样只有一个请求成功；
+- leader 完成后把结果写入租约行并标记为已释放；
+- follower 轮询租约行，已释放时直接返回其中的结果；
+- leader 进程崩溃时租约在 AI_SINGLE_FLIGHT_LEASE_SECONDS 后过期，等待中的 follower 接管并自行调用模型。
+"""
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def acquire(image_id, kind):
+    """尝试取得租约，成功时返回令牌，已有其他请求持有时返回 None（关闭合并时总是成功）"""
+    from ..models import AIAnalysisLease
+
+    token = uuid.uuid4().hex
+    if not settings.AI_SINGLE_FLIGHT_ENABLED:
+        return token
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.AI_SINGLE_FLIGHT_LEASE_SECONDS)
+    try:
+        with transaction.atomic():
+            AIAnalysisLease.objects.create(image_id=image_id, kind=kind, token=token, expires_at=expires_at)
+        return token
+    except IntegrityError:
+        pass
+    taken = AIAnalysisLease.objects.filter(image_id=image_id, kind=kind).filter(
+        Q(released=True) | Q(expires_at__lte=now)
+    ).update(token=token, expires_at=expires_at, released=False, result=None)
+    return token if taken else None
+
+
+def release(image_id, kind, token, outcome):
+    """保存 leader 的结果供 follower 读取并释放租约（租约已过期并被接管时不覆盖新租约）"""
+    from ..models import AIAnalysisLease
+
+    if not settings.AI_SINGLE_FLIGHT_ENABLED:
+        return
+    AIAnalysisLease.objects.filter(image_id=image_id, kind=kind, token=token).update(released=True, result=outcome)
+
+
+def wait(image_id, kind):
+    """
+    等待当前 leader 的结果，返回 (结果, None)；
+    租约过期或已被删除时接管租约，返回 (None, 新令牌)，调用方应自行执行分析并 release。
+    超过 AI_SINGLE_FLIGHT_WAIT_SECONDS 仍无结果时返回带 error 的结果。
+    """
+    from ..models import AIAnalysisLease
+
+    deadline = time.monotonic() + settings.AI_SINGLE_FLIGHT_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        lease = AIAnalysisLease.objects.filter(image_id=image_id, kind=kind).values(
+            'released', 'result', 'expires_at'
+        ).first()
+        if lease is not None and lease['released']:
+            return lease['result'], None
+        if lease is None or lease['expires_at'] <= timezone.now():
+            new_token = acquire(image_id, kind)
+            if new_token is not None:
+                logger.info(f"图片 {image_id} 的 {kind} 分析租约已失效，接管执行")
+                return None, new_token
+        time.sleep(settings.AI_SINGLE_FLIGHT_POLL_SECONDS)
+    return {"result": None, "error": "等待其他请求的分析结果超时"}, None
@@ -1,56 +1,133 @@
-import requests
 import base64
-from PIL import Image
-import io
+import json
 import logging
 
+import requests
+
+from . import client
+from .decode import prepare_payload
+
 logger = logging.getLogger(__name__)
 
-def analyze_image_style(image_path, api_key):
-    """分析图片的艺术风格和摄影风格"""
+# 风格/情感分析使用的模型和提示词
+STYLE_MODEL = "qwen2.5-vl-7b-instruct"
+# 预处理参数（最长边、JPEG 质量）
+STYLE_MAX_SIZE = 1024
+STYLE_QUALITY = 85
+
+STYLE_SYSTEM_PROMPT = "你是一个专业的图像风格分析师，精通各种艺术流派和摄影风格。"
+STYLE_PROMPT = """请分析这张图片的风格特征，返回JSON格式：
+{
+    "art_style": "艺术风格（如：写实主义、印象派、抽象派、超现实主义、极简主义等）",
+    "photography_style": "摄影风格（如：人像摄影、风景摄影、街头摄影、纪实摄影、艺术摄影等）",
+    "color_style": "色彩风格（如：暖色调、冷色调、高对比度、低饱和度、黑白等）",
+    "composition": "构图方式（如：三分法、对称构图、引导线、框架构图等）",
+    "mood": "情感氛围（如：宁静、活力、忧郁、神秘、温馨等）",
+    "technique_features": ["特殊技法1", "特殊技法2"]
+}"""
+
+EMOTION_SYSTEM_PROMPT = "你是一个情感分析专家，擅长解读图像传达的情感和意境。"
+EMOTION_PROMPT = """请深入分析这张图片的情感层面，返回JSON格式：
+{
+    "primary_emotion": "主要情感",
+    "secondary_emotions": ["次要情感1", "次要情感2"],
+    "atmosphere": "整体氛围描述",
+    "story_hint": "图片可能讲述的故事",
+    "viewer_feeling": "观看者可能产生的感受",
+    "symbolic_elements": ["象征元素1", "象征元素2"]
+}"""
+
+# 风格和情感合并为一次调用时的提示词：同一个 JSON 中分别返回两部分，结构与单独调用相同
+COMBINED_SYSTEM_PROMPT = "你是一个专业的图像风格分析师和情感分析专家，精通各种艺术流派和摄影风格，擅长解读图像传达的情感和意境。"
+COMBINED_PROMPT = """请同时分析这张图片的风格特征和情感层面，只返回一个JSON对象，格式如下：
+{
+    "style": {
+        "art_style": "艺术风格（如：写实主义、印象派、抽象派、超现实主义、极简主义等）",
+        "photography_style": "摄影风格（如：人像摄影、风景摄影、街头摄影、纪实摄影、艺术摄影等）",
+        "color_style": "色彩风格（如：暖色调、冷色调、高对比度、低饱和度、黑白等）",
+        "composition": "构图方式（如：三分法、对称构图、引导线、框架构图等）",
+        "mood": "情感氛围（如：宁静、活力、忧郁、神秘、温馨等）",
+        "technique_features": ["特殊技法1", "特殊技法2"]
+    },
+    "emotion": {
+        "primary_emotion": "主要情感",
+        "secondary_emotions": ["次要情感1", "次要情感2"],
+        "atmosphere": "整体氛围描述",
+        "story_hint": "图片可能讲述的故事",
+        "viewer_feeling": "观看者可能产生的感受",
+        "symbolic_elements": ["象征元素1", "象征元素2"]
+    }
+}"""
+
+# 两种结果的字段：(文本字段, 列表字段)
+STYLE_SCHEMA = (
+    ("art_style", "photography_style", "color_style", "composition", "mood"),
+    ("technique_features",),
+)
+EMOTION_SCHEMA = (
+    ("primary_emotion", "atmosphere", "story_hint", "viewer_feeling"),
+    ("secondary_emotions", "symbolic_elements"),
+)
+
+
+def validate_analysis(data, schema):
+    """
+    按字段表校验模型返回的风格/情感结果：文本字段必须都有，列表字段缺失时为空列表、单个字符串转为列表，
+    多余的字段丢弃。不合格时返回 None。
+    """
+    if not isinstance(data, dict):
+        return None
+    text_fields, list_fields = schema
+    result = {}
+    for field in text_fields:
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None
+        result[field] = value.strip()
+    for field in list_fields:
+        value = data.get(field) or []
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list):
+            return None
+        result[field] = [str(item) for item in value if item]
+    return result
+
+
+
+def prepare_image(image_path):
+    """预处理图片：缩小解码、摆正方向，按最长边缩放后编码为 JPEG 字节"""
+    return prepare_payload(image_path, STYLE_MAX_SIZE, STYLE_QUALITY)
+
+
+def analyze_image_style(image_path, api_key, image_bytes=None):
+    """
+    分析图片的艺术风格和摄影风格（image_path 也可以是内存中的文件对象）
+    :param image_bytes: 已预处理好的 JPEG 字节，传入时跳过读取和预处理 image_path
+    """
     try:
         # 预处理图片
-        img = Image.open(image_path)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # 调整大小
-        max_size = 1024
-        width, height = img.size
-        if max(width, height) > max_size:
-            ratio = max_size / max(width, height)
-            new_size = (int(width * ratio), int(height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
+        if image_bytes is None:
+            image_bytes = prepare_image(image_path)
         
         # 转换为base64
-        byte_arr = io.BytesIO()
-        img.save(byte_arr, format='JPEG', quality=85)
-        image_bytes = byte_arr.getvalue()
         encoded_image = base64.b64encode(image_bytes).decode("utf-8")
         image_data_url = f"data:image/jpeg;base64,{encoded_image}"
         
         # 构建请求
         payload = {
-            "model": "qwen2.5-vl-7b-instruct",
+            "model": STYLE_MODEL,
             "messages": [
                 {
                     "role": "system",
-                    "content": "你是一个专业的图像风格分析师，精通各种艺术流派和摄影风格。"
+                    "content": STYLE_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
                     "content": [
                         {
                             "type": "text",
-                            "text": """请分析这张图片的风格特征，返回JSON格式：
-{
-    "art_style": "艺术风格（如：写实主义、印象派、抽象派、超现实主义、极简主义等）",
-    "photography_style": "摄影风格（如：人像摄影、风景摄影、街头摄影、纪实摄影、艺术摄影等）",
-    "color_style": "色彩风格（如：暖色调、冷色调、高对比度、低饱和度、黑白等）",
-    "composition": "构图方式（如：三分法、对称构图、引导线、框架构图等）",
-    "mood": "情感氛围（如：宁静、活力、忧郁、神秘、温馨等）",
-    "technique_features": ["特殊技法1", "特殊技法2"]
-}"""
+                            "text": STYLE_PROMPT
                         },
                         {
                             "type": "image_url",
@@ -61,17 +138,7 @@ def analyze_image_style(image_path, api_key):
             ]
         }
         
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            "https://api.qnaigc.com/v1/chat/completions",
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
+        response = client.post_chat(client.qnaigc_chat_url(), api_key, payload, kind='style')
         
         if response.status_code == 200:
             result = response.json()
@@ -97,48 +164,27 @@ def analyze_image_style(image_path, api_key):
         return None
 
 
-def analyze_image_emotion(image_path, api_key):
-    """分析图片的情感和意境"""
+def analyze_image_emotion(image_path, api_key, image_bytes=None):
+    """分析图片的情感和意境（参数同 analyze_image_style）"""
     try:
-        # 预处理图片（同上）
-        img = Image.open(image_path)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        max_size = 1024
-        width, height = img.size
-        if max(width, height) > max_size:
-            ratio = max_size / max(width, height)
-            new_size = (int(width * ratio), int(height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
-        byte_arr = io.BytesIO()
-        img.save(byte_arr, format='JPEG', quality=85)
-        image_bytes = byte_arr.getvalue()
+        if image_bytes is None:
+            image_bytes = prepare_image(image_path)
         encoded_image = base64.b64encode(image_bytes).decode("utf-8")
         image_data_url = f"data:image/jpeg;base64,{encoded_image}"
         
         payload = {
-            "model": "qwen2.5-vl-7b-instruct",
+            "model": STYLE_MODEL,
             "messages": [
                 {
                     "role": "system",
-                    "content": "你是一个情感分析专家，擅长解读图像传达的情感和意境。"
+                    "content": EMOTION_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
                     "content": [
                         {
                             "type": "text",
-                            "text": """请深入分析这张图片的情感层面，返回JSON格式：
-{
-    "primary_emotion": "主要情感",
-    "secondary_emotions": ["次要情感1", "次要情感2"],
-    "atmosphere": "整体氛围描述",
-    "story_hint": "图片可能讲述的故事",
-    "viewer_feeling": "观看者可能产生的感受",
-    "symbolic_elements": ["象征元素1", "象征元素2"]
-}"""
+                            "text": EMOTION_PROMPT
                         },
                         {
                             "type": "image_url",
@@ -149,17 +195,7 @@ def analyze_image_emotion(image_path, api_key):
             ]
         }
         
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            "https://api.qnaigc.com/v1/chat/completions",
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
+        response = client.post_chat(client.qnaigc_chat_url(), api_key, payload, kind='emotion')
         
         if response.status_code == 200:
             result = response.json()
@@ -180,4 +216,47 @@ def analyze_image_emotion(image_path, api_key):
         
     except Exception as e:
         logger.error(f"Emotion analysis failed: {str(e)}")
-        return None 
\ No newline at end of file
+        return None 
+
+
+def analyze_image_style_emotion(image_path, api_key, image_bytes=None):
+    """
+    一次调用同时分析风格和情感（参数同 analyze_image_style）。
+    返回 (风格结果, 情感结果)，某一部分不符合字段表时对应位置为 None，由调用方回退到单独调用；
+    请求失败（网络错误、超时、熔断、非 200 响应）时抛出异常，单独调用同样会失败，调用方不应回退。
+    """
+    if image_bytes is None:
+        image_bytes = prepare_image(image_path)
+    encoded_image = base64.b64encode(image_bytes).decode("utf-8")
+    image_data_url = f"data:image/jpeg;base64,{encoded_image}"
+
+    payload = {
+        "model": STYLE_MODEL,
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": COMBINED_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": COMBINED_PROMPT},
+                    {"type": "image_url", "image_url": {"url": image_data_url}}
+                ]
+            }
+        ]
+    }
+
+    response = client.post_chat(client.qnaigc_chat_url(), api_key, payload, kind='style_emotion')
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Combined style analysis failed: {response.status_code}", response=response)
+
+    try:
+        content = response.json()['choices'][0]['message']['content']
+        start = content.find('{')
+        end = content.rfind('}') + 1
+        data = json.loads(content[start:end]) if start != -1 and end != 0 else {}
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        logger.error(f"Failed to parse combined style analysis: {str(e)}")
+        return None, None
+    if not isinstance(data, dict):
+        data = {}
+    return validate_analysis(data.get('style'), STYLE_SCHEMA), validate_analysis(data.get('emotion'), EMOTION_SCHEMA)
@@ -0,0 +1,154 @@
+"""
+分类器使用的词表缓存
+
+类别映射（classes.txt）、标签映射（Tag 表）以及据此渲染好的提示词片段在每个进程内只构建一次。
+数据库的 VocabularyVersion 表中保存一个全局版本号（不依赖缓存后端，多个 worker 进程和多台机器都能看到），
+Tag 的 post_save/post_delete 信号和标签导入都会更新它，各 worker 每次取词表时读一次版本号（一次主键查询），
+发现版本号变化（或 classes.txt 被修改）时才重新构建。
+
+本模块在应用加载阶段会被 tags.signals 导入，不能在模块级导入 ai_classify（其导入时会调用 django.setup()）。
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import DatabaseError, transaction
+
+logger = logging.getLogger(__name__)
+
+VERSION_ROW_ID = 1
+
+_vocabularies = {}
+_model_maps = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def current_version():
+    """当前词表版本号；还没有更新过时为 0，数据库不可用时返回 None（不复用已缓存的词表）"""
+    from tags.models import VocabularyVersion
+
+    try:
+        version = VocabularyVersion.objects.filter(id=VERSION_ROW_ID).values_list('version', flat=True).first()
+    except DatabaseError as e:
+        logger.error(f"读取词表版本号失败: {str(e)}")
+        return None
+    return version or 0
+
+
+def bump_version():
+    """
+    标记词表已变化。在事务中调用时等事务提交后再更新版本号，
+    避免其他 worker 在提交前按新版本号缓存了旧数据。
+    """
+    if getattr(_local, 'batch_depth', 0):
+        _local.batch_dirty = True
+        return
+    transaction.on_commit(_set_new_version)
+
+
+def _set_new_version():
+    from tags.models import VocabularyVersion
+
+    version = time.time_ns()
+    VocabularyVersion.objects.update_or_create(id=VERSION_ROW_ID, defaults={'version': version})
+    logger.info(f"词表版本已更新: {version}")
+
+
+@contextmanager
+def batch_update():
+    """批量导入标签时只在结束后更新一次版本号，而不是每行一次"""
+    _local.batch_depth = getattr(_local, 'batch_depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.batch_depth -= 1
+        if not _local.batch_depth and getattr(_local, 'batch_dirty', False):
+            _local.batch_dirty = False
+            bump_version()
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class Vocabulary:
+    """某个版本的类别/标签词表及渲染好的提示词片段"""
+
+    def __init__(self, version, classes_file, classes_mtime, category_map, tag_map, tag_list_str):
+        self.version = version
+        self.classes_file = classes_file
+        self.classes_mtime = classes_mtime
+        self.category_map = category_map
+        self.tag_map = tag_map
+        self.tag_list_str = tag_list_str
+        self._prompt = None
+        self._fingerprint = None
+
+    @property
+    def classification_prompt(self):
+        """分类系统提示词，同一版本只渲染一次"""
+        if self._prompt is None:
+            from .ai_classify import build_classification_prompt
+            self._prompt = build_classification_prompt(self.category_map, self.tag_list_str)
+        return self._prompt
+
+    def prompt_for(self, shortlist=None):
+        """分类系统提示词；给定预筛选候选时只包含候选类别和标签"""
+        if shortlist is None:
+            return self.classification_prompt
+        from .ai_classify import build_classification_prompt
+        category_map = {i: self.category_map[i] for i in shortlist.category_ids if i in self.category_map}
+        tag_list_str = "\n".join(f"{i}: {self.tag_map[i]}" for i in shortlist.tag_ids if i in self.tag_map)
+        return build_classification_prompt(category_map, tag_list_str)
+
+    @property
+    def fingerprint(self):
+        """提示词内容的指纹：词表内容不变时保持不变，用作分类结果缓存键的一部分"""
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha256(self.classification_prompt.encode('utf-8')).hexdigest()[:16]
+        return self._fingerprint
+
+
+def get_vocabulary(classes_file="classes.txt"):
+    """获取当前版本的词表，版本号或 classes.txt 变化时重新构建"""
+    version = current_version()
+    classes_mtime = _mtime(classes_file)
+    vocabulary = _vocabularies.get(classes_file)
+    if vocabulary and version is not None and vocabulary.version == version and vocabulary.classes_mtime == classes_mtime:
+        return vocabulary
+
+    with _lock:
+        vocabulary = _vocabularies.get(classes_file)
+        if vocabulary and version is not None and vocabulary.version == version \
+                and vocabulary.classes_mtime == classes_mtime:
+            return vocabulary
+
+        from .ai_classify import load_category_map, get_tags_from_database
+        category_map = load_category_map(classes_file)
+        tag_map, tag_list_str, from_database = get_tags_from_database(with_source=True)
+        vocabulary = Vocabulary(version, classes_file, classes_mtime, category_map, tag_map, tag_list_str)
+        # 数据库读取失败时使用的是默认标签，不缓存，下次调用重试
+        if from_database and version is not None:
+            _vocabularies[classes_file] = vocabulary
+            logger.info(f"词表已重建: 版本 {version}, {len(category_map)} 个类别, {len(tag_map)} 个标签")
+        return vocabulary
+
+
+def get_model_map(model_file="model.txt"):
+    """model.txt 的解析结果，文件未修改时复用"""
+    mtime = _mtime(model_file)
+    cached = _model_maps.get(model_file)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    from .ai_classify import load_model_map
+    model_map = load_model_map(model_file)
+    _model_maps[model_file] = (mtime, model_map)
+    return model_map
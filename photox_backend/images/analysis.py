@@ -0,0 +1,404 @@
+# images/analysis.py
+"""
+对已入库图片执行 AI 分析（分类、描述、风格、情感）
+
+一次请求中原图最多下载一次、解码一次，各分析按 (最长边, 质量) 共用同一份缩放后的 JPEG；
+未命中结果缓存的模型调用在线程池中并发执行，每个结果返回后立即写库，
+总耗时取决于最慢的一次调用而不是各次调用之和。
+风格和情感都需要调用模型时（AI_STYLE_COMBINED 开启）合并为一次调用，某一部分无效时再单独调用该部分。
+工作线程只发 HTTP 请求，缓存读写和落库都在调用线程中完成。
+同一张图片同一种分析的并发请求只有一个调用模型，其他请求等待它的结果。
+描述还可以通过 stream_description 以 Server-Sent Events 流式返回，模型输出的片段到达后立即转发给客户端。
+"""
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from .ai import client as ai_client
+from .ai import result_cache
+from .ai import metering, single_flight
+from .ai.ai_classify import CLASSIFY_MODEL, CLASSIFY_MAX_SIZE, CLASSIFY_QUALITY
+from .ai.decode import PAYLOAD_VERSION, DecodedImage
+from .ai.description import (
+    generate_image_description, stream_image_description, clean_description, resolve_model_name, DESCRIPTION_PROMPT,
+)
+from .ai.style_analysis import (
+    analyze_image_style, analyze_image_emotion, analyze_image_style_emotion, STYLE_MODEL, STYLE_MAX_SIZE,
+    STYLE_QUALITY, STYLE_SYSTEM_PROMPT, STYLE_PROMPT, EMOTION_SYSTEM_PROMPT, EMOTION_PROMPT,
+    COMBINED_SYSTEM_PROMPT, COMBINED_PROMPT, STYLE_SCHEMA, EMOTION_SCHEMA, validate_analysis,
+)
+from .ai.vocabulary import get_vocabulary
+from .ingest import classification_fields, classification_params, classify_jpeg
+from .models import Image
+from .variants import smallest_variant_url
+
+logger = logging.getLogger(__name__)
+
+# 描述使用 model.txt 中的第 3 个模型
+DESCRIPTION_MODEL_ID = 3
+
+
+class Analysis:
+    """一种 AI 分析：缓存键的组成、模型调用方式以及结果写回 Image 的哪些字段"""
+    name = ''
+    kind = ''
+    max_size = 1024
+    quality = 85
+
+    def model_name(self):
+        raise NotImplementedError
+
+    def params(self):
+        """除内容哈希和模型外影响输出的参数（提示词指纹、预处理参数）"""
+        return {"max_size": self.max_size, "quality": self.quality, "payload": PAYLOAD_VERSION}
+
+    def call(self, jpeg):
+        """用预处理好的 JPEG 字节调用模型（在工作线程中执行，不能访问数据库）"""
+        raise NotImplementedError
+
+    def cacheable(self, result):
+        return result is not None and 'error' not in result
+
+    def stored(self, image):
+        """图片上已保存的结果，没有时返回 None"""
+        raise NotImplementedError
+
+    def fields(self, result):
+        """结果对应的 Image 字段，结果无效时返回空字典（不写库）"""
+        raise NotImplementedError
+
+
+class ClassifyAnalysis(Analysis):
+    name = 'classify'
+    kind = result_cache.KIND_CLASSIFY
+    max_size = CLASSIFY_MAX_SIZE
+    quality = CLASSIFY_QUALITY
+
+    def __init__(self):
+        # 词表在调用线程中读取，工作线程复用进程内缓存，不再查询数据库
+        self.vocabulary = get_vocabulary("ai/classes.txt")
+
+    def model_name(self):
+        return CLASSIFY_MODEL
+
+    def params(self):
+        return classification_params(self.vocabulary)
+
+    def call(self, jpeg):
+        return classify_jpeg(jpeg, self.vocabulary)
+
+    def stored(self, image):
+        tags = image.get_tags_as_list()
+        if image.category_id is None or not tags:
+            return None
+        return {"category_id": image.category_id, "tags": tags}
+
+    def fields(self, result):
+        if 'error' in result:
+            return {}
+        return classification_fields(result)
+
+
+class DescriptionAnalysis(Analysis):
+    name = 'description'
+    kind = result_cache.KIND_DESCRIPTION
+
+    def model_name(self):
+        return resolve_model_name(DESCRIPTION_MODEL_ID)
+
+    def params(self):
+        return {"prompt": result_cache.fingerprint(DESCRIPTION_PROMPT), **super().params()}
+
+    def call(self, jpeg):
+        return generate_image_description(None, settings.QNAIGC_API_KEY, DESCRIPTION_MODEL_ID, image_bytes=jpeg)
+
+    def stored(self, image):
+        return {"description": image.ai_description} if image.ai_description else None
+
+    def fields(self, result):
+        # 调用失败时的提示文字不写入图片，下次请求重新生成
+        if 'error' in result:
+            return {}
+        return {'ai_description': result['description']}
+
+
+class StyleAnalysis(Analysis):
+    name = 'style'
+    kind = result_cache.KIND_STYLE
+    max_size = STYLE_MAX_SIZE
+    quality = STYLE_QUALITY
+    field = 'ai_style_analysis'
+    prompt = STYLE_SYSTEM_PROMPT + STYLE_PROMPT
+    # 单独调用的结果与合并调用按同一字段表校验
+    schema = STYLE_SCHEMA
+
+    def model_name(self):
+        return STYLE_MODEL
+
+    def params(self):
+        prompt = self.prompt
+        if settings.AI_STYLE_COMBINED:
+            # 结果可能来自合并调用，提示词指纹同时包含合并提示词
+            prompt += COMBINED_SYSTEM_PROMPT + COMBINED_PROMPT
+        return {**super().params(), "prompt": result_cache.fingerprint(prompt)}
+
+    def call(self, jpeg):
+        return validate_analysis(analyze_image_style(None, settings.DASHSCOPE_API_KEY, image_bytes=jpeg), self.schema)
+
+    def stored(self, image):
+        return getattr(image, self.field) or None
+
+    def fields(self, result):
+        return {self.field: result} if result else {}
+
+
+class EmotionAnalysis(StyleAnalysis):
+    name = 'emotion'
+    kind = result_cache.KIND_EMOTION
+    field = 'ai_emotion_analysis'
+    prompt = EMOTION_SYSTEM_PROMPT + EMOTION_PROMPT
+    schema = EMOTION_SCHEMA
+
+    def call(self, jpeg):
+        return validate_analysis(analyze_image_emotion(None, settings.DASHSCOPE_API_KEY, image_bytes=jpeg), self.schema)
+
+
+ANALYSES = {
+    'classify': ClassifyAnalysis,
+    'description': DescriptionAnalysis,
+    'style': StyleAnalysis,
+    'emotion': EmotionAnalysis,
+}
+
+
+def download_original(image):
+    """通过共享连接池下载原图字节"""
+    resp = ai_client.get_session().get(image.image_url, timeout=ai_client.default_timeout())
+    resp.raise_for_status()
+    return resp.content
+
+
+def download_thumbnail(image):
+    """下载最小的派生图片（没有时下载原图），供本地模型等只需要小图的场景使用"""
+    url = smallest_variant_url(image.variants) or image.image_url
+    resp = ai_client.get_session().get(url, timeout=ai_client.default_timeout())
+    resp.raise_for_status()
+    return resp.content
+
+
+def run_analyses(image, names, force=False):
+    """
+    执行指定的分析并把结果写回 image。
+    force 为 False 时已保存过结果的分析直接返回已有结果。
+    其他请求正在对同一张图片执行同一种分析时，等待并复用它的结果（见 ai/single_flight.py）。
+    返回 {name: {"source": "stored"|"cache"|"model"|"shared", "result": ..., "error": ...}}
+    """
+    outcomes = {}
+    analyses = [ANALYSES[name]() for name in names]
+
+    pending = []
+    followers = []
+    leases = {}
+    for analysis in analyses:
+        stored = None if force else analysis.stored(image)
+        if stored is not None:
+            outcomes[analysis.name] = {"source": "stored", "result": stored}
+            continue
+        content_hash = image.content_hash
+        cached = result_cache.get(analysis.kind, content_hash, analysis.model_name(), analysis.params())
+        if cached is not None:
+            _persist(image, analysis, cached)
+            outcomes[analysis.name] = {"source": "cache", "result": cached}
+            continue
+        token = single_flight.acquire(image.id, analysis.name)
+        if token is None:
+            followers.append(analysis)
+            continue
+        leases[analysis.name] = token
+        pending.append(analysis)
+
+    _run_models(image, pending, outcomes, leases)
+
+    for analysis in followers:
+        logger.info(f"图片 {image.id} 的 {analysis.name} 分析正由其他请求执行，等待其结果")
+        shared, token = single_flight.wait(image.id, analysis.name)
+        if token is not None:
+            # leader 失效，接管后自行执行
+            leases[analysis.name] = token
+            _run_models(image, [analysis], outcomes, leases)
+            continue
+        outcomes[analysis.name] = {**shared, "source": "shared"}
+        # leader 已写库，这里只同步内存中的 image
+        for field, value in analysis.fields(shared.get("result") or {}).items():
+            setattr(image, field, value)
+    return outcomes
+
+
+def _settle(image, analysis, outcome, outcomes, leases):
+    """记录一项分析的结果，并交给等待同一分析的其他请求"""
+    outcomes[analysis.name] = outcome
+    token = leases.pop(analysis.name, None)
+    if token is not None:
+        shared = {key: value for key, value in outcome.items() if key != "source"}
+        single_flight.release(image.id, analysis.name, token, shared)
+
+
+def _run_models(image, pending, outcomes, leases):
+    """下载原图并调用模型执行 pending 中的分析（调用方已持有这些分析的租约）"""
+    if not pending:
+        return
+    try:
+        _call_models(image, pending, outcomes, leases)
+    finally:
+        # 异常退出时也要释放租约，等待的请求不必等到租约过期
+        for analysis in pending:
+            if analysis.name in leases:
+                outcome = outcomes.get(analysis.name) or {"source": "model", "result": None, "error": "分析失败"}
+                _settle(image, analysis, outcome, outcomes, leases)
+
+
+def _call_models(image, pending, outcomes, leases):
+    # 原图只下载、解码一次；相同预处理参数的分析共用同一份 JPEG
+    try:
+        decoded = DecodedImage(download_original(image), filename=image.image_url, content_hash=image.content_hash or None)
+        jpegs = {analysis.name: decoded.ai_jpeg(analysis.max_size, analysis.quality) for analysis in pending}
+    except Exception as e:
+        logger.error(f"图片 {image.id} 下载或预处理失败: {str(e)}")
+        for analysis in pending:
+            _settle(image, analysis, {"source": "model", "result": None, "error": f"图片下载失败: {str(e)}"},
+                    outcomes, leases)
+        return
+
+    started = time.monotonic()
+    by_name = {analysis.name: analysis for analysis in pending}
+    with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+        # future -> 该次调用产生结果的分析
+        futures = {}
+        if settings.AI_STYLE_COMBINED and 'style' in by_name and 'emotion' in by_name:
+            group = (by_name.pop('style'), by_name.pop('emotion'))
+            call = metering.bind(image.id, analyze_image_style_emotion)
+            futures[pool.submit(call, None, settings.DASHSCOPE_API_KEY, jpegs['style'])] = group
+        for analysis in by_name.values():
+            futures[pool.submit(metering.bind(image.id, analysis.call), jpegs[analysis.name])] = (analysis,)
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                group = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 请求失败（网络错误、超时、熔断）时单独调用同样会失败，不再回退
+                    for analysis in group:
+                        logger.error(f"图片 {image.id} 的 {analysis.name} 分析失败: {str(e)}")
+                        _settle(image, analysis, {"source": "model", "result": None, "error": str(e)}, outcomes, leases)
+                    continue
+                if len(group) == 1:
+                    _record(image, group[0], result, decoded.content_hash, outcomes, leases, started)
+                    continue
+                # 合并调用：有效的部分直接采用，不符合字段表的部分回退到单独调用
+                for analysis, part in zip(group, result):
+                    if part is None:
+                        logger.info(f"图片 {image.id} 的合并分析缺少 {analysis.name} 结果，单独调用")
+                        futures[pool.submit(metering.bind(image.id, analysis.call), jpegs[analysis.name])] = (analysis,)
+                    else:
+                        _record(image, analysis, part, decoded.content_hash, outcomes, leases, started)
+
+
+def _record(image, analysis, result, content_hash, outcomes, leases, started):
+    """模型返回一个结果后立即写缓存和写库，不等待其他分析"""
+    if analysis.cacheable(result):
+        result_cache.put(analysis.kind, content_hash, analysis.model_name(), result, analysis.params())
+    _persist(image, analysis, result)
+    outcome = {"source": "model", "result": result}
+    if not analysis.fields(result or {}):
+        outcome["error"] = (result or {}).get("error", "分析失败")
+    _settle(image, analysis, outcome, outcomes, leases)
+    logger.info(f"图片 {image.id} 的 {analysis.name} 分析完成: {time.monotonic() - started:.2f}s")
+
+
+def sse_event(event, data):
+    """一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_description(image, force=False):
+    """
+    以 Server-Sent Events 流式生成描述：start 事件之后是若干 delta 事件（{"text": 片段}），
+    最后是 done 事件（{"description": 完整描述, "source": ...}）；失败时以 error 事件结束。
+    已保存或命中缓存时直接发送 done 事件；生成完成后写入 Image.ai_description 和结果缓存。
+    与 run_analyses 共用描述的租约：其他请求正在生成时不再调用模型，等它完成后直接发送 done 事件（source 为 shared）。
+    """
+    analysis = DescriptionAnalysis()
+    # 先发送一个事件，客户端在下载原图和等待模型前就收到响应
+    yield sse_event("start", {"image_id": image.id})
+
+    stored = None if force else analysis.stored(image)
+    if stored is not None:
+        yield sse_event("done", {"description": stored["description"], "source": "stored"})
+        return
+    cached = result_cache.get(analysis.kind, image.content_hash, analysis.model_name(), analysis.params())
+    if cached is not None:
+        _persist(image, analysis, cached)
+        yield sse_event("done", {"description": cached["description"], "source": "cache"})
+        return
+
+    token = single_flight.acquire(image.id, analysis.name)
+    if token is None:
+        logger.info(f"图片 {image.id} 的 {analysis.name} 分析正由其他请求执行，等待其结果")
+        shared, token = single_flight.wait(image.id, analysis.name)
+        if token is None:
+            description = (shared.get("result") or {}).get("description")
+            if not description:
+                yield sse_event("error", {"message": shared.get("error") or "描述生成失败"})
+                return
+            image.ai_description = description
+            yield sse_event("done", {"description": description, "source": "shared"})
+            return
+
+    # 无论成功、失败还是客户端中途断开，都释放租约并把结果交给等待的请求
+    shared = {"result": None, "error": "描述生成失败"}
+    try:
+        started = time.monotonic()
+        parts = []
+        try:
+            decoded = DecodedImage(download_original(image), filename=image.image_url, content_hash=image.content_hash or None)
+            jpeg = decoded.ai_jpeg(analysis.max_size, analysis.quality)
+            with metering.image_scope(image.id):
+                for text in stream_image_description(jpeg, settings.QNAIGC_API_KEY, DESCRIPTION_MODEL_ID):
+                    if not parts:
+                        logger.info(f"图片 {image.id} 的描述首个片段: {time.monotonic() - started:.2f}s")
+                    parts.append(text)
+                    yield sse_event("delta", {"text": text})
+        except Exception as e:
+            logger.error(f"图片 {image.id} 的流式描述失败: {str(e)}")
+            shared["error"] = f"描述生成失败: {str(e)}"
+            yield sse_event("error", {"message": shared["error"]})
+            return
+
+        description = clean_description("".join(parts))
+        if not description:
+            shared["error"] = "描述生成失败: 模型未返回内容"
+            yield sse_event("error", {"message": shared["error"]})
+            return
+        result = {"description": description, "model_used": analysis.model_name()}
+        result_cache.put(analysis.kind, decoded.content_hash, analysis.model_name(), result, analysis.params())
+        _persist(image, analysis, result)
+        shared = {"result": result}
+        logger.info(f"图片 {image.id} 的流式描述完成: {time.monotonic() - started:.2f}s")
+        yield sse_event("done", {"description": description, "source": "model"})
+    finally:
+        single_flight.release(image.id, analysis.name, token, shared)
+
+
+def _persist(image, analysis, result):
+    """只更新该分析对应的字段，避免覆盖并发写入的其他字段"""
+    fields = analysis.fields(result or {})
+    if not fields:
+        return
+    Image.objects.filter(id=image.id).update(**fields)
+    for field, value in fields.items():
+        setattr(image, field, value)
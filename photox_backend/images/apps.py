@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ImagesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'images'
+
+    def ready(self):
+        import atexit
+        from django.core.signals import request_finished
+        from .ai import metering
+        # 请求结束时写入本进程缓冲的模型调用记录；管理命令等非请求进程在退出时写入
+        request_finished.connect(metering.flush_on_request_finished, dispatch_uid='images.ai.metering')
+        atexit.register(metering.flush_at_exit)
+
+        if settings.AI_LOCAL_MODEL_PRELOAD:
+            from .ai import local_model
+            local_model.preload()
@@ -1,22 +1,58 @@
 
-from django.conf import settings
-import qiniu
+import logging
 
+from django.db import transaction
 
-def delete_image_from_cloud(image_url):
-    # 获取图片的文件名或路径部分
-    file_name = image_url.split('/')[-1]
+from .models import Image
+from .storage import get_storage
+from .variants import variant_keys
+
+logger = logging.getLogger(__name__)
 
-    # 从 settings.py 中获取七牛云的认证信息
-    access_key = settings.QINIU_ACCESS_KEY
-    secret_key = settings.QINIU_SECRET_KEY
-    bucket_name = settings.QINIU_BUCKET_NAME
 
-    # 创建七牛云认证对象
-    q = qiniu.Auth(access_key, secret_key)
-    bucket = qiniu.BucketManager(q)
+def delete_image_from_cloud(image_url):
+    # 从外链 URL 还原存储 key（包含 images/ 前缀，不能只取最后一段文件名）
+    storage = get_storage()
+    file_name = storage.key_from_url(image_url)
+    if not file_name:
+        raise Exception(f"无法识别的图片地址: {image_url}")
 
     # 删除图片
-    ret, info = bucket.delete(bucket_name, file_name)
-    if info.status_code != 200:
+    if not storage.delete(file_name):
         raise Exception("Failed to delete image from cloud storage")
+
+
+def delete_image(image):
+    """
+    删除图片记录，没有其他记录引用同一存储对象时一并删除存储中的文件和派生图片。
+    内容去重后多条记录共享同一个存储对象（按 content_hash 判断，走索引，包括仍在后台处理中的记录），
+    在事务中锁住同内容的记录再检查，避免与并发的去重复用、入库交错导致误删仍被引用的对象。
+    """
+    image_url, variants, content_hash = image.image_url, image.variants, image.content_hash
+    with transaction.atomic():
+        if content_hash:
+            same_content = Image.objects.select_for_update().filter(content_hash=content_hash)
+            list(same_content.values_list('id', flat=True))
+        image.delete()
+        if content_hash:
+            shared = Image.objects.filter(content_hash=content_hash).exists()
+        else:
+            # 早期没有内容哈希的记录只能按地址判断
+            shared = bool(image_url) and Image.objects.filter(image_url=image_url).exists()
+        if shared or not image_url:
+            return False
+        return release_image_object(image_url, variants)
+
+
+def release_image_object(image_url, variants=None):
+    """从存储中删除图片及其派生图片，调用方负责确认没有记录再引用该对象"""
+    try:
+        delete_image_from_cloud(image_url)
+        keys = variant_keys(variants)
+        if keys:
+            get_storage().batch_delete(keys)
+    except Exception as e:
+        logger.error(f"删除存储对象失败: {image_url}, {str(e)}")
+        return False
+    logger.info(f"已删除存储对象: {image_url}")
+    return True
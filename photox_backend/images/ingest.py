@@ -0,0 +1,479 @@
+# images/ingest.py
+"""
+图片异步入库流水线
+
+上传请求只负责把原始字节写入暂存目录并创建 status=processing 的 Image 记录，
+随后由本模块的后台线程池依次执行：颜色提取 -> AI 分类 -> 七牛云上传 -> 生成派生图片 -> 自动归档相册，
+每个阶段的进度都会写回 Image.processing_stages，供状态接口查询。
+
+各阶段共用一个 DecodedImage：文件只读取、解码一次，调色板、AI 载荷和上传数据都从内存派生。
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from .models import Image
+from .storage import get_storage
+from .ai import cascade, metering, result_cache, shortlist
+from .ai.ai_classify import image_classification, CLASSIFY_MODEL, CLASSIFY_MAX_SIZE, CLASSIFY_QUALITY
+from .ai.vocabulary import get_vocabulary
+from .ai.decode import PAYLOAD_VERSION, DecodedImage
+from .ai.exif import EXIF_FIELDS
+from .variants import generate_variants, generate_variants_safely
+
+logger = logging.getLogger(__name__)
+
+# 流水线阶段，按执行顺序排列
+INGEST_STAGES = ['colors', 'classify', 'upload', 'variants', 'album']
+
+STAGE_PENDING = 'pending'
+STAGE_RUNNING = 'running'
+STAGE_DONE = 'done'
+STAGE_FAILED = 'failed'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# 每个用户一个 [信号量, 使用者数]，限制同一用户同时进行的批量上传处理数；没有使用者时删除
+_user_slots = {}
+_user_slots_lock = threading.Lock()
+
+
+def get_executor():
+    """获取进程内共享的入库线程池（首次调用时创建）"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_INGEST_WORKERS,
+                    thread_name_prefix='image-ingest',
+                )
+    return _executor
+
+
+def build_storage_key(filename, content_hash=None):
+    """
+    生成七牛云中的存储路径。
+    提供内容哈希时按内容寻址（images/<sha256>.<ext>），相同内容总是落到同一个对象上。
+    """
+    if content_hash:
+        ext = os.path.splitext(filename)[1].lower()
+        return f"images/{content_hash}{ext}"
+    safe_filename = os.path.basename(filename).replace(' ', '_')
+    return f"images/{str(time.time()).replace('.', '')}_{safe_filename}"
+
+
+def spool_upload(image_file):
+    """
+    把上传文件写入暂存目录（文件名带 uuid，避免并发冲突），写入的同时计算 SHA-256。
+    返回 (暂存文件路径, 内容哈希)。
+    """
+    spool_dir = settings.IMAGE_INGEST_SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    ext = os.path.splitext(image_file.name)[1].lower()
+    spool_path = os.path.join(spool_dir, f"{uuid.uuid4().hex}{ext}")
+    sha256 = hashlib.sha256()
+    with open(spool_path, 'wb') as f:
+        for chunk in image_file.chunks():
+            sha256.update(chunk)
+            f.write(chunk)
+    return spool_path, sha256.hexdigest()
+
+
+def chunked_spool_path(session_id, filename):
+    """分片上传会话对应的暂存文件路径"""
+    spool_dir = os.path.join(settings.IMAGE_INGEST_SPOOL_DIR, 'chunked')
+    os.makedirs(spool_dir, exist_ok=True)
+    ext = os.path.splitext(filename)[1].lower()
+    return os.path.join(spool_dir, f"{session_id}{ext}")
+
+
+def append_chunk(path, offset, stream, limit, buffer_size=64 * 1024):
+    """
+    从请求流中读取一个分片，写到暂存文件的 offset 处，返回写入的字节数。
+    写入前先截断到 offset，丢弃上次中断请求残留的半截数据；超过 limit 时抛出 ValueError 并回滚。
+    """
+    written = 0
+    with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        while True:
+            data = stream.read(buffer_size)
+            if not data:
+                break
+            written += len(data)
+            if written > limit:
+                f.truncate(offset)
+                raise ValueError(f"分片超出允许的大小 {limit} 字节")
+            f.write(data)
+    return written
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """分块读取本地文件计算 SHA-256，不把整个文件读入内存"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def hash_upload(uploaded_file):
+    """分块计算上传文件的 SHA-256，不把文件内容保留在内存中"""
+    sha256 = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def find_duplicate(content_hash):
+    """按内容哈希查找已处理完成的图片（走 content_hash 索引的单次查询）"""
+    if not content_hash:
+        return None
+    return Image.objects.filter(
+        content_hash=content_hash,
+        status=Image.STATUS_READY,
+    ).exclude(image_url='').order_by('id').first()
+
+
+def exif_fields(decoded):
+    """Image 记录中的 EXIF 字段值"""
+    return {**decoded.exif, 'exif_extracted': True}
+
+
+def create_from_duplicate(source, user, title, is_public):
+    """
+    复用已存在图片的存储对象和 AI 结果（标签、分类、颜色）创建新记录，
+    不再调用大模型和云存储。
+    在事务中锁住并重新读取来源记录，来源已被删除时返回 None，调用方按新图片处理。
+    """
+    with transaction.atomic():
+        source = Image.objects.select_for_update().filter(
+            pk=source.pk, status=Image.STATUS_READY,
+        ).exclude(image_url='').first()
+        if source is None:
+            return None
+        image = Image.objects.create(
+            image_url=source.image_url,
+            title=title,
+            tags=source.tags,
+            user=user,
+            is_public=is_public,
+            category_id=source.category_id,
+            needs_reclassify=source.needs_reclassify,
+            colors=source.colors,
+            content_hash=source.content_hash,
+            perceptual_hash=source.perceptual_hash,
+            variants=source.variants,
+            exif_extracted=source.exif_extracted,
+            **{field: getattr(source, field) for field in EXIF_FIELDS},
+        )
+    if source.needs_reclassify:
+        logger.info(f"图片内容与 {source.id} 相同，复用已有结果创建图片 {image.id}（待重新分类）")
+        return image
+    try:
+        category_map = get_vocabulary("ai/classes.txt").category_map
+        assign_auto_album(image, category_map.get(source.category_id, category_map.get(0, "其他")))
+    except Exception as e:
+        logger.error(f"自动添加到相册失败: {str(e)}")
+    logger.info(f"图片内容与 {source.id} 相同，复用已有结果创建图片 {image.id}")
+    return image
+
+
+def enqueue_spooled(user, spool_path, content_hash, filename, title='', is_public=False):
+    """
+    把已写入暂存目录的完整文件交给入库流程。
+    内容已存在时直接复用结果并删除暂存文件，返回 (image, False)；
+    否则创建 status=processing 的记录并提交后台任务，返回 (image, True)。
+    """
+    duplicate = find_duplicate(content_hash)
+    image = create_from_duplicate(duplicate, user=user, title=title, is_public=is_public) if duplicate else None
+    if image:
+        os.remove(spool_path)
+        return image, False
+
+    image = Image.objects.create(
+        image_url='',
+        title=title,
+        user=user,
+        is_public=is_public,
+        status=Image.STATUS_PROCESSING,
+        processing_stages=initial_stages(),
+        content_hash=content_hash,
+    )
+    submit_ingest(image.id, spool_path, build_storage_key(filename, content_hash))
+    logger.info(f"图片 {image.id} 已提交后台处理")
+    return image, True
+
+
+@contextmanager
+def user_slot(user_id):
+    """
+    占用该用户的一个并发名额，名额数由 IMAGE_BATCH_UPLOAD_CONCURRENCY 配置。
+    按使用者计数，最后一个使用者离开时删除该用户的信号量，避免字典随用户数无限增长。
+    """
+    with _user_slots_lock:
+        slot = _user_slots.get(user_id)
+        if slot is None:
+            slot = _user_slots[user_id] = [threading.BoundedSemaphore(settings.IMAGE_BATCH_UPLOAD_CONCURRENCY), 0]
+        slot[1] += 1
+    try:
+        with slot[0]:
+            yield
+    finally:
+        with _user_slots_lock:
+            slot[1] -= 1
+            if slot[1] == 0:
+                del _user_slots[user_id]
+
+
+def classification_params(vocabulary):
+    """影响分类结果的参数：词表指纹、预处理参数以及（开启时的）预筛选、级联配置"""
+    params = {
+        "prompt": vocabulary.fingerprint, "max_size": CLASSIFY_MAX_SIZE, "quality": CLASSIFY_QUALITY,
+        "payload": PAYLOAD_VERSION,
+    }
+    shortlist_config = shortlist.config_fingerprint()
+    if shortlist_config:
+        params["shortlist"] = shortlist_config
+    cascade_config = cascade.config_fingerprint()
+    if cascade_config:
+        params["cascade"] = cascade_config
+    return params
+
+
+def classify_jpeg(jpeg, vocabulary, image=None):
+    """
+    用预处理好的 JPEG 分类。
+    开启级联或预筛选时先在 image（PIL 图片，未提供时从 jpeg 解码）上运行一次本地模型：
+    级联模式下置信度足够时直接采用本地结果，否则把预测结果用于缩小大模型提示词中的候选。
+    """
+    predictions = None
+    if cascade.enabled() or shortlist.enabled():
+        if image is None:
+            image = PILImage.open(io.BytesIO(jpeg))
+        predictions = cascade.local_predictions(image)
+
+    if cascade.enabled() and predictions:
+        result = cascade.local_result(predictions, vocabulary)
+        cascade.record_decision(result is not None)
+        if result is not None:
+            return result
+
+    candidates = None
+    if shortlist.enabled() and predictions:
+        candidates = shortlist.build_shortlist(predictions, vocabulary)
+    return cascade.timed_remote(lambda: image_classification(
+        image_path=None,
+        api_key=settings.DASHSCOPE_API_KEY,
+        classes_file="ai/classes.txt",
+        image_bytes=jpeg,
+        shortlist=candidates,
+    ))
+
+
+def classify_decoded(decoded):
+    """
+    使用内存中已缩放好的 JPEG 调用 AI 分类。
+    结果按内容哈希、模型、词表指纹和预处理参数缓存，同一张图片不会重复发给模型。
+    """
+    vocabulary = get_vocabulary("ai/classes.txt")
+    return result_cache.cached_call(
+        result_cache.KIND_CLASSIFY,
+        decoded.content_hash,
+        CLASSIFY_MODEL,
+        lambda: classify_jpeg(
+            decoded.ai_jpeg(CLASSIFY_MAX_SIZE, CLASSIFY_QUALITY),
+            vocabulary,
+            image=decoded.resized(CLASSIFY_MAX_SIZE),
+        ),
+        params=classification_params(vocabulary),
+        # 调用失败时的兜底结果不缓存
+        cacheable=lambda result: 'error' not in result,
+    )
+
+
+def classification_fields(result):
+    """
+    分类结果对应的 Image 字段。
+    调用失败（熔断、超时、响应无法解析）时不写入占位标签，只标记为待重新分类。
+    """
+    if 'error' in result:
+        return {'category_id': None, 'tags': '[]', 'needs_reclassify': True}
+    return {
+        'category_id': result['category_id'],
+        'tags': json.dumps([tag['name'] for tag in result['tags']], ensure_ascii=False),
+        'needs_reclassify': False,
+    }
+
+
+def upload_decoded(decoded, storage_key):
+    """把原始字节直接上传到配置的存储后端，返回外链 URL（失败返回 None）"""
+    return get_storage().put(key=storage_key, data=decoded.data)
+
+
+def process_upload_io(decoded, storage_key):
+    """
+    执行单个文件不涉及写库的 I/O 阶段：颜色提取、AI 分类、七牛云上传、派生图片。
+    可在任意线程中调用，结果由调用方在请求线程中落库。
+    """
+    colors = decoded.palette(num_colors=2)
+    result = classify_decoded(decoded)
+    image_url = upload_decoded(decoded, storage_key)
+    if not image_url:
+        raise Exception("上传到七牛云失败，未获取到图片URL")
+    return {
+        "colors": colors,
+        "classification": result,
+        "image_url": image_url,
+        "perceptual_hash": decoded.perceptual_hash,
+        "variants": generate_variants_safely(decoded),
+    }
+
+
+def initial_stages():
+    """新建记录时所有阶段均为 pending"""
+    return {stage: {"status": STAGE_PENDING} for stage in INGEST_STAGES}
+
+
+def assign_auto_album(image, category_name):
+    """查找或创建对应类别的相册并把图片加入其中"""
+    from albums.models import Album
+    album, created = Album.objects.get_or_create(
+        title=f"{category_name}相册",
+        user=image.user,
+        defaults={
+            'description': f'自动创建的{category_name}分类相册',
+            'is_public': False
+        }
+    )
+    album.images.add(image)
+    return album
+
+
+@contextmanager
+def _stage(image, stage):
+    """记录某个阶段的开始/结束时间和结果，异常会继续向上抛出"""
+    image.processing_stages[stage] = {
+        "status": STAGE_RUNNING,
+        "started_at": timezone.now().isoformat(),
+    }
+    image.save(update_fields=['processing_stages'])
+    try:
+        yield
+    except Exception as e:
+        image.processing_stages[stage].update({
+            "status": STAGE_FAILED,
+            "finished_at": timezone.now().isoformat(),
+            "error": str(e),
+        })
+        image.save(update_fields=['processing_stages'])
+        raise
+    image.processing_stages[stage].update({
+        "status": STAGE_DONE,
+        "finished_at": timezone.now().isoformat(),
+    })
+    image.save(update_fields=['processing_stages'])
+
+
+def run_ingest(image_id, spool_path, storage_key):
+    """执行完整的入库流水线，结果直接写回 Image 记录"""
+    try:
+        image = Image.objects.get(id=image_id)
+    except Image.DoesNotExist:
+        logger.error(f"入库任务对应的图片不存在: {image_id}")
+        return
+
+    logger.info(f"开始后台处理图片 {image_id}: {spool_path}")
+    try:
+        decoded = DecodedImage.from_path(spool_path)
+        image.content_hash = decoded.content_hash
+        image.perceptual_hash = decoded.perceptual_hash
+        image.perceptual_hash_at = timezone.now()
+        exif = exif_fields(decoded)
+        for field, value in exif.items():
+            setattr(image, field, value)
+        image.save(update_fields=['content_hash', 'perceptual_hash', 'perceptual_hash_at', *exif])
+
+        with _stage(image, 'colors'):
+            image.colors = decoded.palette(num_colors=2)
+            image.save(update_fields=['colors'])
+
+        with _stage(image, 'classify'), metering.image_scope(image_id):
+            result = classify_decoded(decoded)
+            fields = classification_fields(result)
+            for field, value in fields.items():
+                setattr(image, field, value)
+            image.save(update_fields=list(fields))
+
+        with _stage(image, 'upload'):
+            image_url = upload_decoded(decoded, storage_key)
+            if not image_url:
+                raise Exception("上传到七牛云失败，未获取到图片URL")
+            image.image_url = image_url
+            image.save(update_fields=['image_url'])
+
+        # 派生图片和相册归档失败都不影响图片本身入库，客户端可回退到原图
+        try:
+            with _stage(image, 'variants'):
+                image.variants = generate_variants(decoded)
+                image.save(update_fields=['variants'])
+        except Exception as e:
+            logger.error(f"生成派生图片失败: {str(e)}")
+
+        # 分类失败时等重新分类后再归档
+        if not image.needs_reclassify:
+            try:
+                with _stage(image, 'album'):
+                    assign_auto_album(image, result['category_name'])
+            except Exception as e:
+                logger.error(f"自动添加到相册失败: {str(e)}")
+
+        image.status = Image.STATUS_READY
+        image.save(update_fields=['status'])
+        logger.info(f"图片 {image_id} 后台处理完成")
+    except Exception as e:
+        logger.error(f"图片 {image_id} 后台处理失败: {str(e)}")
+        logger.error(traceback.format_exc())
+        image.status = Image.STATUS_FAILED
+        image.processing_error = str(e)
+        image.save(update_fields=['status', 'processing_error', 'processing_stages'])
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+
+def _run_in_worker(image_id, spool_path, storage_key):
+    """线程池入口：任务前后清理数据库连接，避免长驻线程持有失效连接"""
+    close_old_connections()
+    try:
+        run_ingest(image_id, spool_path, storage_key)
+    finally:
+        # 后台线程不经过 request_finished，在这里写入模型调用记录
+        metering.flush()
+        close_old_connections()
+
+
+def submit_ingest(image_id, spool_path, storage_key):
+    """
+    提交入库任务；IMAGE_INGEST_EAGER 为 True 时在当前线程内直接执行。
+    在事务中调用时等事务提交后再交给线程池，保证后台线程能读到新建的 Image 记录。
+    """
+    if settings.IMAGE_INGEST_EAGER:
+        run_ingest(image_id, spool_path, storage_key)
+        return
+    transaction.on_commit(lambda: get_executor().submit(_run_in_worker, image_id, spool_path, storage_key))
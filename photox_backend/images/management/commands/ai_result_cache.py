@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from images.ai import result_cache
+from images.models import AIResultCache
+
+
+class Command(BaseCommand):
+    help = '查看 AI 结果缓存的命中率，或手动淘汰/清空缓存条目'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='按最近使用时间淘汰超出上限的条目')
+        parser.add_argument('--max-entries', type=int, help='与 --evict 一起使用，覆盖 AI_RESULT_CACHE_MAX_ENTRIES')
+        parser.add_argument('--clear', action='store_true', help='删除全部缓存条目（可配合 --kind 只删某一类）')
+        parser.add_argument('--kind', choices=result_cache.KINDS, help='与 --clear 一起使用')
+        parser.add_argument('--reset-stats', action='store_true', help='清零命中/未命中计数')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            queryset = AIResultCache.objects.all()
+            if options['kind']:
+                queryset = queryset.filter(kind=options['kind'])
+            deleted, _ = queryset.delete()
+            self.stdout.write(self.style.SUCCESS(f"已删除 {deleted} 条缓存"))
+        if options['evict']:
+            deleted = result_cache.evict(options['max_entries'])
+            self.stdout.write(self.style.SUCCESS(f"已淘汰 {deleted} 条缓存"))
+        if options['reset_stats']:
+            result_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS("计数已清零"))
+
+        for kind, counts in result_cache.stats().items():
+            total = counts['hits'] + counts['misses']
+            ratio = counts['hits'] / total * 100 if total else 0
+            entries = AIResultCache.objects.filter(kind=kind).count()
+            self.stdout.write(f"{kind}: {entries} 条, 命中 {counts['hits']}, 未命中 {counts['misses']}, 命中率 {ratio:.1f}%")
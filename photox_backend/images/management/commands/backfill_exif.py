@@ -0,0 +1,58 @@
+import io
+
+import requests
+from django.core.management.base import BaseCommand
+from PIL import Image as PILImage
+
+from images.ai.exif import extract_exif
+from images.models import Image
+
+# EXIF 位于 JPEG 文件头部，先只请求前 256KB
+HEADER_BYTES = 256 * 1024
+
+
+class Command(BaseCommand):
+    help = '为已入库但未解析 EXIF 的图片补充拍摄时间、相机、镜头、GPS 等字段'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='本次最多处理多少个存储对象（默认不限）'
+        )
+
+    def fetch_exif(self, image_url):
+        """优先用 Range 请求只下载文件头，解析失败时再下载完整文件"""
+        resp = requests.get(image_url, headers={'Range': f'bytes=0-{HEADER_BYTES - 1}'}, timeout=30)
+        resp.raise_for_status()
+        try:
+            fields = extract_exif(PILImage.open(io.BytesIO(resp.content)))
+            if fields or resp.status_code == 200:
+                return fields
+        except Exception:
+            pass
+        resp = requests.get(image_url, timeout=60)
+        resp.raise_for_status()
+        return extract_exif(PILImage.open(io.BytesIO(resp.content)))
+
+    def handle(self, *args, **options):
+        queryset = Image.objects.filter(exif_extracted=False, status=Image.STATUS_READY).exclude(image_url='')
+        # 去重后多条记录共享同一个原图，每个原图只下载一次
+        urls = queryset.order_by('image_url').values_list('image_url', flat=True).distinct()
+        if options['limit'] is not None:
+            urls = urls[:options['limit']]
+
+        done = failed = 0
+        for image_url in urls.iterator():
+            try:
+                fields = self.fetch_exif(image_url)
+                updated = Image.objects.filter(image_url=image_url, exif_extracted=False) \
+                    .update(exif_extracted=True, **fields)
+                done += 1
+                self.stdout.write(f"{image_url}: 解析出 {len(fields)} 个字段，更新 {updated} 条记录")
+            except Exception as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"{image_url} 解析 EXIF 失败: {str(e)}"))
+
+        self.stdout.write(self.style.SUCCESS(f"EXIF 回填完成! 成功: {done}, 失败: {failed}"))
@@ -0,0 +1,166 @@
+import io
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PILImage
+
+PATHS = ('upload', 'batch-upload', 'analyze')
+
+
+class Command(BaseCommand):
+    help = (
+        '并发压测运行中的服务的上传、批量上传和 AI 分析接口，报告吞吐量和 p50/p95/p99 延迟。'
+        '配合 mock_vision_server 使用时，被测服务应将 AI_DASHSCOPE_BASE_URL、AI_QNAIGC_BASE_URL 指向模拟服务'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/api/v1', help='被测服务的 API 地址')
+        parser.add_argument('--username', default=None, help='登录用户名（与 --password 一起使用）')
+        parser.add_argument('--password', default=None, help='登录密码')
+        parser.add_argument('--token', default=None, help='直接使用的 JWT access token')
+        parser.add_argument('--path', action='append', choices=PATHS, help='要压测的接口，可重复指定（默认全部）')
+        parser.add_argument('--requests', type=int, default=40, help='每个接口的请求数')
+        parser.add_argument('--concurrency', type=int, default=8, help='并发请求数')
+        parser.add_argument('--batch-size', type=int, default=4, help='批量上传每个请求的图片数')
+        parser.add_argument('--image-size', type=int, default=1600, help='生成的测试图片最长边（像素）')
+        parser.add_argument('--analyses', default='description,style,emotion', help='analyze 接口执行的分析，逗号分隔')
+        parser.add_argument('--cleanup', action='store_true', help='结束后删除压测上传的图片')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--requests、--concurrency 和 --batch-size 必须大于 0')
+        self.base_url = options['base_url'].rstrip('/')
+        self.headers = {"Authorization": f"Bearer {self.login(options)}"}
+        self.local = threading.local()
+        self.image_size = options['image_size']
+        self.created = []
+        self.created_lock = threading.Lock()
+
+        paths = options['path'] or list(PATHS)
+        for path in paths:
+            if path == 'upload':
+                self.run(path, options, self.upload_one)
+            elif path == 'batch-upload':
+                self.run(path, options, lambda i: self.upload_batch(options['batch_size']),
+                         images_per_request=options['batch_size'])
+            else:
+                if not self.created:
+                    # 没有本次上传的图片时先准备一些（不计入结果）
+                    for i in range(options['concurrency']):
+                        self.upload_one(i)
+                if not self.created:
+                    raise CommandError('没有可用于分析的图片（上传全部失败）')
+                analyses = [name.strip() for name in options['analyses'].split(',') if name.strip()]
+                ids = list(self.created)
+                self.run(path, options, lambda i: self.analyze(ids[i % len(ids)], analyses))
+
+        if options['cleanup']:
+            for image_id in self.created:
+                self.session().delete(f"{self.base_url}/images/{image_id}/", headers=self.headers, timeout=30)
+            self.stdout.write(f"已删除 {len(self.created)} 张压测图片")
+
+    def login(self, options):
+        if options['token']:
+            return options['token']
+        if not (options['username'] and options['password']):
+            raise CommandError('需要 --token 或 --username/--password')
+        resp = requests.post(f"{self.base_url}/auth/login/", json={
+            "username": options['username'], "password": options['password']
+        }, timeout=30)
+        if resp.status_code != 200:
+            raise CommandError(f"登录失败: {resp.status_code} {resp.text[:200]}")
+        return resp.json()['data']['access']
+
+    def session(self):
+        """每个线程一个 Session，复用 keep-alive 连接"""
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def make_image(self):
+        """生成内容唯一的测试图片，避免命中去重和 AI 结果缓存"""
+        width = self.image_size
+        height = width * 3 // 4
+        image = PILImage.effect_noise((width // 8, height // 8), random.randint(32, 96)).resize((width, height))
+        image = PILImage.merge('RGB', [image, image.rotate(90, expand=False), image.transpose(PILImage.FLIP_LEFT_RIGHT)])
+        image.putpixel((0, 0), tuple(os.urandom(3)))
+        buf = io.BytesIO()
+        image.save(buf, format='JPEG', quality=90)
+        return buf.getvalue()
+
+    def remember(self, image_ids):
+        with self.created_lock:
+            self.created.extend(image_ids)
+
+    def upload_one(self, index):
+        resp = self.session().post(
+            f"{self.base_url}/images/upload/?mode=sync", headers=self.headers,
+            files={'image': (f"bench-{index}.jpg", self.make_image(), 'image/jpeg')}, timeout=120,
+        )
+        if resp.status_code != 201:
+            raise Exception(f"{resp.status_code} {resp.text[:200]}")
+        self.remember([resp.json()['id']])
+
+    def upload_batch(self, batch_size):
+        files = [('images', (f"bench-{i}.jpg", self.make_image(), 'image/jpeg')) for i in range(batch_size)]
+        resp = self.session().post(f"{self.base_url}/images/batch-upload/", headers=self.headers, files=files, timeout=300)
+        if resp.status_code not in (201, 207):
+            raise Exception(f"{resp.status_code} {resp.text[:200]}")
+        data = resp.json()
+        self.remember([result['id'] for result in data['results']])
+        if data['error_count']:
+            raise Exception(f"{data['error_count']} 个文件失败: {data['errors'][0]['error']}")
+
+    def analyze(self, image_id, analyses):
+        resp = self.session().post(
+            f"{self.base_url}/images/{image_id}/analyze/", headers=self.headers,
+            json={"analyses": analyses, "force": True}, timeout=300,
+        )
+        if resp.status_code != 200:
+            raise Exception(f"{resp.status_code} {resp.text[:200]}")
+
+    def run(self, path, options, func, images_per_request=1):
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def timed(index):
+            started = time.perf_counter()
+            try:
+                func(index)
+                ok = True
+            except Exception as e:
+                ok = False
+                with lock:
+                    errors.append(str(e))
+            with lock:
+                latencies.append((time.perf_counter() - started, ok))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(timed, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+
+        succeeded = sorted(latency for latency, ok in latencies if ok)
+        self.stdout.write(self.style.SUCCESS(
+            f"[{path}] {options['requests']} 个请求, 并发 {options['concurrency']}, 成功 {len(succeeded)}, "
+            f"失败 {len(errors)}, 耗时 {elapsed:.2f}s"
+        ))
+        if succeeded:
+            self.stdout.write(
+                f"  吞吐量: {len(succeeded) / elapsed:.2f} 请求/s"
+                + (f" ({len(succeeded) * images_per_request / elapsed:.2f} 张/s)" if images_per_request > 1 else "")
+            )
+            self.stdout.write(
+                f"  延迟: p50 {self.percentile(succeeded, 50) * 1000:.0f}ms, p95 {self.percentile(succeeded, 95) * 1000:.0f}ms, "
+                f"p99 {self.percentile(succeeded, 99) * 1000:.0f}ms, max {succeeded[-1] * 1000:.0f}ms"
+            )
+        for message in sorted(set(errors))[:5]:
+            self.stdout.write(self.style.ERROR(f"  错误: {message}"))
+
+    def percentile(self, samples, pct):
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
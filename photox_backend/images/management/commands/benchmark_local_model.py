@@ -0,0 +1,99 @@
+import gc
+import io
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PILImage
+
+from images.ai import backends
+from images.ai.local_model import LocalModel, resident_bytes
+from images.analysis import download_thumbnail
+from images.models import Image
+
+
+class Command(BaseCommand):
+    help = '比较本地模型各推理后端的加载耗时、延迟、吞吐量、内存占用，以及与 eager 模型 top-5 的一致性'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', action='append', choices=backends.BACKENDS,
+                            help='要比较的后端，可重复指定（默认全部；eager 总是作为基准）')
+        parser.add_argument('--model', default=None, help='torchvision 模型名（默认 AI_LOCAL_MODEL）')
+        parser.add_argument('--limit', type=int, default=32, help='使用多少张最近的图片缩略图作为样本')
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='不读取图片库，改用指定数量的随机图片（只用于比较速度，一致性没有参考意义）')
+        parser.add_argument('--batch-size', type=int, default=None, help='吞吐量测试的批大小（默认 AI_LOCAL_MODEL_BATCH_SIZE）')
+
+    def handle(self, *args, **options):
+        model_name = options['model'] or settings.AI_LOCAL_MODEL
+        batch_size = options['batch_size'] or settings.AI_LOCAL_MODEL_BATCH_SIZE
+        samples = self.load_samples(options)
+        if not samples:
+            raise CommandError('没有可用的样本图片（可使用 --synthetic）')
+        names = [name for name in options['backend'] or backends.BACKENDS if name != 'eager']
+
+        self.stdout.write(self.style.SUCCESS(f"模型 {model_name}, 样本 {len(samples)} 张, 批大小 {batch_size}"))
+        reference = self.run_backend(model_name, 'eager', samples, batch_size)
+        if reference is None:
+            raise CommandError('eager 模型加载失败')
+        for name in names:
+            self.run_backend(model_name, name, samples, batch_size, reference)
+
+    def load_samples(self, options):
+        if options['synthetic']:
+            rng = random.Random(0)
+            return [PILImage.effect_noise((320, 240), rng.randint(16, 96)).convert('RGB')
+                    for _ in range(options['synthetic'])]
+        samples = []
+        for image in Image.objects.filter(status=Image.STATUS_READY).exclude(image_url='').order_by('-id')[:options['limit']]:
+            try:
+                samples.append(PILImage.open(io.BytesIO(download_thumbnail(image))).convert('RGB'))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"图片 {image.id} 下载失败: {str(e)}"))
+        return samples
+
+    def run_backend(self, model_name, backend, samples, batch_size, reference=None):
+        gc.collect()
+        before = resident_bytes()
+        started = time.perf_counter()
+        try:
+            model = LocalModel(model_name, backend=backend)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"[{backend}] 加载失败: {str(e)}"))
+            return None
+        load_time = time.perf_counter() - started
+        if model.backend != backend:
+            self.stdout.write(self.style.WARNING(f"[{backend}] 不可用（已回退到 {model.backend}），跳过"))
+            return None
+
+        model.predict(samples[0])  # 预热
+        latencies = []
+        for image in samples:
+            started = time.perf_counter()
+            model.predict(image)
+            latencies.append(time.perf_counter() - started)
+
+        predictions = []
+        started = time.perf_counter()
+        for start in range(0, len(samples), batch_size):
+            predictions.extend(model.predict_batch(samples[start:start + batch_size]))
+        throughput = len(samples) / (time.perf_counter() - started)
+        memory = (resident_bytes() - before) / 1024 / 1024
+
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"[{backend}] 加载 {load_time:.2f}s, 单张延迟 p50 {statistics.median(latencies) * 1000:.1f}ms "
+            f"p95 {p95 * 1000:.1f}ms, 批量吞吐 {throughput:.1f} 张/s, 常驻内存增加 {memory:.0f} MB"
+        )
+        if reference is not None:
+            top1 = sum(ours[0][0] == theirs[0][0] for ours, theirs in zip(predictions, reference)) / len(samples)
+            overlap = statistics.mean(
+                len({label for label, _ in ours} & {label for label, _ in theirs}) / len(theirs)
+                for ours, theirs in zip(predictions, reference)
+            )
+            self.stdout.write(f"[{backend}] 与 eager 一致性: top-1 {top1 * 100:.1f}%, top-5 重合 {overlap * 100:.1f}%")
+        del model
+        return predictions
@@ -0,0 +1,103 @@
+import io
+import multiprocessing
+import resource
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PILImage
+
+from images.ai.decode import prepare_payload
+
+
+def legacy_nearest(data, max_size, quality):
+    """改造前 ai_classify.process_image 的做法：全尺寸解码后 NEAREST 缩放"""
+    img = PILImage.open(io.BytesIO(data)).convert('RGB')
+    width, height = img.size
+    if max(width, height) > max_size:
+        ratio = max_size / max(width, height)
+        img = img.resize((int(width * ratio), int(height * ratio)), PILImage.Resampling.NEAREST)
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def legacy_lanczos(data, max_size, quality):
+    """改造前 style_analysis.prepare_image 的做法：全尺寸解码后直接 LANCZOS 缩放"""
+    img = PILImage.open(io.BytesIO(data)).convert('RGB')
+    width, height = img.size
+    if max(width, height) > max_size:
+        ratio = max_size / max(width, height)
+        img = img.resize((int(width * ratio), int(height * ratio)), PILImage.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def current(data, max_size, quality):
+    return prepare_payload(data, max_size, quality)
+
+
+METHODS = {
+    'legacy-nearest': legacy_nearest,
+    'legacy-lanczos': legacy_lanczos,
+    'draft': current,
+}
+
+
+def measure(name, data, max_size, quality, iterations):
+    """在独立子进程中运行，峰值常驻内存只反映该方法本身"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        output = METHODS[name](data, max_size, quality)
+        timings.append(time.perf_counter() - started)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return timings, (peak - baseline) * 1024, len(output)
+
+
+class Command(BaseCommand):
+    help = '比较发给视觉模型的图片预处理方式（全尺寸解码 vs JPEG draft 缩小解码）的耗时和峰值内存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None, help='测试图片路径（默认生成 6000x4000 的 JPEG）')
+        parser.add_argument('--max-size', type=int, default=1024, help='输出最长边')
+        parser.add_argument('--quality', type=int, default=85, help='输出 JPEG 质量')
+        parser.add_argument('--iterations', type=int, default=5, help='每种方式的重复次数')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            try:
+                with open(options['file'], 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                raise CommandError(f"读取图片失败: {str(e)}")
+        else:
+            data = self.synthetic_jpeg()
+        with PILImage.open(io.BytesIO(data)) as img:
+            self.stdout.write(self.style.SUCCESS(
+                f"测试图片 {img.format} {img.size[0]}x{img.size[1]} ({len(data) / 1024 / 1024:.1f} MB), "
+                f"输出最长边 {options['max_size']}, 重复 {options['iterations']} 次"
+            ))
+
+        # fork 出的子进程从同一基线开始，峰值内存互不影响
+        context = multiprocessing.get_context('fork')
+        for name in METHODS:
+            with context.Pool(1) as pool:
+                timings, peak, size = pool.apply(
+                    measure, (name, data, options['max_size'], options['quality'], options['iterations'])
+                )
+            self.stdout.write(
+                f"  {name:15s} 中位数 {statistics.median(timings) * 1000:7.1f}ms, 最快 {min(timings) * 1000:7.1f}ms, "
+                f"峰值内存增加 {peak / 1024 / 1024:6.1f} MB, 输出 {size / 1024:.0f} KB"
+            )
+
+    def synthetic_jpeg(self):
+        """生成带细节的 24MP JPEG（纯色图片解码过快，不能反映真实照片）"""
+        noise = PILImage.effect_noise((750, 500), 64).resize((6000, 4000), PILImage.Resampling.BICUBIC)
+        gradient = PILImage.linear_gradient('L').resize((6000, 4000))
+        img = PILImage.merge('RGB', [noise, gradient, noise.transpose(PILImage.Transpose.FLIP_LEFT_RIGHT)])
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=92)
+        return buf.getvalue()
@@ -0,0 +1,70 @@
+import io
+import os
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from images.storage import STORAGE_BACKENDS, get_storage
+
+
+class Command(BaseCommand):
+    help = '对存储后端做上传/查询/删除压测，比较各后端的吞吐量和延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend',
+            action='append',
+            choices=sorted(STORAGE_BACKENDS),
+            help='要压测的后端，可重复指定（默认只测 local）'
+        )
+        parser.add_argument('--count', type=int, default=50, help='每个后端上传的对象数')
+        parser.add_argument('--size', type=int, default=1024 * 1024, help='每个对象的字节数')
+        parser.add_argument('--concurrency', type=int, default=4, help='并发线程数')
+        parser.add_argument('--stream', action='store_true', help='使用 put_stream 代替 put')
+
+    def handle(self, *args, **options):
+        if options['count'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--count 和 --concurrency 必须大于 0')
+
+        payload = os.urandom(options['size'])
+        for name in options['backend'] or ['local']:
+            self.run_backend(get_storage(name), payload, options)
+
+    def timed(self, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        return time.perf_counter() - started, result
+
+    def run_backend(self, storage, payload, options):
+        prefix = f"benchmark/{uuid.uuid4().hex}"
+        keys = [f"{prefix}/{i}.bin" for i in range(options['count'])]
+
+        if options['stream']:
+            upload = lambda key: storage.put_stream(key, io.BytesIO(payload), len(payload))
+        else:
+            upload = lambda key: storage.put(key, payload)
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            started = time.perf_counter()
+            put_results = list(pool.map(lambda key: self.timed(upload, key), keys))
+            put_elapsed = time.perf_counter() - started
+
+            exists_results = list(pool.map(lambda key: self.timed(storage.exists, key), keys))
+
+        delete_elapsed, deleted = self.timed(storage.batch_delete, keys)
+
+        failures = sum(1 for _, url in put_results if not url)
+        total_mb = len(payload) * (len(keys) - failures) / (1024 * 1024)
+        self.stdout.write(self.style.SUCCESS(f"[{storage.name}] {len(keys)} 个对象 x {len(payload)} 字节, 并发 {options['concurrency']}"))
+        self.stdout.write(f"  上传: {put_elapsed:.3f}s, {len(keys) / put_elapsed:.1f} 次/s, {total_mb / put_elapsed:.2f} MB/s, 失败 {failures}")
+        self.stdout.write(f"  上传延迟: {self.describe([t for t, _ in put_results])}")
+        self.stdout.write(f"  exists 延迟: {self.describe([t for t, _ in exists_results])}")
+        self.stdout.write(f"  批量删除: {delete_elapsed:.3f}s, 成功 {sum(deleted.values())}/{len(keys)}")
+
+    def describe(self, samples):
+        samples = sorted(samples)
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return f"p50 {statistics.median(samples) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, max {samples[-1] * 1000:.1f}ms"
@@ -0,0 +1,123 @@
+import io
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PILImage
+
+from images.ai import local_model, shortlist
+from images.ai.ai_classify import image_classification, CLASSIFY_MAX_SIZE, CLASSIFY_QUALITY
+from images.ai.decode import DecodedImage
+from images.ai.vocabulary import get_vocabulary
+from images.analysis import download_original, download_thumbnail
+from images.models import Image
+
+
+class Command(BaseCommand):
+    help = '评估分类提示词预筛选：提示词长度、本地模型耗时、候选召回率，可选对比大模型延迟和结果一致性'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=50, help='使用多少张最近的已分类图片作为样本')
+        parser.add_argument('--call-model', action='store_true',
+                            help='同时用完整词表和候选各调用一次大模型，比较延迟和结果（会产生费用）')
+
+    def handle(self, *args, **options):
+        vocabulary = get_vocabulary("ai/classes.txt")
+        full_prompt = vocabulary.prompt_for(None)
+        samples = list(Image.objects.filter(
+            status=Image.STATUS_READY, needs_reclassify=False, category_id__isnull=False
+        ).exclude(tags__in=['', '[]']).exclude(image_url='').order_by('-id')[:options['limit']])
+        if not samples:
+            raise CommandError('没有可用的已分类图片')
+
+        local_times, prompt_chars = [], []
+        category_hits, tag_recalls = [], []
+        fallbacks = 0
+        model_times = {'full': [], 'shortlist': []}
+        agreements = []
+        tag_ids_by_name = {name: tag_id for tag_id, name in vocabulary.tag_map.items()}
+
+        for image in samples:
+            try:
+                thumbnail = PILImage.open(io.BytesIO(download_thumbnail(image)))
+                started = time.perf_counter()
+                predictions = local_model.predict(thumbnail, top_k=5)
+                candidates = shortlist.build_shortlist(predictions, vocabulary)
+                local_times.append(time.perf_counter() - started)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"图片 {image.id} 本地预测失败: {str(e)}"))
+                continue
+
+            if candidates is None:
+                fallbacks += 1
+                prompt_chars.append(len(full_prompt))
+                continue
+            prompt_chars.append(len(vocabulary.prompt_for(candidates)))
+
+            # 召回率：样本已有的类别/标签（视为真值）是否仍在候选中，不在候选中的大模型无法再选出
+            category_hits.append(image.category_id in candidates.category_ids)
+            truth = {tag_ids_by_name[name] for name in image.get_tags_as_list() if name in tag_ids_by_name}
+            if truth:
+                tag_recalls.append(len(truth & set(candidates.tag_ids)) / len(truth))
+
+            if options['call_model']:
+                self.compare_model(image, vocabulary, candidates, model_times, agreements)
+
+        if not local_times:
+            raise CommandError('所有样本的本地预测都失败了')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"样本 {len(local_times)} 张, 本地模型 {settings.AI_LOCAL_MODEL}, 候选 "
+            f"{settings.AI_CATEGORY_SHORTLIST_SIZE} 个类别 / {settings.AI_TAG_SHORTLIST_SIZE} 个标签, 回退完整词表 {fallbacks} 次"
+        ))
+        average_chars = statistics.mean(prompt_chars)
+        self.stdout.write(
+            f"  提示词长度: 完整 {len(full_prompt)} 字符, 预筛选后平均 {average_chars:.0f} 字符 "
+            f"(减少 {(1 - average_chars / len(full_prompt)) * 100:.1f}%)"
+        )
+        self.stdout.write(f"  本地模型耗时: {self.describe(local_times)}")
+        if category_hits:
+            self.stdout.write(f"  类别召回率: {sum(category_hits) / len(category_hits) * 100:.1f}%")
+        if tag_recalls:
+            self.stdout.write(f"  标签召回率: {statistics.mean(tag_recalls) * 100:.1f}%")
+        if model_times['full']:
+            self.stdout.write(f"  大模型延迟（完整词表）: {self.describe(model_times['full'])}")
+            self.stdout.write(f"  大模型延迟（预筛选）: {self.describe(model_times['shortlist'])}")
+            category_agreement = sum(1 for same, _ in agreements if same) / len(agreements)
+            self.stdout.write(
+                f"  与完整词表结果一致: 类别 {category_agreement * 100:.1f}%, "
+                f"标签 Jaccard 平均 {statistics.mean(j for _, j in agreements):.2f}"
+            )
+
+    def compare_model(self, image, vocabulary, candidates, model_times, agreements):
+        try:
+            jpeg = DecodedImage(download_original(image)).ai_jpeg(CLASSIFY_MAX_SIZE, CLASSIFY_QUALITY)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"图片 {image.id} 下载失败: {str(e)}"))
+            return
+        results = {}
+        for mode, mode_candidates in (('full', None), ('shortlist', candidates)):
+            started = time.perf_counter()
+            results[mode] = image_classification(
+                image_path=None,
+                api_key=settings.DASHSCOPE_API_KEY,
+                classes_file="ai/classes.txt",
+                image_bytes=jpeg,
+                shortlist=mode_candidates,
+            )
+            model_times[mode].append(time.perf_counter() - started)
+        if any('error' in result for result in results.values()):
+            return
+        full_tags = {tag['id'] for tag in results['full']['tags']}
+        short_tags = {tag['id'] for tag in results['shortlist']['tags']}
+        union = full_tags | short_tags
+        agreements.append((
+            results['full']['category_id'] == results['shortlist']['category_id'],
+            len(full_tags & short_tags) / len(union) if union else 1.0,
+        ))
+
+    def describe(self, samples):
+        samples = sorted(samples)
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return f"p50 {statistics.median(samples) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, max {samples[-1] * 1000:.1f}ms"
@@ -0,0 +1,40 @@
+import requests
+from django.core.management.base import BaseCommand
+
+from images.ai.decode import DecodedImage
+from images.models import Image
+from images.variants import generate_variants
+
+
+class Command(BaseCommand):
+    help = '为缺少派生图片（缩略图）的已入库图片补生成各尺寸的 WebP/JPEG'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='本次最多处理多少个存储对象（默认不限）'
+        )
+
+    def handle(self, *args, **options):
+        queryset = Image.objects.filter(variants={}, status=Image.STATUS_READY).exclude(image_url='')
+        # 去重后多条记录共享同一个原图，每个原图只下载、生成一次
+        urls = queryset.order_by('image_url').values_list('image_url', flat=True).distinct()
+        if options['limit'] is not None:
+            urls = urls[:options['limit']]
+
+        done = failed = 0
+        for image_url in urls.iterator():
+            try:
+                resp = requests.get(image_url, timeout=30)
+                resp.raise_for_status()
+                variants = generate_variants(DecodedImage(resp.content, filename=image_url))
+                updated = Image.objects.filter(image_url=image_url, variants={}).update(variants=variants)
+                done += 1
+                self.stdout.write(f"{image_url}: 已生成 {len(variants)} 个尺寸，更新 {updated} 条记录")
+            except Exception as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"{image_url} 生成派生图片失败: {str(e)}"))
+
+        self.stdout.write(self.style.SUCCESS(f"派生图片补生成完成! 成功: {done}, 失败: {failed}"))
@@ -0,0 +1,77 @@
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from images.ai.decode import DecodedImage
+from images.models import Image
+from images.phash import get_index
+
+
+class Command(BaseCommand):
+    help = '为缺少感知哈希的图片补算 dHash，并增量构建/刷新近似重复检索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='每批补算哈希的图片数量'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='本次最多补算多少张图片（默认不限）'
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='忽略已有索引文件，从数据库全量重建'
+        )
+
+    def handle(self, *args, **options):
+        self.backfill(options['batch_size'], options['limit'])
+
+        index = get_index()
+        started = time.monotonic()
+        if options['rebuild']:
+            index.rebuild()
+        else:
+            index.refresh()
+        index.save()
+        self.stdout.write(self.style.SUCCESS(
+            f"索引已保存到 {index.path}: {index.tree.size} 条, 哈希更新至 {index.watermark}, "
+            f"耗时 {time.monotonic() - started:.2f}s"
+        ))
+
+    def backfill(self, batch_size, limit):
+        """下载缺少感知哈希的已入库图片并计算 dHash"""
+        queryset = Image.objects.filter(perceptual_hash='', status=Image.STATUS_READY).exclude(image_url='')
+        total = queryset.count() if limit is None else min(limit, queryset.count())
+        done = failed = 0
+        last_id = 0
+
+        while done + failed < total:
+            batch = list(queryset.filter(id__gt=last_id).order_by('id')[:min(batch_size, total - done - failed)])
+            if not batch:
+                break
+            for image in batch:
+                last_id = image.id
+                try:
+                    resp = requests.get(image.image_url, timeout=30)
+                    resp.raise_for_status()
+                    # 与入库时相同的计算路径（按 EXIF 方向摆正并缩小后计算），补算的哈希与新上传的可以直接比较
+                    decoded = DecodedImage(resp.content, filename=image.image_url, content_hash=image.content_hash or None)
+                    Image.objects.filter(id=image.id).update(
+                        perceptual_hash=decoded.perceptual_hash, perceptual_hash_at=timezone.now()
+                    )
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f"图片 {image.id} 计算哈希失败: {str(e)}"))
+            self.stdout.write(f"已补算 {done}/{total}，失败 {failed}")
+
+        if total:
+            self.stdout.write(self.style.SUCCESS(f"感知哈希补算完成! 成功: {done}, 失败: {failed}"))
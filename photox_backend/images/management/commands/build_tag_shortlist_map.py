@@ -0,0 +1,91 @@
+import io
+import json
+import os
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PILImage
+
+from images.ai import local_model
+from images.ai.vocabulary import get_vocabulary
+from images.analysis import download_thumbnail
+from images.models import Image
+
+
+class Command(BaseCommand):
+    help = '用已分类图片统计本地模型 ImageNet 标签与类别/标签的共现，生成分类提示词的候选预筛选映射'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=2000, help='最多使用多少张最近的已分类图片')
+        parser.add_argument('--min-count', type=int, default=3, help='出现次数少于该值的 ImageNet 标签不写入映射')
+        parser.add_argument('--max-tags', type=int, default=20, help='每个 ImageNet 标签最多保留的标签数')
+        parser.add_argument('--output', default=None, help='输出路径（默认 AI_TAG_SHORTLIST_MAP_PATH）')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='每次前向计算的图片数（默认 AI_LOCAL_MODEL_BATCH_SIZE）')
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.AI_TAG_SHORTLIST_MAP_PATH
+        vocabulary = get_vocabulary("ai/classes.txt")
+        queryset = Image.objects.filter(
+            status=Image.STATUS_READY, needs_reclassify=False, category_id__isnull=False
+        ).exclude(tags__in=['', '[]']).exclude(image_url='').order_by('-id')[:options['limit']]
+
+        label_weight = Counter()
+        label_count = Counter()
+        category_weight = defaultdict(Counter)
+        tag_weight = defaultdict(Counter)
+        used = failed = 0
+        batch_size = options['batch_size'] or settings.AI_LOCAL_MODEL_BATCH_SIZE
+        images = list(queryset)
+        for start in range(0, len(images), batch_size):
+            batch, thumbnails = [], []
+            for image in images[start:start + batch_size]:
+                try:
+                    thumbnails.append(PILImage.open(io.BytesIO(download_thumbnail(image))))
+                    batch.append(image)
+                except Exception as e:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f"图片 {image.id} 下载失败: {str(e)}"))
+            if not batch:
+                continue
+            try:
+                batch_predictions = local_model.predict_batch(thumbnails, top_k=5)
+            except Exception as e:
+                failed += len(batch)
+                self.stdout.write(self.style.ERROR(f"图片 {batch[0].id}-{batch[-1].id} 预测失败: {str(e)}"))
+                continue
+
+            for image, predictions in zip(batch, batch_predictions):
+                used += 1
+                category = vocabulary.category_map.get(image.category_id)
+                tags = image.get_tags_as_list()
+                for label, prob in predictions:
+                    label_weight[label] += prob
+                    label_count[label] += 1
+                    if category:
+                        category_weight[label][category] += prob
+                    for tag in tags:
+                        tag_weight[label][tag] += prob
+
+        if not used:
+            raise CommandError('没有可用的已分类图片')
+
+        labels = {}
+        for label, total in label_weight.items():
+            if label_count[label] < options['min_count']:
+                continue
+            labels[label] = {
+                "categories": {name: round(weight / total, 4) for name, weight in category_weight[label].most_common()},
+                "tags": {name: round(weight / total, 4)
+                         for name, weight in tag_weight[label].most_common(options['max_tags'])},
+            }
+
+        # 先写临时文件再替换，正在读取映射的 worker 不会读到半个文件
+        tmp_path = f"{output}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"model": settings.AI_LOCAL_MODEL, "images": used, "labels": labels}, f, ensure_ascii=False)
+        os.replace(tmp_path, output)
+        self.stdout.write(self.style.SUCCESS(
+            f"映射已写入 {output}: {used} 张图片, {len(labels)} 个 ImageNet 标签, 失败 {failed}"
+        ))
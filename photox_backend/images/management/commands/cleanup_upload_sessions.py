@@ -0,0 +1,34 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from images.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = '清理长时间未完成的分片上传会话及其暂存文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=None,
+            help='超过多少小时未更新的会话视为过期（默认取 IMAGE_UPLOAD_SESSION_TTL_HOURS）'
+        )
+
+    def handle(self, *args, **options):
+        hours = options['hours'] or settings.IMAGE_UPLOAD_SESSION_TTL_HOURS
+        cutoff = timezone.now() - timedelta(hours=hours)
+        stale = UploadSession.objects.filter(status=UploadSession.STATUS_UPLOADING, updated_at__lt=cutoff)
+
+        removed = 0
+        for session in stale.iterator():
+            if os.path.exists(session.spool_path):
+                os.remove(session.spool_path)
+            session.delete()
+            removed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'已清理 {removed} 个过期的上传会话'))
@@ -0,0 +1,46 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from images.ai import backends
+from images.ai.local_model import LocalModel
+
+
+class Command(BaseCommand):
+    help = '把本地 ImageNet 模型导出为 TorchScript 或 ONNX，供 AI_LOCAL_MODEL_BACKEND 使用'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', required=True, choices=sorted(backends.EXPORTED), help='导出格式')
+        parser.add_argument('--model', default=None, help='torchvision 模型名（默认 AI_LOCAL_MODEL）')
+        parser.add_argument('--weights', default='DEFAULT', help='权重版本（默认 DEFAULT）')
+        parser.add_argument('--quantize', action='store_true',
+                            help='导出前对全连接层做动态 int8 量化（仅 torchscript，导出为 quantized_torchscript 后端）')
+
+    def handle(self, *args, **options):
+        model_name = options['model'] or settings.AI_LOCAL_MODEL
+        backend = options['backend']
+        if options['quantize']:
+            if backend not in backends.TORCHSCRIPT_BACKENDS:
+                raise CommandError('--quantize 只支持 torchscript')
+            backend = 'quantized_torchscript'
+
+        # 量化版本单独保存为 <模型>-<权重>-int8.pt，不覆盖 float 版本
+        quantized = backend == 'quantized_torchscript'
+        eager = LocalModel(model_name, options['weights'], backend='quantized' if quantized else 'eager')
+        path = backends.artifact_path(model_name, eager.weights.name, backend)
+        try:
+            backends.export(eager.model, eager.weights, backend, path)
+            exported = backends.load_exported(model_name, eager.weights.name, backend)
+        except ImportError as e:
+            raise CommandError(f"缺少导出 {backend} 所需的依赖: {str(e)}")
+
+        # 用随机输入检查导出结果与原模型一致
+        torch = eager.torch
+        size = backends.input_size(eager.weights)
+        sample = torch.randn(2, 3, size, size)
+        with torch.inference_mode():
+            diff = (eager.model(sample) - exported(sample)).abs().max().item()
+        self.stdout.write(self.style.SUCCESS(
+            f"已导出 {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB), 与原模型输出的最大差异 {diff:.2e}"
+        ))
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from images.ai.mock_server import LatencyModel, MockVisionServer
+
+
+class Command(BaseCommand):
+    help = '启动本地模拟的视觉大模型服务（OpenAI 兼容 chat/completions），用于不产生费用的压测'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+        parser.add_argument('--port', type=int, default=8765, help='监听端口')
+        parser.add_argument('--latency', default='lognormal:1.5,0.4',
+                            help='响应延迟分布（秒）: fixed:s, uniform:a,b, normal:mean,std, lognormal:median,sigma')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='返回错误的请求比例（0-1）')
+        parser.add_argument('--error-status', type=int, default=503, help='注入错误时返回的状态码')
+        parser.add_argument('--responses', default=None,
+                            help='预设返回内容的 JSON 文件，按类型覆盖: {"classify"|"description"|"style"|"emotion": 内容}')
+        parser.add_argument('--seed', type=int, default=None, help='随机种子（复现延迟和错误序列）')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['error_rate'] <= 1:
+            raise CommandError('--error-rate 必须在 0 到 1 之间')
+        try:
+            latency = LatencyModel.parse(options['latency'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        responses = None
+        if options['responses']:
+            try:
+                with open(options['responses'], 'r', encoding='utf-8') as f:
+                    responses = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"读取预设返回内容失败: {str(e)}")
+
+        server = MockVisionServer(
+            options['host'], options['port'], latency=latency, error_rate=options['error_rate'],
+            error_status=options['error_status'], responses=responses, seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"模拟视觉模型服务已启动: {server.base_url}（延迟 {options['latency']}, 错误率 {options['error_rate']}）\n"
+            f"设置 AI_DASHSCOPE_BASE_URL={server.base_url} AI_QNAIGC_BASE_URL={server.base_url} 后启动应用"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from images.ai import client as ai_client
+from images.ai import resilience
+from images.ai.decode import DecodedImage
+from images.ingest import assign_auto_album, classification_fields, classify_decoded
+from images.models import Image
+
+
+class Command(BaseCommand):
+    help = '重新分类上传时 AI 分类失败（如模型熔断）的图片，成功后写入标签并归档到相册'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='本次最多处理多少个存储对象（默认不限）'
+        )
+
+    def handle(self, *args, **options):
+        queryset = Image.objects.filter(needs_reclassify=True, status=Image.STATUS_READY).exclude(image_url='')
+        # 去重后多条记录共享同一个原图，每个原图只下载、分类一次
+        urls = queryset.order_by('image_url').values_list('image_url', flat=True).distinct()
+        if options['limit'] is not None:
+            urls = urls[:options['limit']]
+
+        done = failed = 0
+        for image_url in urls.iterator():
+            # 模型仍处于熔断状态时不再继续，留给下一次执行
+            if resilience.is_open(ai_client.dashscope_chat_url()):
+                self.stdout.write(self.style.WARNING("分类模型处于熔断状态，停止本次重新分类"))
+                break
+            try:
+                resp = ai_client.get_session().get(image_url, timeout=ai_client.default_timeout())
+                resp.raise_for_status()
+                result = classify_decoded(DecodedImage(resp.content, filename=image_url))
+                if 'error' in result:
+                    raise Exception(result['error'])
+
+                images = list(Image.objects.filter(image_url=image_url, needs_reclassify=True))
+                Image.objects.filter(id__in=[image.id for image in images]).update(**classification_fields(result))
+                for image in images:
+                    assign_auto_album(image, result['category_name'])
+                done += 1
+                self.stdout.write(f"{image_url}: {result['category_name']}，更新 {len(images)} 条记录")
+            except Exception as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"{image_url} 重新分类失败: {str(e)}"))
+
+        self.stdout.write(self.style.SUCCESS(f"重新分类完成! 成功: {done}, 失败: {failed}"))
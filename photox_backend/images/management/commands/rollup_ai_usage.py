@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from images.ai import metering
+from images.models import AICallRecord
+
+
+class Command(BaseCommand):
+    help = (
+        '把 AI 调用记录按天、按模型汇总（调用数、失败数、token、p50/p95 延迟、费用），'
+        '默认汇总昨天和今天，建议用 cron 定期执行；可选清理已汇总的旧记录'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='汇总最近几天（含今天）')
+        parser.add_argument('--prune-days', type=int, default=0,
+                            help='删除早于该天数的调用记录，删除前先重新汇总这些天（0 为不删除，需大于 --days）')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days 必须大于 0')
+        if options['prune_days'] and options['prune_days'] <= options['days']:
+            raise CommandError('--prune-days 必须大于 --days，只删除已经汇总过的记录')
+
+        today = timezone.localdate()
+        for offset in range(options['days'] - 1, -1, -1):
+            day = today - timedelta(days=offset)
+            summary = metering.rollup(day)
+            if not summary:
+                self.stdout.write(f"{day}: 无调用记录")
+            for row in summary:
+                self.stdout.write(
+                    f"{day} {row['model_name']}: {row['calls']} 次, 失败 {row['failures']}, "
+                    f"token {row['prompt_tokens']}/{row['completion_tokens']}, "
+                    f"p50 {row['latency_p50_ms']}ms, p95 {row['latency_p95_ms']}ms, 费用 ¥{row['cost']:.4f}"
+                )
+
+        if options['prune_days']:
+            cutoff = today - timedelta(days=options['prune_days'])
+            old_records = AICallRecord.objects.filter(created_at__date__lt=cutoff)
+            # 先汇总要删除的每一天（可能从未汇总过，或汇总时当天的记录还不完整），汇总不会随记录一起丢失
+            days = old_records.annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct()
+            for day in sorted(days):
+                metering.rollup(day)
+            deleted, _ = old_records.delete()
+            self.stdout.write(self.style.SUCCESS(f"已汇总并删除 {cutoff} 之前的 {deleted} 条调用记录"))
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0007_auto_20250701_1106'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='processing_error',
+            field=models.TextField(blank=True, null=True, verbose_name='处理错误信息'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='processing_stages',
+            field=models.JSONField(blank=True, default=dict, verbose_name='处理阶段进度'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='status',
+            field=models.CharField(choices=[('processing', '处理中'), ('ready', '已完成'), ('failed', '处理失败')], db_index=True, default='ready', max_length=20, verbose_name='处理状态'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image_url',
+            field=models.URLField(blank=True, max_length=1024, verbose_name='图片URL'),
+        ),
+    ]
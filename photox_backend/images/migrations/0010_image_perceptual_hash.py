@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0009_image_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=16, verbose_name='感知哈希'),
+        ),
+    ]
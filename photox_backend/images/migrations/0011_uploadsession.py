@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('images', '0010_image_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='文件名')),
+                ('total_size', models.BigIntegerField(verbose_name='文件总大小')),
+                ('received_size', models.BigIntegerField(default=0, verbose_name='已接收大小')),
+                ('title', models.CharField(blank=True, max_length=255, verbose_name='标题')),
+                ('is_public', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('uploading', '上传中'), ('completed', '已完成')], default='uploading', max_length=20, verbose_name='状态')),
+                ('spool_path', models.CharField(max_length=1024, verbose_name='暂存文件路径')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='images.image', verbose_name='生成的图片')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL, verbose_name='所属用户')),
+            ],
+            options={
+                'verbose_name': '分片上传会话',
+                'verbose_name_plural': '分片上传会话',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
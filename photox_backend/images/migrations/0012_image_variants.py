@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0011_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, verbose_name='派生图片'),
+        ),
+    ]
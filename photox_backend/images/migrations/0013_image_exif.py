@@ -0,0 +1,85 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0012_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='camera_make',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='相机厂商'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='camera_model',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='相机型号'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='exif_extracted',
+            field=models.BooleanField(default=False, verbose_name='已解析EXIF'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='exposure_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='曝光时间(秒)'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='f_number',
+            field=models.FloatField(blank=True, null=True, verbose_name='光圈值'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='focal_length',
+            field=models.FloatField(blank=True, null=True, verbose_name='焦距(mm)'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='gps_latitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='纬度'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='gps_longitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='经度'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='iso',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='ISO'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='lens_model',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='镜头型号'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='orientation',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='EXIF方向'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='taken_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='拍摄时间'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'taken_at'], name='image_user_taken_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['camera_make', 'camera_model'], name='image_camera_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['gps_latitude', 'gps_longitude'], name='image_gps_idx'),
+        ),
+    ]
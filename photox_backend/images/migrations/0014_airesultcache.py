@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0013_image_exif'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIResultCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='缓存键')),
+                ('kind', models.CharField(db_index=True, max_length=20, verbose_name='调用类型')),
+                ('content_hash', models.CharField(db_index=True, max_length=64, verbose_name='图片内容哈希')),
+                ('model_name', models.CharField(max_length=100, verbose_name='模型')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='提示词版本与预处理参数')),
+                ('result', models.JSONField(verbose_name='结果')),
+                ('hit_count', models.PositiveIntegerField(default=0, verbose_name='命中次数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='最近使用时间')),
+            ],
+            options={
+                'verbose_name': 'AI结果缓存',
+                'verbose_name_plural': 'AI结果缓存',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0014_airesultcache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='needs_reclassify',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='待重新分类'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0015_image_needs_reclassify'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AICallRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, verbose_name='调用时间')),
+                ('kind', models.CharField(blank=True, max_length=20, verbose_name='调用类型')),
+                ('model_name', models.CharField(max_length=100, verbose_name='模型')),
+                ('endpoint', models.CharField(max_length=200, verbose_name='端点')),
+                ('image_id', models.BigIntegerField(blank=True, null=True, verbose_name='图片ID')),
+                ('outcome', models.CharField(max_length=20, verbose_name='结果')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='HTTP状态码')),
+                ('prompt_tokens', models.PositiveIntegerField(default=0, verbose_name='输入token')),
+                ('completion_tokens', models.PositiveIntegerField(default=0, verbose_name='输出token')),
+                ('latency_ms', models.PositiveIntegerField(verbose_name='延迟(毫秒)')),
+            ],
+            options={
+                'verbose_name': 'AI调用记录',
+                'verbose_name_plural': 'AI调用记录',
+            },
+        ),
+        migrations.CreateModel(
+            name='AIUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='日期')),
+                ('model_name', models.CharField(max_length=100, verbose_name='模型')),
+                ('calls', models.PositiveIntegerField(default=0, verbose_name='调用次数')),
+                ('failures', models.PositiveIntegerField(default=0, verbose_name='失败次数')),
+                ('prompt_tokens', models.BigIntegerField(default=0, verbose_name='输入token')),
+                ('completion_tokens', models.BigIntegerField(default=0, verbose_name='输出token')),
+                ('latency_p50_ms', models.PositiveIntegerField(default=0, verbose_name='p50延迟(毫秒)')),
+                ('latency_p95_ms', models.PositiveIntegerField(default=0, verbose_name='p95延迟(毫秒)')),
+                ('cost', models.FloatField(default=0, verbose_name='费用(元)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='汇总时间')),
+            ],
+            options={
+                'verbose_name': 'AI每日用量',
+                'verbose_name_plural': 'AI每日用量',
+                'ordering': ['-date', 'model_name'],
+                'unique_together': {('date', 'model_name')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:59
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0016_aicallrecord_aiusagedaily'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='perceptual_hash_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='感知哈希更新时间'),
+        ),
+    ]
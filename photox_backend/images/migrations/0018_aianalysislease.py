@@ -0,0 +1,31 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0017_image_perceptual_hash_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIAnalysisLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name='分析类型')),
+                ('token', models.CharField(max_length=32, verbose_name='租约令牌')),
+                ('expires_at', models.DateTimeField(verbose_name='过期时间')),
+                ('released', models.BooleanField(default=False, verbose_name='已释放')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='结果')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_leases', to='images.image', verbose_name='图片')),
+            ],
+            options={
+                'verbose_name': 'AI分析租约',
+                'verbose_name_plural': 'AI分析租约',
+                'unique_together': {('image', 'kind')},
+            },
+        ),
+    ]
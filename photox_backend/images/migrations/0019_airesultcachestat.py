@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0018_aianalysislease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIResultCacheStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, unique=True, verbose_name='调用类型')),
+                ('hits', models.PositiveBigIntegerField(default=0, verbose_name='命中次数')),
+                ('misses', models.PositiveBigIntegerField(default=0, verbose_name='未命中次数')),
+            ],
+            options={
+                'verbose_name': 'AI结果缓存统计',
+                'verbose_name_plural': 'AI结果缓存统计',
+            },
+        ),
+    ]
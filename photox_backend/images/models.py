@@ -7,12 +7,24 @@ from django.db import models
 # from users.models import CustomUser
 # 或者使用 settings.AUTH_USER_MODEL 避免循环导入
 from django.conf import settings
+import uuid
+from django.utils import timezone
 
 
 class Image(models.Model):
+    # 入库处理状态：异步上传时先建行为 processing，后台流水线完成后置为 ready
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PROCESSING, '处理中'),
+        (STATUS_READY, '已完成'),
+        (STATUS_FAILED, '处理失败'),
+    ]
+
     title = models.CharField(max_length=255, blank=True, verbose_name="标题")
     # image_url 存储在云存储的地址
-    image_url = models.URLField(max_length=1024, verbose_name="图片URL")
+    image_url = models.URLField(max_length=1024, blank=True, verbose_name="图片URL")
     # 使用 settings.AUTH_USER_MODEL 指向 CustomUser 模型
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='images', on_delete=models.CASCADE, verbose_name="所属用户")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
@@ -25,6 +37,34 @@ class Image(models.Model):
     ai_style_analysis = models.JSONField(default=dict, blank=True, verbose_name="AI风格分析")
     ai_emotion_analysis = models.JSONField(default=dict, blank=True, verbose_name="AI情感分析")
     user_tags = models.JSONField(default=list, blank=True, verbose_name="用户自定义标签")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_READY, db_index=True, verbose_name="处理状态")
+    # 各处理阶段进度，如 {"classify": {"status": "done", "started_at": ..., "finished_at": ...}}
+    processing_stages = models.JSONField(default=dict, blank=True, verbose_name="处理阶段进度")
+    processing_error = models.TextField(blank=True, null=True, verbose_name="处理错误信息")
+    # 原始文件内容的 SHA-256，用于秒传去重：相同内容复用已存储的对象和 AI 结果
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True, verbose_name="内容哈希")
+    # 64 位 dHash 的十六进制表示，用于近似重复/相似图片检索
+    perceptual_hash = models.CharField(max_length=16, blank=True, default='', db_index=True, verbose_name="感知哈希")
+    # 感知哈希写入时间，近似重复索引据此增量补充（异步入库和补算的哈希晚于记录创建写入）
+    perceptual_hash_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name="感知哈希更新时间")
+    # 派生图片（缩略图），如 {"256": {"width": 256, "height": 171, "webp": url, "jpeg": url}}
+    variants = models.JSONField(default=dict, blank=True, verbose_name="派生图片")
+    # 入库时从 EXIF 解析出的拍摄信息
+    taken_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name="拍摄时间")
+    camera_make = models.CharField(max_length=100, blank=True, default='', verbose_name="相机厂商")
+    camera_model = models.CharField(max_length=100, blank=True, default='', verbose_name="相机型号")
+    lens_model = models.CharField(max_length=255, blank=True, default='', db_index=True, verbose_name="镜头型号")
+    focal_length = models.FloatField(null=True, blank=True, verbose_name="焦距(mm)")
+    iso = models.PositiveIntegerField(null=True, blank=True, verbose_name="ISO")
+    exposure_time = models.FloatField(null=True, blank=True, verbose_name="曝光时间(秒)")
+    f_number = models.FloatField(null=True, blank=True, verbose_name="光圈值")
+    orientation = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="EXIF方向")
+    gps_latitude = models.FloatField(null=True, blank=True, verbose_name="纬度")
+    gps_longitude = models.FloatField(null=True, blank=True, verbose_name="经度")
+    # 是否已解析过 EXIF（没有 EXIF 的图片也会置为 True，避免回填命令重复下载）
+    exif_extracted = models.BooleanField(default=False, verbose_name="已解析EXIF")
+    # AI 分类失败（模型熔断、超时或响应无法解析）时置为 True，由 reclassify_images 命令稍后重试，不写入占位标签
+    needs_reclassify = models.BooleanField(default=False, db_index=True, verbose_name="待重新分类")
 
     def __str__(self):
         return self.title or f"Image {self.id}"
@@ -52,3 +92,145 @@ class Image(models.Model):
         verbose_name = "图片"
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'taken_at'], name='image_user_taken_at_idx'),
+            models.Index(fields=['camera_make', 'camera_model'], name='image_camera_idx'),
+            models.Index(fields=['gps_latitude', 'gps_longitude'], name='image_gps_idx'),
+        ]
+
+
+class UploadSession(models.Model):
+    """分片续传会话：客户端按偏移量逐片上传，全部收齐后 finalize 交给入库流水线"""
+    STATUS_UPLOADING = 'uploading'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, '上传中'),
+        (STATUS_COMPLETED, '已完成'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='upload_sessions', on_delete=models.CASCADE, verbose_name="所属用户")
+    filename = models.CharField(max_length=255, verbose_name="文件名")
+    total_size = models.BigIntegerField(verbose_name="文件总大小")
+    received_size = models.BigIntegerField(default=0, verbose_name="已接收大小")
+    title = models.CharField(max_length=255, blank=True, verbose_name="标题")
+    is_public = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_UPLOADING, verbose_name="状态")
+    spool_path = models.CharField(max_length=1024, verbose_name="暂存文件路径")
+    image = models.ForeignKey(Image, null=True, blank=True, on_delete=models.SET_NULL, verbose_name="生成的图片")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    def __str__(self):
+        return f"{self.filename} ({self.received_size}/{self.total_size})"
+
+    class Meta:
+        verbose_name = "分片上传会话"
+        verbose_name_plural = verbose_name
+        ordering = ['-created_at']
+
+
+class AIResultCache(models.Model):
+    """
+    AI 调用结果的持久化缓存（分类、描述、风格、情感）。
+    key 由图片内容哈希、模型名、提示词/词表指纹和预处理参数共同决定，按 last_used_at 做 LRU 淘汰。
+    """
+    key = models.CharField(max_length=64, unique=True, verbose_name="缓存键")
+    kind = models.CharField(max_length=20, db_index=True, verbose_name="调用类型")
+    content_hash = models.CharField(max_length=64, db_index=True, verbose_name="图片内容哈希")
+    model_name = models.CharField(max_length=100, verbose_name="模型")
+    params = models.JSONField(default=dict, blank=True, verbose_name="提示词版本与预处理参数")
+    result = models.JSONField(verbose_name="结果")
+    hit_count = models.PositiveIntegerField(default=0, verbose_name="命中次数")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="最近使用时间")
+
+    def __str__(self):
+        return f"{self.kind}:{self.content_hash[:12]} ({self.model_name})"
+
+    class Meta:
+        verbose_name = "AI结果缓存"
+        verbose_name_plural = verbose_name
+
+
+class AIResultCacheStat(models.Model):
+    """AI 结果缓存按调用类型累计的命中/未命中次数，多个 worker 进程共享，条目被淘汰后计数仍保留"""
+    kind = models.CharField(max_length=20, unique=True, verbose_name="调用类型")
+    hits = models.PositiveBigIntegerField(default=0, verbose_name="命中次数")
+    misses = models.PositiveBigIntegerField(default=0, verbose_name="未命中次数")
+
+    def __str__(self):
+        return f"{self.kind}: {self.hits}/{self.misses}"
+
+    class Meta:
+        verbose_name = "AI结果缓存统计"
+        verbose_name_plural = verbose_name
+
+
+class AIAnalysisLease(models.Model):
+    """
+    同一张图片同一种分析的执行租约（见 ai/single_flight.py）。
+    (image, kind) 唯一约束保证并发请求中只有一个插入成功；过期或已释放的租约用带条件的 UPDATE 接管。
+    释放时保留结果供等待的请求读取，下次取得租约时覆盖。
+    """
+    image = models.ForeignKey(Image, related_name='ai_leases', on_delete=models.CASCADE, verbose_name="图片")
+    kind = models.CharField(max_length=20, verbose_name="分析类型")
+    token = models.CharField(max_length=32, verbose_name="租约令牌")
+    expires_at = models.DateTimeField(verbose_name="过期时间")
+    released = models.BooleanField(default=False, verbose_name="已释放")
+    result = models.JSONField(null=True, blank=True, verbose_name="结果")
+
+    def __str__(self):
+        return f"{self.image_id}:{self.kind}"
+
+    class Meta:
+        verbose_name = "AI分析租约"
+        verbose_name_plural = verbose_name
+        unique_together = ('image', 'kind')
+
+
+class AICallRecord(models.Model):
+    """
+    视觉大模型的一次调用记录（只追加）。
+    image_id 不设外键，图片删除后记录仍保留用于统计；按天汇总见 AIUsageDaily。
+    """
+    created_at = models.DateTimeField(db_index=True, verbose_name="调用时间")
+    kind = models.CharField(max_length=20, blank=True, verbose_name="调用类型")
+    model_name = models.CharField(max_length=100, verbose_name="模型")
+    endpoint = models.CharField(max_length=200, verbose_name="端点")
+    image_id = models.BigIntegerField(null=True, blank=True, verbose_name="图片ID")
+    outcome = models.CharField(max_length=20, verbose_name="结果")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="HTTP状态码")
+    prompt_tokens = models.PositiveIntegerField(default=0, verbose_name="输入token")
+    completion_tokens = models.PositiveIntegerField(default=0, verbose_name="输出token")
+    latency_ms = models.PositiveIntegerField(verbose_name="延迟(毫秒)")
+
+    def __str__(self):
+        return f"{self.model_name} {self.outcome} {self.latency_ms}ms"
+
+    class Meta:
+        verbose_name = "AI调用记录"
+        verbose_name_plural = verbose_name
+
+
+class AIUsageDaily(models.Model):
+    """按天、按模型汇总的 AI 调用量、延迟和费用，由 rollup_ai_usage 命令生成"""
+    date = models.DateField(db_index=True, verbose_name="日期")
+    model_name = models.CharField(max_length=100, verbose_name="模型")
+    calls = models.PositiveIntegerField(default=0, verbose_name="调用次数")
+    failures = models.PositiveIntegerField(default=0, verbose_name="失败次数")
+    prompt_tokens = models.BigIntegerField(default=0, verbose_name="输入token")
+    completion_tokens = models.BigIntegerField(default=0, verbose_name="输出token")
+    latency_p50_ms = models.PositiveIntegerField(default=0, verbose_name="p50延迟(毫秒)")
+    latency_p95_ms = models.PositiveIntegerField(default=0, verbose_name="p95延迟(毫秒)")
+    cost = models.FloatField(default=0, verbose_name="费用(元)")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="汇总时间")
+
+    def __str__(self):
+        return f"{self.date} {self.model_name}"
+
+    class Meta:
+        verbose_name = "AI每日用量"
+        verbose_name_plural = verbose_name
+        unique_together = ('date', 'model_name')
+        ordering = ['-date', 'model_name']
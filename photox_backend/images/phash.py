@@ -0,0 +1,233 @@
+# images/phash.py
+"""
+感知哈希（dHash）与近似重复检索
+
+每张图片入库时计算 64 位 dHash，存入 Image.perceptual_hash（16 位十六进制）。
+进程内维护一棵按汉明距离组织的 BK 树，查询“相似/近似重复”图片时只访问距离范围内的分支，
+无需扫描整张表。索引可由管理命令 build_phash_index 预先构建并持久化为 JSON 文件（只保存图片 id 和哈希，
+加载时重新建树，不使用 pickle，文件被篡改也不会执行代码），各进程启动后加载该文件，再按 perceptual_hash_at 增量补充此后写入哈希的图片
+（包括先建记录、后由异步入库或 build_phash_index 补算哈希的旧图片）。
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from PIL import Image as PILImage
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8  # 8x8 = 64 位
+# 增量刷新时回看的时间：写入时间早于水位线但稍后才提交的事务也能被补上（已索引的 id 会跳过）
+REFRESH_OVERLAP = timedelta(seconds=60)
+# 持久化文件的格式版本，不一致时从数据库重新构建
+INDEX_FORMAT = 2
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """计算差值哈希：缩放为 (hash_size+1) x hash_size 灰度图，比较相邻像素明暗"""
+    small = image.convert('L').resize((hash_size + 1, hash_size), PILImage.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (1 if pixels[offset + col] < pixels[offset + col + 1] else 0)
+    return value
+
+
+def to_hex(value):
+    return f"{value:016x}"
+
+
+def from_hex(text):
+    return int(text, 16)
+
+
+def hamming(a, b):
+    """两个哈希值的汉明距离"""
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树，节点为 [hash, [image_id, ...], {distance: child}]"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item_id):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item_id], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item_id], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """返回 [(distance, item_id), ...]，按距离升序"""
+        results = []
+        if self.root is None:
+            return results
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item_id) for item_id in node[1])
+            # 三角不等式：只有边权在 [d - r, d + r] 范围内的子树可能命中
+            low, high = distance - max_distance, distance + max_distance
+            for edge, child in node[2].items():
+                if low <= edge <= high:
+                    stack.append(child)
+        results.sort()
+        return results
+
+
+class PerceptualIndex:
+    """进程内的近似重复索引，支持从持久化文件加载和按哈希写入时间增量刷新"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.tree = BKTree()
+        self.indexed_ids = set()
+        # 已索引的最晚哈希写入时间
+        self.watermark = None
+        self.loaded_mtime = None
+        self.lock = threading.Lock()
+
+    def _reset(self):
+        self.tree = BKTree()
+        self.indexed_ids = set()
+        self.watermark = None
+
+    def _add_rows(self, rows):
+        for image_id, hex_hash, hashed_at in rows:
+            if image_id not in self.indexed_ids:
+                self.tree.add(from_hex(hex_hash), image_id)
+                self.indexed_ids.add(image_id)
+            if self.watermark is None or hashed_at > self.watermark:
+                self.watermark = hashed_at
+
+    def _rows(self):
+        from .models import Image
+
+        queryset = Image.objects.exclude(perceptual_hash='')
+        if self.watermark is not None:
+            queryset = queryset.filter(perceptual_hash_at__gte=self.watermark - REFRESH_OVERLAP)
+        return queryset.order_by('perceptual_hash_at').values_list('id', 'perceptual_hash', 'perceptual_hash_at')
+
+    def _load(self):
+        """从持久化文件恢复索引：按保存的 (id, 哈希) 重新建树；格式不对时清空，由数据库重新构建"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('format') != INDEX_FORMAT:
+                raise ValueError(f"不支持的索引格式: {state.get('format')}")
+            entries = [(int(image_id), from_hex(hex_hash)) for image_id, hex_hash in state['entries']]
+            watermark = datetime.fromisoformat(state['watermark']) if state.get('watermark') else None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"感知哈希索引文件无效，从数据库重新构建: {str(e)}")
+            self._reset()
+            return
+        self._reset()
+        for image_id, value in entries:
+            if image_id not in self.indexed_ids:
+                self.tree.add(value, image_id)
+                self.indexed_ids.add(image_id)
+        self.watermark = watermark
+        logger.info(f"已加载感知哈希索引: {self.tree.size} 条, 哈希更新至 {self.watermark}")
+
+    def refresh(self):
+        """加载持久化文件（如有更新），再补充哈希写入时间晚于水位线的图片"""
+        with self.lock:
+            if self.path and os.path.exists(self.path):
+                mtime = os.path.getmtime(self.path)
+                if mtime != self.loaded_mtime:
+                    self._load()
+                    self.loaded_mtime = mtime
+
+            self._add_rows(self._rows().iterator())
+
+    def rebuild(self):
+        """从数据库全量重建索引"""
+        with self.lock:
+            self._reset()
+            self._add_rows(self._rows().iterator())
+
+    def _entries(self):
+        """树中所有 (image_id, 十六进制哈希)"""
+        entries = []
+        stack = [self.tree.root] if self.tree.root is not None else []
+        while stack:
+            node = stack.pop()
+            entries.extend([image_id, to_hex(node[0])] for image_id in node[1])
+            stack.extend(node[2].values())
+        return entries
+
+    def save(self):
+        """持久化为 JSON 文件（先写临时文件再原子替换）"""
+        tmp_path = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self.lock:
+            state = {
+                'format': INDEX_FORMAT,
+                'watermark': self.watermark.isoformat() if self.watermark else None,
+                'entries': self._entries(),
+            }
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self.loaded_mtime = os.path.getmtime(self.path)
+
+    def search(self, hex_hash, max_distance):
+        self.refresh()
+        return self.tree.search(from_hex(hex_hash), max_distance)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """获取进程内共享的感知哈希索引"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PerceptualIndex(settings.PHASH_INDEX_PATH)
+    return _index
+
+
+def find_similar(hex_hash, max_distance=None, exclude_id=None):
+    """查找汉明距离不超过 max_distance 的图片，返回 [(distance, image_id), ...]"""
+    if not hex_hash:
+        return []
+    if max_distance is None:
+        max_distance = settings.PHASH_MAX_DISTANCE
+    return [(d, image_id) for d, image_id in get_index().search(hex_hash, max_distance) if image_id != exclude_id]
+
+
+def near_duplicates_for_user(image, max_distance=None):
+    """上传时的重复提示：返回该用户自己已有的近似重复图片 [{"id", "distance"}, ...]"""
+    from .models import Image
+
+    matches = find_similar(image.perceptual_hash, max_distance, exclude_id=image.id)
+    if not matches:
+        return []
+    owned = set(Image.objects.filter(
+        id__in=[image_id for _, image_id in matches],
+        user_id=image.user_id,
+    ).values_list('id', flat=True))
+    return [{"id": image_id, "distance": distance} for distance, image_id in matches if image_id in owned]
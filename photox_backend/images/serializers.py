@@ -1,8 +1,9 @@
 import logging
 import json
 import ast
+from django.conf import settings
 from rest_framework import serializers
-from .models import Image
+from .models import Image, UploadSession
 from community.models import Like, Follow
 from users.serializers import UserSerializer
 
@@ -65,6 +66,7 @@ class ImageSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)  # 使用UserSerializer序列化用户信息
     is_following_author = serializers.SerializerMethodField()  # 添加关注状态字段
     is_liked = serializers.SerializerMethodField()  # 添加当前用户是否点赞
+    exif = serializers.SerializerMethodField()  # 拍摄信息
 
     class Meta:
         model = Image
@@ -72,7 +74,7 @@ class ImageSerializer(serializers.ModelSerializer):
             'id', 'image_url', 'title', 'tags', 'tags_list',
             'user', 'created_at', 'is_public',
             'category_id', 'category', 'colors', 'like_count', 
-            'is_following_author', 'is_liked'
+            'is_following_author', 'is_liked', 'status', 'needs_reclassify', 'variants', 'exif'
         ]
     
     def get_tags_list(self, obj):
@@ -105,6 +107,25 @@ class ImageSerializer(serializers.ModelSerializer):
             ).exists()
         return False
 
+    def get_exif(self, obj):
+        """拍摄信息；GPS 坐标属于隐私，只返回给上传者本人"""
+        exif = {
+            'taken_at': serializers.DateTimeField().to_representation(obj.taken_at) if obj.taken_at else None,
+            'camera_make': obj.camera_make,
+            'camera_model': obj.camera_model,
+            'lens_model': obj.lens_model,
+            'focal_length': obj.focal_length,
+            'iso': obj.iso,
+            'exposure_time': obj.exposure_time,
+            'f_number': obj.f_number,
+            'orientation': obj.orientation,
+        }
+        request = self.context.get('request')
+        if request and request.user.is_authenticated and request.user.id == obj.user_id:
+            exif['gps_latitude'] = obj.gps_latitude
+            exif['gps_longitude'] = obj.gps_longitude
+        return exif
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
 
@@ -151,4 +172,25 @@ class ImageUploadSerializer(serializers.Serializer):
     """处理图片上传请求"""
     image = serializers.ImageField()
     title = serializers.CharField(required=False, max_length=255)
-    is_public = serializers.BooleanField(required=False, default=False)
\ No newline at end of file
+    is_public = serializers.BooleanField(required=False, default=False)
+
+
+class UploadSessionCreateSerializer(serializers.Serializer):
+    """创建分片上传会话"""
+    filename = serializers.CharField(max_length=255)
+    total_size = serializers.IntegerField(min_value=1)
+    title = serializers.CharField(required=False, allow_blank=True, max_length=255)
+    is_public = serializers.BooleanField(required=False, default=False)
+
+    def validate_total_size(self, value):
+        if value > settings.IMAGE_CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"文件大小超过上限 {settings.IMAGE_CHUNKED_UPLOAD_MAX_SIZE} 字节")
+        return value
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """分片上传会话的进度信息"""
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'total_size', 'received_size', 'status', 'image', 'created_at', 'updated_at']
\ No newline at end of file
@@ -0,0 +1,212 @@
+# images/storage.py
+"""
+图片存储后端
+
+上传、删除等操作统一通过 StorageBackend 接口完成，具体实现由 settings.IMAGE_STORAGE_BACKEND 选择：
+  - 'qiniu'：七牛云对象存储（默认）
+  - 'local'：本地目录，通过 MEDIA_URL 对外提供访问，便于离线压测和开发调试
+"""
+import logging
+import os
+import shutil
+import threading
+import uuid
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend:
+    """存储后端接口，key 为对象在存储中的路径（如 images/<sha256>.jpg）"""
+
+    name = None
+
+    def put(self, key, data):
+        """上传内存中的字节数据，成功返回外链 URL，失败返回 None"""
+        raise NotImplementedError
+
+    def put_stream(self, key, fileobj, size=None):
+        """从文件对象流式上传，成功返回外链 URL，失败返回 None"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """删除对象，成功（或对象本就不存在）返回 True"""
+        raise NotImplementedError
+
+    def batch_delete(self, keys):
+        """批量删除，返回 {key: 是否成功}"""
+        return {key: self.delete(key) for key in keys}
+
+    def url(self, key):
+        """对象的外链 URL"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def key_from_url(self, url):
+        """从外链 URL 还原存储 key，不属于本后端的 URL 返回 None"""
+        raise NotImplementedError
+
+
+class QiniuStorageBackend(StorageBackend):
+    """七牛云对象存储，认证对象和 BucketManager 在进程内复用"""
+
+    name = 'qiniu'
+
+    def __init__(self):
+        import qiniu
+
+        self._qiniu = qiniu
+        self.auth = qiniu.Auth(settings.QINIU_ACCESS_KEY, settings.QINIU_SECRET_KEY)
+        self.bucket = qiniu.BucketManager(self.auth)
+        self.bucket_name = settings.QINIU_BUCKET_NAME
+
+    def _token(self, key):
+        return self.auth.upload_token(self.bucket_name, key, 3600)
+
+    def _check(self, key, ret, info):
+        if not ret or ret.get('key') != key:
+            logger.error(f"上传到七牛云失败: {key}, {info.text_body}")
+            return None
+        return self.url(key)
+
+    def put(self, key, data):
+        ret, info = self._qiniu.put_data(self._token(key), key, data)
+        return self._check(key, ret, info)
+
+    def put_stream(self, key, fileobj, size=None):
+        if size is None:
+            size = os.fstat(fileobj.fileno()).st_size
+        ret, info = self._qiniu.put_stream(
+            self._token(key), key, fileobj, os.path.basename(key), size, bucket_name=self.bucket_name
+        )
+        return self._check(key, ret, info)
+
+    def delete(self, key):
+        ret, info = self.bucket.delete(self.bucket_name, key)
+        # 612：对象不存在，视为已删除
+        if info.status_code in (200, 612):
+            return True
+        logger.error(f"从七牛云删除失败: {key}, {info.text_body}")
+        return False
+
+    def batch_delete(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        ret, info = self.bucket.batch(self._qiniu.build_batch_delete(self.bucket_name, keys))
+        if not isinstance(ret, list):
+            logger.error(f"七牛云批量删除失败: {info.text_body}")
+            return {key: False for key in keys}
+        return {key: item.get('code') in (200, 612) for key, item in zip(keys, ret)}
+
+    def url(self, key):
+        return f"{settings.QINIU_IMAGE_DOMAIN.rstrip('/')}/{key}"
+
+    def exists(self, key):
+        ret, info = self.bucket.stat(self.bucket_name, key)
+        return info.status_code == 200
+
+    def key_from_url(self, url):
+        prefix = f"{settings.QINIU_IMAGE_DOMAIN.rstrip('/')}/"
+        if url.startswith(prefix):
+            return url[len(prefix):]
+        # 历史数据可能使用其他绑定域名，按 URL 路径还原
+        parsed = urlparse(url)
+        if parsed.netloc.endswith('clouddn.com'):
+            return parsed.path.lstrip('/')
+        return None
+
+
+class LocalStorageBackend(StorageBackend):
+    """本地目录存储，文件写入 IMAGE_LOCAL_STORAGE_ROOT，由 MEDIA_URL 对外提供"""
+
+    name = 'local'
+
+    @property
+    def root(self):
+        return str(settings.IMAGE_LOCAL_STORAGE_ROOT)
+
+    @property
+    def base_url(self):
+        return f"{settings.IMAGE_LOCAL_STORAGE_BASE_URL.rstrip('/')}{settings.MEDIA_URL}"
+
+    def path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"非法的存储路径: {key}")
+        return path
+
+    def _write(self, key, write):
+        """先写临时文件再原子替换，并发写同一个 key 时读方不会看到半截文件"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"写入本地存储失败: {key}, {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        return self.url(key)
+
+    def put(self, key, data):
+        return self._write(key, lambda f: f.write(data))
+
+    def put_stream(self, key, fileobj, size=None):
+        return self._write(key, lambda f: shutil.copyfileobj(fileobj, f, 1024 * 1024))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"删除本地文件失败: {key}, {str(e)}")
+            return False
+        return True
+
+    def url(self, key):
+        return f"{self.base_url}{key}"
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def key_from_url(self, url):
+        for prefix in (self.base_url, settings.MEDIA_URL):
+            if url.startswith(prefix):
+                return url[len(prefix):]
+        path = urlparse(url).path
+        if path.startswith(settings.MEDIA_URL):
+            return path[len(settings.MEDIA_URL):]
+        return None
+
+
+STORAGE_BACKENDS = {
+    QiniuStorageBackend.name: QiniuStorageBackend,
+    LocalStorageBackend.name: LocalStorageBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_storage(name=None):
+    """获取存储后端实例（同名后端在进程内只创建一次），默认使用 IMAGE_STORAGE_BACKEND"""
+    name = name or settings.IMAGE_STORAGE_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        if name not in STORAGE_BACKENDS:
+            raise ValueError(f"未知的存储后端: {name}")
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = STORAGE_BACKENDS[name]()
+                _backends[name] = backend
+    return backend
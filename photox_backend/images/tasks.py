@@ -1,13 +1,13 @@
-from .models import Image
-from image_classifier import ImageClassifier
+from PIL import Image as PILImage
+
+from .ai import local_model
 
-def ai_image_analysis(path):
 
-    # 初始化图像分类器
-    classifier = ImageClassifier()
+def ai_image_analysis(path):
 
-    # 使用分类器进行图像预测
-    results = classifier.predict(path)
+    # 使用进程内共用的本地模型进行图像预测（模型只加载一次，并发调用合并推理）
+    with PILImage.open(path) as image:
+        results = local_model.predict(image)
 
     # 提取预测标签并转化为逗号分隔的字符串
     tags = ', '.join([label for label, confidence in results])
@@ -1,3 +1,1344 @@
-from django.test import TestCase
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image as PILImage
+from PIL.ExifTags import Base, GPS, IFD
+from PIL.JpegImagePlugin import JpegImageFile
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from albums.models import Album
+from tags.models import Tag
+from . import ingest, phash
+from .ai import (
+    backends, cascade, client, local_model, metering, mock_server, resilience, result_cache, shortlist, single_flight,
+    vocabulary,
+)
+from .analysis import run_analyses, stream_description
+from .ai.decode import DecodedImage, prepare_payload
+from .ai.style_analysis import STYLE_MODEL, analyze_image_emotion, analyze_image_style, analyze_image_style_emotion
+from .models import AICallRecord, AIResultCache, AIUsageDaily, Image
+from .storage import get_storage
+
+User = get_user_model()
+
+
+def make_upload(name='test.jpg', size=(64, 48), color=(200, 30, 30), exif=None):
+    """生成一张内存中的测试图片"""
+    buf = io.BytesIO()
+    PILImage.new('RGB', size, color).save(buf, format='JPEG', **({'exif': exif} if exif else {}))
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/jpeg')
+
+
+def make_exif(make='Canon', model='EOS R5', taken='2024:05:01 08:30:00', gps=True):
+    """构造带拍摄参数和 GPS 的 EXIF"""
+    exif = PILImage.Exif()
+    exif[Base.Make] = make
+    exif[Base.Model] = model
+    exif[Base.Orientation] = 6
+    exif_ifd = exif.get_ifd(IFD.Exif)
+    exif_ifd[Base.DateTimeOriginal] = taken
+    exif_ifd[Base.FocalLength] = 35.0
+    exif_ifd[Base.FNumber] = 2.8
+    exif_ifd[Base.ExposureTime] = 0.004
+    exif_ifd[Base.ISOSpeedRatings] = 200
+    exif_ifd[Base.LensModel] = 'RF24-70mm F2.8'
+    if gps:
+        gps_ifd = exif.get_ifd(IFD.GPSInfo)
+        gps_ifd[GPS.GPSLatitudeRef] = 'N'
+        gps_ifd[GPS.GPSLatitude] = (30.0, 32.0, 24.0)
+        gps_ifd[GPS.GPSLongitudeRef] = 'E'
+        gps_ifd[GPS.GPSLongitude] = (114.0, 21.0, 36.0)
+    return exif
+
+
+FAKE_CLASSIFICATION = {
+    "category_id": 1,
+    "category_name": "风景",
+    "tags": [{"id": 7, "name": "风景"}, {"id": 11, "name": "日落"}],
+    "model_used": "test-model",
+}
+
+
+class SyncUploadTestCase(TestCase):
+    """同步上传测试用例"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='syncer',
+            email='syncer@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    @mock.patch('images.storage.QiniuStorageBackend.put', return_value='http://cdn.example.com/images/s.jpg')
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_upload_uses_single_in_memory_decode(self, mock_classify, mock_upload):
+        """分类收到缩小后的 JPEG 字节，上传收到原始字节，不再经过临时文件"""
+        upload = make_upload(size=(2048, 1024), color=(10, 120, 200))
+        original = upload.read()
+        upload.seek(0)
+
+        response = self.client.post('/api/v1/images/upload/', {'image': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertIsNone(mock_classify.call_args.kwargs['image_path'])
+        payload = PILImage.open(io.BytesIO(mock_classify.call_args.kwargs['image_bytes']))
+        self.assertEqual(payload.size, (1024, 512))
+        # 第一次上传为原图，其后为派生图片
+        self.assertEqual(mock_upload.call_args_list[0].kwargs['data'], original)
+        self.assertTrue(response.data['colors'])
+
+    @mock.patch('images.storage.QiniuStorageBackend.put')
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_upload_generates_variants(self, mock_classify, mock_upload):
+        """入库时生成各尺寸的 WebP 和渐进式 JPEG，小于原图的尺寸才缩放"""
+        mock_upload.side_effect = lambda key, data: f"http://cdn.example.com/{key}"
+        response = self.client.post('/api/v1/images/upload/', {
+            'image': make_upload(size=(1000, 500), color=(90, 90, 200)),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        variants = response.data['variants']
+        self.assertEqual(sorted(variants), ['1600', '256', '768'])
+        self.assertEqual((variants['256']['width'], variants['256']['height']), (256, 128))
+        self.assertEqual((variants['1600']['width'], variants['1600']['height']), (1000, 500))
+        self.assertTrue(variants['768']['webp'].endswith('_768.webp'))
+
+        uploaded = {call.kwargs['key']: call.kwargs['data'] for call in mock_upload.call_args_list}
+        jpeg = PILImage.open(io.BytesIO(uploaded[variants['256']['jpeg'].split('cdn.example.com/')[1]]))
+        self.assertEqual(jpeg.size, (256, 128))
+        self.assertTrue(jpeg.info.get('progressive'))
+
+    @mock.patch('images.storage.QiniuStorageBackend.put')
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_variants_follow_exif_orientation(self, mock_classify, mock_upload):
+        """EXIF 方向为 6（需顺时针旋转 90°）的横向原图，派生图片按摆正后的竖向尺寸生成"""
+        mock_upload.side_effect = lambda key, data: f"http://cdn.example.com/{key}"
+        response = self.client.post('/api/v1/images/upload/', {
+            'image': make_upload(size=(2000, 1000), exif=make_exif()),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        variants = response.data['variants']
+        self.assertEqual((variants['256']['width'], variants['256']['height']), (128, 256))
+        self.assertEqual((variants['1600']['width'], variants['1600']['height']), (800, 1600))
+
+    @mock.patch('images.storage.QiniuStorageBackend.put', return_value='http://cdn.example.com/images/d.jpg')
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_duplicate_upload_reuses_previous_results(self, mock_classify, mock_upload):
+        """相同内容再次上传时复用存储对象和 AI 结果，不再调用模型和云存储"""
+        first = self.client.post('/api/v1/images/upload/', {'image': make_upload('a.jpg')}, format='multipart')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        uploads = mock_upload.call_count
+
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        self.client.force_authenticate(user=other)
+        second = self.client.post('/api/v1/images/upload/', {'image': make_upload('b.jpg')}, format='multipart')
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(mock_classify.call_count, 1)
+        self.assertEqual(mock_upload.call_count, uploads)
+        self.assertNotEqual(first.data['id'], second.data['id'])
+        self.assertEqual(second.data['image_url'], first.data['image_url'])
+        self.assertEqual(second.data['tags'], first.data['tags'])
+        self.assertEqual(second.data['category_id'], first.data['category_id'])
+        self.assertEqual(second.data['variants'], first.data['variants'])
+        self.assertTrue(Album.objects.filter(user=other, title='风景相册').exists())
+
+
+@override_settings(IMAGE_INGEST_EAGER=True)
+class AsyncUploadTestCase(TestCase):
+    """异步入库上传测试用例"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='uploader',
+            email='uploader@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    @mock.patch('images.storage.QiniuStorageBackend.put', return_value='http://cdn.example.com/images/test.jpg')
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_async_upload_returns_202_and_completes(self, mock_classify, mock_upload):
+        """异步上传立即返回 202，后台处理完成后状态接口返回各阶段进度"""
+        response = self.client.post('/api/v1/images/upload/?mode=async', {
+            'image': make_upload(),
+            'title': '异步上传',
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        image_id = response.data['data']['id']
+
+        response = self.client.get(response.data['status_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertEqual(data['status'], Image.STATUS_READY)
+        for stage in ('colors', 'classify', 'upload', 'variants', 'album'):
+            self.assertEqual(data['stages'][stage]['status'], 'done')
+        self.assertEqual(data['image']['image_url'], 'http://cdn.example.com/images/test.jpg')
+
+        image = Image.objects.get(id=image_id)
+        self.assertEqual(image.get_tags_as_list(), ['风景', '日落'])
+        self.assertTrue(Album.objects.filter(user=self.user, title='风景相册', images=image).exists())
+
+    @mock.patch('images.storage.QiniuStorageBackend.put', return_value=None)
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_async_upload_failure_is_reported(self, mock_classify, mock_upload):
+        """上传阶段失败时图片标记为 failed 并记录失败阶段"""
+        response = self.client.post('/api/v1/images/upload/?mode=async', {
+            'image': make_upload(),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        data = self.client.get(response.data['status_url']).data['data']
+        self.assertEqual(data['status'], Image.STATUS_FAILED)
+        self.assertEqual(data['stages']['upload']['status'], 'failed')
+        self.assertNotIn('image', data)
+
+
+class BatchUploadTestCase(TestCase):
+    """批量上传测试用例"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='batcher',
+            email='batcher@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    @override_settings(IMAGE_BATCH_UPLOAD_CONCURRENCY=4)
+    @mock.patch('images.storage.QiniuStorageBackend.put')
+    @mock.patch('images.ingest.image_classification')
+    def test_batch_upload_runs_files_concurrently(self, mock_classify, mock_upload):
+        """多个文件的 I/O 阶段并发执行，总耗时接近单个文件而不是总和"""
+        def slow_classify(**kwargs):
+            time.sleep(0.3)
+            return FAKE_CLASSIFICATION
+
+        mock_classify.side_effect = slow_classify
+        mock_upload.side_effect = lambda **kwargs: f"http://cdn.example.com/{kwargs['key']}"
+
+        files = [make_upload(f'p{i}.jpg', color=(i * 40, 10, 10)) for i in range(4)]
+        decode_threads = []
+        from_upload = DecodedImage.from_upload.__func__
+
+        def record_decode(cls, uploaded_file):
+            decode_threads.append(threading.current_thread().name)
+            return from_upload(cls, uploaded_file)
+
+        started = time.monotonic()
+        with mock.patch.object(DecodedImage, 'from_upload', classmethod(record_decode)):
+            response = self.client.post('/api/v1/images/batch-upload/', {'images': files}, format='multipart')
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['success_count'], 4)
+        self.assertEqual([r['title'] for r in response.data['results']], ['p0.jpg', 'p1.jpg', 'p2.jpg', 'p3.jpg'])
+        self.assertLess(elapsed, 0.3 * 4)
+        # 文件在工作线程中逐个读取解码，请求线程不整批持有解码结果
+        self.assertEqual(len(decode_threads), 4)
+        self.assertTrue(all(name.startswith('batch-upload') for name in decode_threads))
+        # 上传结束后不再保留该用户的并发名额
+        self.assertNotIn(self.user.id, ingest._user_slots)
+
+    @mock.patch('images.storage.QiniuStorageBackend.put')
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_batch_upload_reports_per_file_errors(self, mock_classify, mock_upload):
+        """部分文件失败时返回 207 和逐个文件的错误信息"""
+        bad = make_upload('bad.jpg', color=(0, 0, 0))
+        bad_hash = hashlib.sha256(bad.read()).hexdigest()
+        bad.seek(0)
+        mock_upload.side_effect = lambda **kwargs: None if bad_hash in kwargs['key'] else 'http://cdn.example.com/ok.jpg'
+
+        response = self.client.post('/api/v1/images/batch-upload/', {
+            'images': [make_upload('good.jpg'), bad],
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['success_count'], 1)
+        self.assertEqual(response.data['error_count'], 1)
+        self.assertEqual(response.data['errors'][0]['file'], 'bad.jpg')
+
+
+class PerceptualHashTestCase(TestCase):
+    """感知哈希与 BK 树检索测试用例"""
+
+    def setUp(self):
+        phash._index = None
+        self.user = User.objects.create_user(username='hasher', email='h@example.com', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_bktree_matches_linear_scan(self):
+        """BK 树查询结果与线性扫描一致"""
+        rng = random.Random(42)
+        values = [rng.getrandbits(64) for _ in range(2000)]
+        tree = phash.BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+
+        query = values[7] ^ 0b1011  # 与第 7 个值相差 3 位
+        expected = sorted((phash.hamming(query, v), i) for i, v in enumerate(values) if phash.hamming(query, v) <= 6)
+        self.assertEqual(tree.search(query, 6), expected)
+        self.assertIn((3, 7), tree.search(query, 6))
+
+    @override_settings(PHASH_INDEX_PATH='/nonexistent/phash.pkl')
+    def test_similar_endpoint_returns_near_duplicates(self):
+        """缩放后的同一张图能被检索为近似重复，内容不同的图片不会出现"""
+        base = PILImage.linear_gradient('L').convert('RGB')
+        near = phash.to_hex(phash.dhash(base.resize((128, 128))))
+        far = phash.to_hex(phash.dhash(base.rotate(90)))
+        original = Image.objects.create(user=self.user, image_url='http://x/1.jpg',
+                                        perceptual_hash=phash.to_hex(phash.dhash(base)))
+        resized = Image.objects.create(user=self.user, image_url='http://x/2.jpg', perceptual_hash=near)
+        Image.objects.create(user=self.user, image_url='http://x/3.jpg', perceptual_hash=far)
+
+        response = self.client.get(f'/api/v1/images/{original.id}/similar/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['data']], [resized.id])
+
+
+    @override_settings(PHASH_INDEX_PATH='/nonexistent/phash.pkl')
+    def test_index_picks_up_hashes_written_later(self):
+        """先建记录、后写入哈希的旧图片（异步入库、补算）在增量刷新后可被检索"""
+        value = phash.to_hex(phash.dhash(PILImage.linear_gradient('L').convert('RGB')))
+        pending = Image.objects.create(user=self.user, image_url='http://x/1.jpg')
+        Image.objects.create(user=self.user, image_url='http://x/2.jpg', perceptual_hash='ffffffffffffffff')
+        self.assertEqual(phash.find_similar(value), [])
+
+        Image.objects.filter(id=pending.id).update(perceptual_hash=value, perceptual_hash_at=timezone.now())
+        self.assertEqual(phash.find_similar(value), [(0, pending.id)])
+        self.assertEqual(phash.get_index().tree.size, 2)
+
+    def test_backfill_matches_ingest_hash(self):
+        """补算的哈希与入库时一样按 EXIF 方向摆正后计算，同一张照片的新旧哈希一致"""
+        buf = io.BytesIO()
+        PILImage.linear_gradient('L').resize((400, 200)).convert('RGB').save(buf, format='JPEG', exif=make_exif())
+        data = buf.getvalue()
+        image = Image.objects.create(user=self.user, image_url='http://x/old.jpg')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        response = mock.Mock(content=data, **{'raise_for_status.return_value': None})
+        with override_settings(PHASH_INDEX_PATH=os.path.join(directory, 'phash.json')), \
+                mock.patch('images.management.commands.build_phash_index.requests.get', return_value=response):
+            call_command('build_phash_index', stdout=io.StringIO())
+        image.refresh_from_db()
+        self.assertEqual(image.perceptual_hash, DecodedImage(data).perceptual_hash)
+
+    def test_index_file_roundtrip(self):
+        """索引以 JSON 保存，加载后重新建树；无效文件被忽略并从数据库重建"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'index', 'phash.json')
+        for i, value in enumerate(['0000000000000000', '000000000000000f', 'ffffffffffffffff']):
+            Image.objects.create(user=self.user, image_url=f'http://x/{i}.jpg', perceptual_hash=value,
+                                 perceptual_hash_at=timezone.now())
+        saved = phash.PerceptualIndex(path)
+        saved.rebuild()
+        saved.save()
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['format'], phash.INDEX_FORMAT)
+
+        loaded = phash.PerceptualIndex(path)
+        with mock.patch.object(loaded, '_rows', return_value=Image.objects.none().values_list('id')):
+            loaded.refresh()
+        self.assertEqual((loaded.tree.size, loaded.watermark), (3, saved.watermark))
+        self.assertEqual([d for d, _ in loaded.tree.search(0, 4)], [0, 4])
+
+        with open(path, 'wb') as f:
+            f.write(b'\x80\x04not json')
+        broken = phash.PerceptualIndex(path)
+        broken.refresh()
+        self.assertEqual(broken.tree.size, 3)
+
+
+@override_settings(IMAGE_INGEST_EAGER=True, IMAGE_UPLOAD_CHUNK_MAX_SIZE=1024)
+class ChunkedUploadTestCase(TestCase):
+    """分片续传上传测试用例"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='chunker', email='chunker@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        upload = make_upload('big.jpg', size=(256, 256), color=(30, 160, 90))
+        self.data = upload.read()
+
+    def put_chunk(self, upload_id, offset, chunk):
+        return self.client.put(f'/api/v1/images/uploads/{upload_id}/?offset={offset}', chunk,
+                               content_type='application/octet-stream')
+
+    @mock.patch('images.storage.QiniuStorageBackend.put', return_value='http://cdn.example.com/images/big.jpg')
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_resume_after_interrupted_chunk(self, mock_classify, mock_upload):
+        """偏移量不一致时返回 409 和已接收位置，客户端从该位置续传后 finalize 交给入库流程"""
+        response = self.client.post('/api/v1/images/uploads/', {
+            'filename': 'big.jpg', 'total_size': len(self.data), 'title': '大图',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload_id = response.data['data']['id']
+
+        self.assertEqual(self.put_chunk(upload_id, 0, self.data[:1000]).status_code, status.HTTP_200_OK)
+        # 模拟客户端丢失了上一次响应，从错误的位置重发
+        response = self.put_chunk(upload_id, 2000, self.data[2000:3000])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Upload-Offset'], '1000')
+
+        offset = int(self.client.get(f'/api/v1/images/uploads/{upload_id}/')['Upload-Offset'])
+        while offset < len(self.data):
+            response = self.put_chunk(upload_id, offset, self.data[offset:offset + 1000])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            offset = response.data['data']['received_size']
+
+        response = self.client.post(f'/api/v1/images/uploads/{upload_id}/finalize/', {
+            'sha256': hashlib.sha256(self.data).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(mock_upload.call_args_list[0].kwargs['data'], self.data)
+
+        image = Image.objects.get(id=response.data['data']['id'])
+        self.assertEqual(image.status, Image.STATUS_READY)
+        self.assertEqual(image.title, '大图')
+
+    def test_finalize_rejects_incomplete_upload(self):
+        """未收齐全部分片时不能 finalize，单个分片超过上限返回 413"""
+        response = self.client.post('/api/v1/images/uploads/', {
+            'filename': 'big.jpg', 'total_size': len(self.data),
+        }, format='json')
+        upload_id = response.data['data']['id']
+
+        response = self.put_chunk(upload_id, 0, self.data[:2048])
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        response = self.client.post(f'/api/v1/images/uploads/{upload_id}/finalize/', format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+
+class LocalStorageTestCase(TestCase):
+    """本地存储后端测试用例"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        overrides = override_settings(
+            IMAGE_STORAGE_BACKEND='local',
+            IMAGE_LOCAL_STORAGE_ROOT=self.root,
+            IMAGE_LOCAL_STORAGE_BASE_URL='http://testserver',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user(username='storer', email='storer@example.com', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_backend_roundtrip(self):
+        """put/put_stream/exists/url/key_from_url/batch_delete 行为一致"""
+        storage = get_storage()
+        url = storage.put('images/a.jpg', b'abc')
+        self.assertEqual(url, 'http://testserver/media/images/a.jpg')
+        self.assertEqual(storage.key_from_url(url), 'images/a.jpg')
+        self.assertEqual(storage.put_stream('images/b.jpg', io.BytesIO(b'def')), storage.url('images/b.jpg'))
+        self.assertTrue(storage.exists('images/b.jpg'))
+
+        self.assertEqual(storage.batch_delete(['images/a.jpg', 'images/b.jpg']),
+                         {'images/a.jpg': True, 'images/b.jpg': True})
+        self.assertFalse(storage.exists('images/a.jpg'))
+        with self.assertRaises(ValueError):
+            storage.put('../escape.jpg', b'x')
+
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_shared_object_deleted_with_last_reference(self, mock_classify):
+        """去重后共享同一存储对象的图片，最后一条记录删除时才删除文件"""
+        first = self.client.post('/api/v1/images/upload/', {'image': make_upload('a.jpg')}, format='multipart')
+        second = self.client.post('/api/v1/images/upload/', {'image': make_upload('b.jpg')}, format='multipart')
+        self.assertEqual(first.data['image_url'], second.data['image_url'])
+        key = get_storage().key_from_url(first.data['image_url'])
+        self.assertTrue(get_storage().exists(key))
+
+        self.client.delete(f"/api/v1/images/{first.data['id']}/")
+        self.assertTrue(get_storage().exists(key))
+        self.client.delete(f"/api/v1/images/{second.data['id']}/")
+        self.assertFalse(get_storage().exists(key))
+        for entry in first.data['variants'].values():
+            self.assertFalse(get_storage().exists(get_storage().key_from_url(entry['webp'])))
+
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_processing_reference_keeps_object(self, mock_classify):
+        """同内容的记录仍在后台处理中时不删除存储对象；来源已删除时去重复用返回 None"""
+        first = self.client.post('/api/v1/images/upload/', {'image': make_upload('a.jpg')}, format='multipart')
+        source = Image.objects.get(id=first.data['id'])
+        Image.objects.create(image_url='', user=self.user, status=Image.STATUS_PROCESSING,
+                             content_hash=source.content_hash)
+        key = get_storage().key_from_url(source.image_url)
+
+        self.client.delete(f"/api/v1/images/{source.id}/")
+        self.assertTrue(get_storage().exists(key))
+        self.assertIsNone(ingest.create_from_duplicate(source, user=self.user, title='', is_public=False))
+
+
+@mock.patch('images.storage.QiniuStorageBackend.put', side_effect=lambda key, data: f"http://cdn.example.com/{key}")
+@mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+class ExifTestCase(TestCase):
+    """EXIF 解析与过滤测试用例"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shooter', email='s@example.com', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_exif_columns_populated_at_upload(self, mock_classify, mock_upload):
+        """上传时解析出拍摄时间、相机、镜头、曝光参数和 GPS"""
+        response = self.client.post('/api/v1/images/upload/', {
+            'image': make_upload(exif=make_exif()),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        image = Image.objects.get(id=response.data['id'])
+        self.assertTrue(image.exif_extracted)
+        self.assertEqual((image.camera_make, image.camera_model), ('Canon', 'EOS R5'))
+        self.assertEqual(image.lens_model, 'RF24-70mm F2.8')
+        self.assertEqual((image.iso, image.focal_length, image.f_number, image.orientation), (200, 35.0, 2.8, 6))
+        self.assertAlmostEqual(image.exposure_time, 0.004)
+        self.assertEqual(timezone.localtime(image.taken_at).strftime('%Y-%m-%d %H:%M'), '2024-05-01 08:30')
+        self.assertAlmostEqual(image.gps_latitude, 30.54)
+        self.assertAlmostEqual(image.gps_longitude, 114.36)
+
+    def test_list_filters_and_orders_by_exif(self, mock_classify, mock_upload):
+        """按相机过滤、按拍摄时间排序，GPS 只对上传者本人可见"""
+        for i, (make, taken) in enumerate([('Canon', '2023:01:01 10:00:00'), ('Canon', '2024:06:01 10:00:00'),
+                                           ('Sony', '2022:01:01 10:00:00')]):
+            self.client.post('/api/v1/images/upload/', {
+                'image': make_upload(f'{i}.jpg', color=(i * 50, 80, 80), exif=make_exif(make=make, taken=taken)),
+                'title': f'{i}.jpg',
+            }, format='multipart')
+
+        response = self.client.get('/api/v1/images/?camera_make=Canon&order_by=-taken_at')
+        self.assertEqual([item['title'] for item in response.data['results']], ['1.jpg', '0.jpg'])
+        self.assertIn('gps_latitude', response.data['results'][0]['exif'])
+
+        response = self.client.get('/api/v1/images/?taken_after=2023-06-01&min_lat=30&max_lat=31&min_lng=114&max_lng=115')
+        self.assertEqual([item['title'] for item in response.data['results']], ['1.jpg'])
+        self.assertEqual(self.client.get('/api/v1/images/?taken_after=bad').status_code, status.HTTP_400_BAD_REQUEST)
+
+        Image.objects.update(is_public=True)
+        other = User.objects.create_user(username='viewer', email='v@example.com', password='testpass123')
+        self.client.force_authenticate(user=other)
+        response = self.client.get(f'/api/v1/images/?user={self.user.id}&camera_make=Sony')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertNotIn('gps_latitude', response.data['results'][0]['exif'])
+
+
+class VocabularyTestCase(TestCase):
+    """分类器词表缓存测试用例"""
+
+    def setUp(self):
+        Tag.objects.create(id=1, name='风景')
+
+    def test_vocabulary_rebuilt_only_when_tags_change(self):
+        """版本号不变时复用词表，标签变化提交后重新加载"""
+        with self.captureOnCommitCallbacks(execute=True):
+            vocabulary.bump_version()
+        first = vocabulary.get_vocabulary('ai/classes.txt')
+        with self.assertNumQueries(1):
+            self.assertIs(vocabulary.get_vocabulary('ai/classes.txt'), first)
+        self.assertIn('1: 风景', first.classification_prompt)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(id=2, name='日落')
+        second = vocabulary.get_vocabulary('ai/classes.txt')
+        self.assertIsNot(second, first)
+        self.assertEqual(second.tag_map, {1: '风景', 2: '日落'})
+
+    def test_batch_import_bumps_version_once(self):
+        """批量导入标签时只更新一次版本号"""
+        with mock.patch('images.ai.vocabulary._set_new_version') as set_version:
+            with self.captureOnCommitCallbacks(execute=True):
+                with vocabulary.batch_update():
+                    for i in range(3, 8):
+                        Tag.objects.create(id=i, name=f'标签{i}')
+        self.assertEqual(set_version.call_count, 1)
+
+
+class AIResultCacheTestCase(TestCase):
+    """AI 结果缓存测试用例"""
+
+    def setUp(self):
+        Tag.objects.create(id=1, name='风景')
+        self.decoded = DecodedImage(make_upload().read())
+
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_same_content_classified_once(self, mock_classify):
+        """相同内容的图片第二次分类直接命中缓存，不再调用模型"""
+        first = ingest.classify_decoded(self.decoded)
+        second = ingest.classify_decoded(DecodedImage(self.decoded.data))
+        self.assertEqual(mock_classify.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(AIResultCache.objects.get().hit_count, 1)
+        # 命中/未命中计数保存在数据库中，命令（独立进程）能看到 worker 累计的次数
+        self.assertEqual(result_cache.stats()[result_cache.KIND_CLASSIFY], {"hits": 1, "misses": 1})
+        out = io.StringIO()
+        call_command('ai_result_cache', stdout=out)
+        self.assertIn('classify: 1 条, 命中 1, 未命中 1, 命中率 50.0%', out.getvalue())
+
+        # 词表变化后提示词指纹改变，需要重新分类
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(id=2, name='日落')
+        ingest.classify_decoded(self.decoded)
+        self.assertEqual(mock_classify.call_count, 2)
+
+    @mock.patch('images.ingest.image_classification', return_value={**FAKE_CLASSIFICATION, "error": "API错误"})
+    def test_failed_result_not_cached(self, mock_classify):
+        """调用失败时的兜底结果不缓存"""
+        ingest.classify_decoded(self.decoded)
+        ingest.classify_decoded(self.decoded)
+        self.assertEqual(mock_classify.call_count, 2)
+        self.assertFalse(AIResultCache.objects.exists())
+
+    def test_evict_keeps_most_recently_used(self):
+        """淘汰时保留最近使用的条目"""
+        for i in range(5):
+            result_cache.put(result_cache.KIND_STYLE, f'hash{i}', 'm', {"i": i})
+        result_cache.get(result_cache.KIND_STYLE, 'hash0', 'm')
+        self.assertEqual(result_cache.evict(max_entries=2), 3)
+        self.assertEqual(
+            set(AIResultCache.objects.values_list('content_hash', flat=True)),
+            {'hash0', 'hash4'},
+        )
+
+
+class AIClientTestCase(TestCase):
+    """视觉大模型 HTTP 客户端测试用例"""
+
+    @override_settings(AI_HTTP_POOL_MAXSIZE=3, AI_HTTP_CONNECT_TIMEOUT=2, AI_HTTP_READ_TIMEOUT=20)
+    def test_calls_share_pooled_session(self):
+        """各次调用复用同一个带连接池的 Session，并使用配置的超时"""
+        session = client.build_session()
+        self.assertEqual(session.get_adapter(client.qnaigc_chat_url())._pool_maxsize, 3)
+
+        with mock.patch('images.ai.client._session', None), \
+                mock.patch('requests.Session.post', return_value=mock.Mock(status_code=200)) as mock_post:
+            client.post_chat(client.qnaigc_chat_url(), 'key', {"model": "m"})
+            first = client.get_session()
+            client.post_chat(client.dashscope_chat_url(), 'key', {"model": "m"})
+            self.assertIs(client.get_session(), first)
+
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(mock_post.call_args.kwargs['timeout'], (2, 20))
+        self.assertEqual(mock_post.call_args.kwargs['headers']['Authorization'], 'Bearer key')
+
+
+class ImageAnalyzeTestCase(TestCase):
+    """一次执行全部 AI 分析的测试用例"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='analyst', email='analyst@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.data = make_upload().read()
+        self.image = Image.objects.create(
+            user=self.user, title='a', image_url='http://cdn.example.com/a.jpg',
+            content_hash=hashlib.sha256(self.data).hexdigest(),
+        )
+
+    def slow(self, result):
+        def call(*args, **kwargs):
+            time.sleep(0.3)
+            return result
+        return call
+
+    @override_settings(AI_STYLE_COMBINED=False)
+    def test_analyze_runs_concurrently_and_persists(self):
+        """四项分析并发执行，原图只下载一次，结果写回图片并进入缓存"""
+        style, emotion = mock_server.DEFAULT_RESPONSES['style'], mock_server.DEFAULT_RESPONSES['emotion']
+        with mock.patch('images.analysis.download_original', return_value=self.data) as download, \
+                mock.patch('images.ingest.image_classification', side_effect=self.slow(FAKE_CLASSIFICATION)), \
+                mock.patch('images.analysis.generate_image_description',
+                           side_effect=self.slow({"description": "一张红色的图片", "model_used": "m"})), \
+                mock.patch('images.analysis.analyze_image_style', side_effect=self.slow(style)), \
+                mock.patch('images.analysis.analyze_image_emotion', side_effect=self.slow(None)):
+            started = time.monotonic()
+            response = self.client.post(f'/api/v1/images/{self.image.id}/analyze/', {}, format='json')
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(set(response.data['data']['errors']), {'emotion'})
+        self.assertEqual(download.call_count, 1)
+        self.assertLess(elapsed, 0.3 * 4)
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.ai_description, '一张红色的图片')
+        self.assertEqual(self.image.ai_style_analysis, style)
+        self.assertEqual(self.image.get_tags_as_list(), ['风景', '日落'])
+        self.assertEqual(AIResultCache.objects.count(), 3)
+
+        # 已保存的结果直接返回；失败的情感分析重试
+        with mock.patch('images.analysis.download_original', return_value=self.data), \
+                mock.patch('images.analysis.analyze_image_emotion', return_value=emotion) as separate_emotion:
+            response = self.client.post(f'/api/v1/images/{self.image.id}/analyze/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(separate_emotion.call_count, 1)
+        self.assertEqual(response.data['data']['sources']['description'], 'stored')
+
+    def test_style_and_emotion_share_one_call(self):
+        """风格和情感合并为一次模型调用，结果分别写入两个字段"""
+        style, emotion = mock_server.DEFAULT_RESPONSES['style'], mock_server.DEFAULT_RESPONSES['emotion']
+        with mock.patch('images.analysis.download_original', return_value=self.data), \
+                mock.patch('images.analysis.analyze_image_style_emotion', return_value=(style, emotion)) as combined, \
+                mock.patch('images.analysis.analyze_image_style') as separate_style, \
+                mock.patch('images.analysis.analyze_image_emotion') as separate_emotion:
+            response = self.client.post(
+                f'/api/v1/images/{self.image.id}/analyze/', {'analyses': ['style', 'emotion']}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(combined.call_count, 1)
+        self.assertFalse(separate_style.called or separate_emotion.called)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.ai_style_analysis, style)
+        self.assertEqual(self.image.ai_emotion_analysis, emotion)
+
+    def test_combined_call_falls_back_for_invalid_part(self):
+        """合并结果中不符合字段表的部分回退到单独调用"""
+        content = json.dumps({"style": mock_server.DEFAULT_RESPONSES['style'], "emotion": {"primary_emotion": "平静"}})
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"choices": [{"message": {"content": content}}]}
+        with mock.patch('images.ai.client.post_chat', return_value=response):
+            style, emotion = analyze_image_style_emotion(None, 'key', image_bytes=self.data)
+        self.assertEqual(style['technique_features'], ['浅景深', '自然光'])
+        self.assertIsNone(emotion)
+
+        emotion = mock_server.DEFAULT_RESPONSES['emotion']
+        with mock.patch('images.analysis.download_original', return_value=self.data), \
+                mock.patch('images.analysis.analyze_image_style_emotion', return_value=(style, None)), \
+                mock.patch('images.analysis.analyze_image_emotion', return_value=emotion) as fallback:
+            response = self.client.post(
+                f'/api/v1/images/{self.image.id}/analyze/', {'analyses': ['style', 'emotion']}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(fallback.call_count, 1)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.ai_emotion_analysis, emotion)
+
+    def test_combined_call_failure_does_not_fall_back(self):
+        """合并调用请求失败时两项分析都记为失败，不再单独调用；单独调用的结果同样按字段表校验"""
+        with mock.patch('images.analysis.download_original', return_value=self.data), \
+                mock.patch('images.analysis.analyze_image_style_emotion',
+                           side_effect=resilience.CircuitOpenError('熔断')), \
+                mock.patch('images.analysis.analyze_image_style') as separate_style, \
+                mock.patch('images.analysis.analyze_image_emotion') as separate_emotion:
+            response = self.client.post(
+                f'/api/v1/images/{self.image.id}/analyze/', {'analyses': ['style', 'emotion']}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertFalse(separate_style.called or separate_emotion.called)
+        self.assertEqual(set(response.data['data']['errors']), {'style', 'emotion'})
+
+        with mock.patch('images.analysis.download_original', return_value=self.data), \
+                mock.patch('images.analysis.analyze_image_style_emotion', return_value=(None, None)), \
+                mock.patch('images.analysis.analyze_image_style', return_value={"mood": "宁静"}), \
+                mock.patch('images.analysis.analyze_image_emotion', return_value={"primary_emotion": "平静"}):
+            response = self.client.post(
+                f'/api/v1/images/{self.image.id}/analyze/', {'analyses': ['style', 'emotion']}, format='json'
+            )
+        self.assertEqual(set(response.data['data']['errors']), {'style', 'emotion'})
+        self.image.refresh_from_db()
+        self.assertFalse(self.image.ai_style_analysis or self.image.ai_emotion_analysis)
+
+    def test_classify_requires_owner(self):
+        """非所有者不能重新分类"""
+        other = User.objects.create_user(username='viewer', email='viewer@example.com', password='testpass123')
+        self.image.is_public = True
+        self.image.save()
+        self.client.force_authenticate(user=other)
+        response = self.client.post(f'/api/v1/images/{self.image.id}/analyze/', {'analyses': ['classify']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(AI_SINGLE_FLIGHT_ENABLED=True, AI_SINGLE_FLIGHT_POLL_SECONDS=0.02, AI_SINGLE_FLIGHT_WAIT_SECONDS=5)
+class SingleFlightTestCase(TestCase):
+    """同一图片同一分析的并发请求合并测试用例"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='flight', email='flight@example.com', password='testpass123')
+        self.data = make_upload(color=(10, 200, 90)).read()
+        self.image = Image.objects.create(
+            user=self.user, title='f', image_url='http://cdn.example.com/f.jpg',
+            content_hash=hashlib.sha256(self.data).hexdigest(),
+        )
+
+    def test_follower_waits_for_leader(self):
+        """租约被其他请求持有时不调用模型，等待并复用其结果"""
+        token = single_flight.acquire(self.image.id, 'description')
+        self.assertIsNotNone(token)
+        self.assertIsNone(single_flight.acquire(self.image.id, 'description'))
+        result = {"description": "领先请求的描述", "model_used": "m"}
+        # leader 在 follower 第一次轮询等待时完成
+        finish = lambda seconds: single_flight.release(self.image.id, 'description', token, {"result": result})
+        with mock.patch('images.ai.single_flight.time.sleep', side_effect=finish), \
+                mock.patch('images.analysis.download_original', return_value=self.data) as download, \
+                mock.patch('images.analysis.generate_image_description') as generate:
+            outcome = run_analyses(self.image, ['description'])['description']
+        self.assertEqual(outcome, {"source": "shared", "result": result})
+        self.assertFalse(download.called or generate.called)
+        self.assertEqual(self.image.ai_description, "领先请求的描述")
+
+    def test_stream_follows_running_analysis(self):
+        """流式描述同样遵守租约：其他请求正在生成时不调用模型，等待后以 done 事件返回其结果"""
+        token = single_flight.acquire(self.image.id, 'description')
+        result = {"description": "领先请求的描述", "model_used": "m"}
+        finish = lambda seconds: single_flight.release(self.image.id, 'description', token, {"result": result})
+        with mock.patch('images.ai.single_flight.time.sleep', side_effect=finish), \
+                mock.patch('images.analysis.stream_image_description') as stream:
+            events = list(stream_description(self.image, force=True))
+        stream.assert_not_called()
+        self.assertEqual(events[-1], 'event: done\ndata: {"description": "领先请求的描述", "source": "shared"}\n\n')
+
+    def test_lease_taken_over_once(self):
+        """过期或已释放的租约只能被一个请求接管，释放时不覆盖已被接管的新租约"""
+        with override_settings(AI_SINGLE_FLIGHT_LEASE_SECONDS=0):
+            stale = single_flight.acquire(self.image.id, 'style')
+        takeover = single_flight.acquire(self.image.id, 'style')
+        self.assertIsNotNone(takeover)
+        self.assertIsNone(single_flight.acquire(self.image.id, 'style'))
+
+        single_flight.release(self.image.id, 'style', stale, {"result": "过期的结果"})
+        self.assertIsNone(single_flight.acquire(self.image.id, 'style'))
+        single_flight.release(self.image.id, 'style', takeover, {"result": "新的结果"})
+        self.assertEqual(single_flight.wait(self.image.id, 'style'), ({"result": "新的结果"}, None))
+        self.assertIsNotNone(single_flight.acquire(self.image.id, 'style'))
+
+    @override_settings(AI_SINGLE_FLIGHT_LEASE_SECONDS=1)
+    def test_takeover_after_lease_expires(self):
+        """持有租约的请求未释放（如进程崩溃）时，租约过期后由等待的请求接管，完成后释放租约"""
+        single_flight.acquire(self.image.id, 'description')
+        with mock.patch('images.analysis.download_original', return_value=self.data), \
+                mock.patch('images.analysis.generate_image_description',
+                           return_value={"description": "接管后的描述", "model_used": "m"}) as generate:
+            outcome = run_analyses(self.image, ['description'])['description']
+        self.assertEqual(outcome['source'], 'model')
+        self.assertEqual(generate.call_count, 1)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.ai_description, "接管后的描述")
+        self.assertIsNotNone(single_flight.acquire(self.image.id, 'description'))
+
+
+@override_settings(AI_BREAKER_FAILURE_THRESHOLD=2, AI_BREAKER_RESET_SECONDS=60, AI_RETRY_MAX_ATTEMPTS=3,
+                   AI_RETRY_BASE_DELAY=0, AI_CALL_BUDGET_SECONDS=5, AI_HEDGE_MIN_DELAY=0.05)
+class ResilienceTestCase(TestCase):
+    """模型调用熔断、重试和对冲测试用例"""
+
+    url = 'https://model.example.com/v1/chat/completions'
+
+    def setUp(self):
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+
+    def test_retries_then_opens_breaker(self):
+        """5xx 在预算内重试（丢弃的失败响应被关闭）；连续失败达到阈值后熔断，不再发出请求"""
+        unavailable, ok = mock.Mock(status_code=503), mock.Mock(status_code=200)
+        responses = iter([unavailable, ok])
+        send = mock.Mock(side_effect=lambda timeout: next(responses))
+        self.assertEqual(resilience.call(self.url, send).status_code, 200)
+        self.assertEqual(send.call_count, 2)
+        unavailable.close.assert_called_once()
+        ok.close.assert_not_called()
+
+        failing = mock.Mock(side_effect=requests.ConnectionError('down'))
+        with self.assertRaises(resilience.CircuitOpenError):
+            resilience.call(self.url, failing)
+        self.assertEqual(failing.call_count, 2)
+
+        snapshot = resilience.health_snapshot()['endpoints'][0]
+        self.assertEqual(snapshot['state'], resilience.STATE_OPEN)
+        self.assertEqual(snapshot['retries'], 2)
+        self.assertTrue(resilience.is_open(self.url))
+
+    def test_hedged_request_wins_slow_tail(self):
+        """请求超过近期 p95 仍未返回时发出对冲请求，取先返回的结果，落后的响应完成后被关闭"""
+        health = resilience.get_health(self.url)
+        health.latencies.extend([0.01] * resilience.HEDGE_MIN_SAMPLES)
+        slow, fast = mock.Mock(status_code=200), mock.Mock(status_code=200)
+        calls = []
+
+        def send(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                time.sleep(0.3)
+                return slow
+            return fast
+
+        started = time.monotonic()
+        self.assertIs(resilience.call(self.url, send), fast)
+        self.assertLess(time.monotonic() - started, 0.25)
+        self.assertEqual(health.counters['hedges'], 1)
+        self.assertEqual(health.counters['hedge_wins'], 1)
+        time.sleep(0.4)
+        slow.close.assert_called_once()
+        fast.close.assert_not_called()
+
+    def test_primary_not_queued_behind_busy_hedges(self):
+        """对冲线程池被占满时主请求仍立即发出，主请求返回后排队中的对冲请求被取消、不会再发送"""
+        health = resilience.get_health(self.url)
+        health.latencies.extend([0.01] * resilience.HEDGE_MIN_SAMPLES)
+        busy_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        busy_pool.submit(release.wait)
+        self.addCleanup(busy_pool.shutdown)
+        self.addCleanup(release.set)
+        send = mock.Mock(side_effect=lambda timeout: time.sleep(0.2) or mock.Mock(status_code=200))
+
+        with mock.patch('images.ai.resilience._get_hedge_pool', return_value=busy_pool):
+            self.assertEqual(resilience.call(self.url, send).status_code, 200)
+        release.set()
+        busy_pool.shutdown(wait=True)
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(health.snapshot()['consecutive_failures'], 0)
+
+    @mock.patch('images.storage.QiniuStorageBackend.put', return_value='http://cdn.example.com/images/r.jpg')
+    @mock.patch('images.ingest.image_classification',
+                return_value={"category_id": 0, "category_name": "其他", "tags": [], "error": "请求异常"})
+    def test_failed_classification_marks_for_reclassify(self, mock_classify, mock_upload):
+        """分类失败时不写占位标签、不归档相册，只标记为待重新分类"""
+        user = User.objects.create_user(username='retry', email='retry@example.com', password='testpass123')
+        api = APIClient()
+        api.force_authenticate(user=user)
+        response = api.post('/api/v1/images/upload/', {'image': make_upload(), 'title': 'r'}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get()
+        self.assertTrue(image.needs_reclassify)
+        self.assertIsNone(image.category_id)
+        self.assertEqual(image.get_tags_as_list(), [])
+        self.assertFalse(Album.objects.exists())
+
+
+class TagShortlistTestCase(TestCase):
+    """分类提示词候选预筛选测试用例"""
+
+    def setUp(self):
+        for tag_id, name in enumerate(['猫', '狗', '汽车', '室内', '日落', '美食'], start=1):
+            Tag.objects.create(id=tag_id, name=name)
+        with self.captureOnCommitCallbacks(execute=True):
+            vocabulary.bump_version()
+        self.vocabulary = vocabulary.get_vocabulary('ai/classes.txt')
+        self.learned = {'tabby': {'categories': {'动物': 1.0}, 'tags': {'猫': 0.9, '室内': 0.4}}}
+
+    def test_shortlist_keeps_relevant_candidates(self):
+        """只保留与本地预测相关的类别和标签，"其他"类别和场景标签总是保留"""
+        candidates = shortlist.build_shortlist(
+            [('tabby', 0.6), ('Egyptian cat', 0.3)], self.vocabulary, learned=self.learned
+        )
+        names = {self.vocabulary.tag_map[i] for i in candidates.tag_ids}
+        self.assertIn('猫', names)
+        self.assertIn('室内', names)
+        self.assertNotIn('汽车', names)
+        self.assertEqual(candidates.category_ids, [0, 3])
+        self.assertLess(len(self.vocabulary.prompt_for(candidates)), len(self.vocabulary.prompt_for(None)))
+
+        # 没有任何信号时回退到完整词表
+        self.assertIsNone(shortlist.build_shortlist([('jigsaw puzzle', 0.9)], self.vocabulary, learned={}))
+
+    @override_settings(AI_TAG_SHORTLIST_ENABLED=True)
+    @mock.patch('images.ai.local_model.predict', return_value=[('tabby', 0.6), ('Egyptian cat', 0.3)])
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_classify_passes_shortlist_to_model(self, mock_classify, mock_predict):
+        """开启预筛选时分类调用带上候选，缓存键包含预筛选配置"""
+        ingest.classify_decoded(DecodedImage(make_upload().read()))
+        candidates = mock_classify.call_args.kwargs['shortlist']
+        self.assertIn(3, candidates.category_ids)
+        self.assertIn('shortlist', AIResultCache.objects.get().params)
+
+
+@override_settings(AI_CASCADE_ENABLED=True, AI_CASCADE_CONFIDENCE_THRESHOLD=0.7, AI_TAG_SHORTLIST_MAP_PATH='/nonexistent/map.json')
+class CascadeTestCase(TestCase):
+    """本地优先的分类级联测试用例"""
+
+    def setUp(self):
+        for tag_id, name in enumerate(['猫', '宠物', '汽车', '室内'], start=1):
+            Tag.objects.create(id=tag_id, name=name)
+        with self.captureOnCommitCallbacks(execute=True):
+            vocabulary.bump_version()
+        cascade.reset_stats()
+
+    @mock.patch('images.ai.local_model.predict', return_value=[('Persian cat', 0.9), ('Egyptian cat', 0.05)])
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_confident_local_prediction_skips_remote(self, mock_classify, mock_predict):
+        """本地置信度达到阈值时直接采用本地结果，不调用大模型"""
+        result = ingest.classify_decoded(DecodedImage(make_upload().read()))
+        mock_classify.assert_not_called()
+        self.assertEqual(result['category_id'], 3)
+        self.assertTrue(result['model_used'].startswith('local:'))
+        self.assertIn('猫', {tag['name'] for tag in result['tags']})
+        stats = cascade.stats()
+        self.assertEqual((stats['accepted'], stats['escalated'], stats['remote_calls']), (1, 0, 0))
+        self.assertIn('cascade', AIResultCache.objects.get().params)
+
+    @mock.patch('images.ai.local_model.predict', return_value=[('Persian cat', 0.4), ('sports car', 0.3)])
+    @mock.patch('images.ingest.image_classification', return_value=FAKE_CLASSIFICATION)
+    def test_uncertain_local_prediction_escalates(self, mock_classify, mock_predict):
+        """本地置信度不足时升级到大模型，并记录各层耗时"""
+        result = ingest.classify_decoded(DecodedImage(make_upload().read()))
+        mock_classify.assert_called_once()
+        self.assertEqual(result, FAKE_CLASSIFICATION)
+        stats = cascade.stats()
+        self.assertEqual((stats['accepted'], stats['escalated'], stats['remote_calls']), (0, 1, 1))
+        self.assertEqual(stats['hit_rate'], 0)
+        # 计数只属于当前 worker 进程
+        self.assertEqual(stats['pid'], os.getpid())
+
+    def test_unmapped_top_label_escalates(self):
+        """top-1 标签映射不到具体类别时，不采用由低置信度预测凑出的类别"""
+        vocab = vocabulary.get_vocabulary('ai/classes.txt')
+        self.assertIsNone(cascade.local_result([('tabby', 0.93), ('car mirror', 0.04), ('Egyptian cat', 0.02)], vocab))
+        # 没有标签得分达到 AI_CASCADE_MIN_TAG_SCORE 时也升级
+        with override_settings(AI_CASCADE_MIN_TAG_SCORE=0.6):
+            self.assertIsNone(cascade.local_result([('Persian cat', 0.9)], vocab))
+        self.assertEqual(cascade.local_result([('Persian cat', 0.9)], vocab)['category_id'], 3)
+
+
+def make_color_model():
+    """不加载权重的微型本地模型：按 RGB 三个通道的平均值给 red/green/blue 三个类别打分"""
+    import torch
+    from torchvision import transforms
+
+    model = local_model.LocalModel.__new__(local_model.LocalModel)
+    model.model_name = 'color'
+    model.model = lambda batch: batch.mean(dim=(2, 3)) * 10
+    model.preprocess = transforms.Compose([transforms.Resize((8, 8)), transforms.ToTensor()])
+    model.categories = ['red', 'green', 'blue']
+    model.torch = torch
+    return model
+
+
+class LocalModelTestCase(TestCase):
+    """本地模型批量推理测试用例"""
+
+    def setUp(self):
+        self.model = make_color_model()
+        self.images = [PILImage.new('RGB', (16, 16), color) for color in [(255, 0, 0), (0, 0, 255), (0, 255, 0)]]
+
+    def test_predict_batch_keeps_input_order(self):
+        """一次前向计算的结果与逐张预测一致，并按输入顺序返回"""
+        results = self.model.predict_batch(self.images, top_k=2)
+        self.assertEqual([result[0][0] for result in results], ['red', 'blue', 'green'])
+        self.assertEqual(len(results[0]), 2)
+        self.assertEqual(self.model.predict(self.images[1], top_k=2), results[1])
+
+    @override_settings(AI_LOCAL_MODEL_BATCH_SIZE=4)
+    def test_concurrent_predictions_are_batched(self):
+        """多个线程同时预测时合并为少量批次，每个调用拿到自己图片的结果"""
+        batch_sizes = []
+        predict_batch = self.model.predict_batch
+
+        def slow_predict_batch(images, top_k=5):
+            batch_sizes.append(len(images))
+            time.sleep(0.05)
+            return predict_batch(images, top_k=top_k)
+
+        self.model.predict_batch = slow_predict_batch
+        images = self.images * 3
+        results = [None] * len(images)
+
+        def worker(index):
+            results[index] = local_model.predict(images[index], top_k=1)[0][0]
+
+        with mock.patch('images.ai.local_model.get_local_model', return_value=self.model):
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(images))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, ['red', 'blue', 'green'] * 3)
+        self.assertLess(len(batch_sizes), len(images))
+        self.assertLessEqual(max(batch_sizes), 4)
+
+
+class InferenceBackendTestCase(TestCase):
+    """本地模型推理后端测试用例"""
+
+    def setUp(self):
+        import torch
+
+        self.torch = torch
+        torch.manual_seed(0)
+        self.model = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 4, 3), torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(), torch.nn.Linear(4, 10)
+        ).eval()
+        self.weights = mock.Mock(**{'transforms.return_value': mock.Mock(crop_size=[16])})
+        self.sample = torch.randn(3, 3, 16, 16)
+        self.export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_dir, ignore_errors=True)
+
+    def test_torchscript_export_matches_eager(self):
+        """导出的 TorchScript 支持任意批大小，输出与 eager 模型一致"""
+        with override_settings(AI_LOCAL_MODEL_EXPORT_DIR=self.export_dir):
+            with self.assertRaises(FileNotFoundError):
+                backends.load_exported('tiny', 'V1', 'torchscript')
+            path = backends.export(self.model, self.weights, 'torchscript', backends.artifact_path('tiny', 'V1', 'torchscript'))
+            self.assertTrue(path.startswith(self.export_dir))
+            exported = backends.load_exported('tiny', 'V1', 'torchscript')
+        with self.torch.inference_mode():
+            self.assertTrue(self.torch.allclose(exported(self.sample), self.model(self.sample), atol=1e-5))
+
+    def test_quantized_model_stays_close(self):
+        """动态量化只替换全连接层，输出与 eager 模型接近"""
+        quantized = backends.quantize(self.model)
+        with self.torch.inference_mode():
+            diff = (quantized(self.sample) - self.model(self.sample)).abs().max().item()
+        self.assertLess(diff, 0.1)
+        self.assertNotIsInstance(quantized[3], self.torch.nn.Linear)
+
+    def test_quantized_export_kept_separately(self):
+        """量化后导出的 TorchScript 不覆盖 float 版本，缓存指纹也不同"""
+        with override_settings(AI_LOCAL_MODEL_EXPORT_DIR=self.export_dir):
+            backends.export(self.model, self.weights, 'torchscript', backends.artifact_path('tiny', 'V1', 'torchscript'))
+            path = backends.artifact_path('tiny', 'V1', 'quantized_torchscript')
+            self.assertTrue(path.endswith('tiny-V1-int8.pt'))
+            backends.export(backends.quantize(self.model), self.weights, 'quantized_torchscript', path)
+            exported = backends.load_exported('tiny', 'V1', 'torchscript')
+        with self.torch.inference_mode():
+            self.assertTrue(self.torch.allclose(exported(self.sample), self.model(self.sample), atol=1e-5))
+        with override_settings(AI_LOCAL_MODEL_BACKEND='torchscript'):
+            float_fingerprint = local_model.fingerprint()
+        with override_settings(AI_LOCAL_MODEL_BACKEND='quantized_torchscript'):
+            self.assertNotEqual(local_model.fingerprint(), float_fingerprint)
+
+
+@override_settings(AI_LOCAL_MODEL='resnet50', AI_LOCAL_MODEL_BACKEND='eager', AI_LOCAL_MODEL_MEMORY_BUDGET_MB=2)
+class ModelRegistryTestCase(TestCase):
+    """本地模型注册表测试用例"""
+
+    def setUp(self):
+        import torch
+
+        self.registry = local_model.ModelRegistry()
+        self.loaded = []
+
+        def fake_model(model_name, weights, backend):
+            self.loaded.append((model_name, weights, backend))
+            # 约 0.8 MB 的参数，预算内最多容纳两个模型
+            return mock.Mock(model=torch.nn.Linear(200, 1024))
+
+        for target, value in [('LocalModel', fake_model), ('resident_bytes', lambda: 0)]:
+            patcher = mock.patch(f'images.ai.local_model.{target}', side_effect=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_shared_instances_per_key(self):
+        """同一 (模型名, 权重, 后端) 只加载一次，不同权重分别加载"""
+        first = self.registry.get()
+        self.assertIs(self.registry.get('resnet50'), first)
+        self.registry.get('resnet50', 'IMAGENET1K_V1')
+        self.assertEqual(self.loaded, [('resnet50', 'DEFAULT', 'eager'), ('resnet50', 'IMAGENET1K_V1', 'eager')])
+        models = self.registry.snapshot()['models']
+        self.assertEqual([(m['weights'], m['hits']) for m in models], [('IMAGENET1K_V1', 1), ('DEFAULT', 2)])
+        self.assertGreater(models[0]['size_mb'], 0.7)
+
+    def test_evicts_least_recently_used(self):
+        """超出内存预算时淘汰最久未使用的模型，刚用过的模型保留"""
+        self.registry.get('resnet50')
+        self.registry.get('mobilenet_v3_large')
+        self.registry.get('resnet50')
+        self.registry.get('efficientnet_b0')
+        snapshot = self.registry.snapshot()
+        self.assertEqual([m['model'] for m in snapshot['models']], ['efficientnet_b0', 'resnet50'])
+        self.assertEqual(snapshot['evictions'], 1)
+
+        # 被淘汰的模型再次使用时重新加载
+        self.registry.get('mobilenet_v3_large')
+        self.assertEqual(self.loaded.count(('mobilenet_v3_large', 'DEFAULT', 'eager')), 2)
+
+    @override_settings(AI_LOCAL_MODEL_WARMUP=' mobilenet_v3_large, efficientnet_b0:IMAGENET1K_V1 ,')
+    def test_preload_warmup_list(self):
+        """预加载默认模型和预热列表中的模型"""
+        with mock.patch('images.ai.local_model.registry', self.registry), \
+                override_settings(AI_LOCAL_MODEL_MEMORY_BUDGET_MB=0):
+            local_model.preload()
+        self.assertEqual([key[:2] for key in self.loaded], [
+            ('resnet50', 'DEFAULT'), ('mobilenet_v3_large', 'DEFAULT'), ('efficientnet_b0', 'IMAGENET1K_V1')
+        ])
+
+
+class MockVisionServerTestCase(TestCase):
+    """模拟视觉大模型服务测试用例"""
+
+    def setUp(self):
+        self.server = mock_server.MockVisionServer(port=0, seed=1)
+        self.server.start()
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(resilience.reset)
+        Tag.objects.create(id=1, name='猫')
+        Tag.objects.create(id=2, name='日落')
+        with self.captureOnCommitCallbacks(execute=True):
+            vocabulary.bump_version()
+
+    def test_latency_spec(self):
+        """延迟分布配置解析，非法配置报错"""
+        latency = mock_server.LatencyModel.parse('uniform:0.1,0.2')
+        self.assertTrue(all(0.1 <= latency.sample() <= 0.2 for _ in range(20)))
+        self.assertEqual(mock_server.LatencyModel.parse('fixed:0.3').sample(), 0.3)
+        for spec in ['gamma:1,2', 'uniform:1', 'fixed:x']:
+            with self.assertRaises(ValueError):
+                mock_server.LatencyModel.parse(spec)
+
+    def test_pipeline_runs_against_configured_base_url(self):
+        """配置的接口地址指向模拟服务时，分类和分析调用拿到合法结果"""
+        with override_settings(AI_DASHSCOPE_BASE_URL=self.server.base_url, AI_QNAIGC_BASE_URL=self.server.base_url):
+            result = ingest.classify_jpeg(make_upload().read(), vocabulary.get_vocabulary('ai/classes.txt'))
+            style = analyze_image_style(None, 'key', image_bytes=make_upload().read())
+        self.assertNotIn('error', result)
+        self.assertTrue({tag['id'] for tag in result['tags']} <= {1, 2})
+        self.assertEqual(style['art_style'], '写实主义')
+        self.assertEqual(self.server.counts, {'classify': 1, 'style': 1})
+
+    def test_streamed_description(self):
+        """描述以 SSE 流式返回，完成后写入图片；再次请求直接返回已保存的描述"""
+        user = User.objects.create_user(username='streamer', email='streamer@example.com', password='testpass123')
+        data = make_upload().read()
+        image = Image.objects.create(user=user, title='s', image_url='http://cdn.example.com/s.jpg',
+                                     content_hash=hashlib.sha256(data).hexdigest())
+        api = APIClient()
+        api.force_authenticate(user=user)
+        expected = mock_server.DEFAULT_RESPONSES['description']
+        with override_settings(AI_QNAIGC_BASE_URL=self.server.base_url), \
+                mock.patch('images.analysis.download_original', return_value=data):
+            response = api.post(f'/api/v1/images/{image.id}/ai_description/?stream=true')
+            self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+            events = [
+                (event.split('\n')[0][len('event: '):], json.loads(event.split('\n')[1][len('data: '):]))
+                for event in b''.join(response.streaming_content).decode('utf-8').strip().split('\n\n')
+            ]
+        self.assertEqual(events[0][0], 'start')
+        deltas = [data['text'] for name, data in events if name == 'delta']
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual(''.join(deltas), expected)
+        self.assertEqual(events[-1], ('done', {"description": expected, "source": "model"}))
+        image.refresh_from_db()
+        self.assertEqual(image.ai_description, expected)
+
+        response = api.post(f'/api/v1/images/{image.id}/ai_description/?stream=true')
+        self.assertIn('"source": "stored"', b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(self.server.counts, {'description': 1})
+
+    def test_injected_errors(self):
+        """按比例注入错误状态码"""
+        self.server.error_rate = 1.0
+        resp = requests.post(f"{self.server.base_url}/chat/completions", json={"messages": []}, timeout=5)
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.server.counts['errors'], 1)
+
+
+class AIMeteringTestCase(TestCase):
+    """模型调用计量、按天汇总和用量仪表板测试用例"""
+
+    def setUp(self):
+        self.server = mock_server.MockVisionServer(port=0, seed=1)
+        self.server.start()
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(resilience.reset)
+        metering.flush()
+        AICallRecord.objects.all().delete()
+
+    def test_calls_are_recorded_and_rolled_up(self):
+        """每次调用记录模型、图片、token 和结果，汇总出延迟分位数和费用"""
+        with override_settings(AI_QNAIGC_BASE_URL=self.server.base_url):
+            with metering.image_scope(42):
+                analyze_image_style(None, 'key', image_bytes=make_upload().read())
+            self.server.error_rate = 1.0
+            with override_settings(AI_RETRY_MAX_ATTEMPTS=1):
+                self.assertIsNone(analyze_image_emotion(None, 'key', image_bytes=make_upload().read()))
+        self.assertEqual(metering.flush(), 2)
+
+        ok, failed = AICallRecord.objects.order_by('id')
+        self.assertEqual((ok.kind, ok.model_name, ok.image_id, ok.outcome), ('style', STYLE_MODEL, 42, 'ok'))
+        self.assertGreater(ok.prompt_tokens, 0)
+        self.assertGreater(ok.completion_tokens, 0)
+        self.assertEqual((failed.kind, failed.image_id, failed.outcome, failed.status_code),
+                         ('emotion', None, 'http_error', 503))
+
+        prices = {STYLE_MODEL: {"prompt": 1000, "completion": 2000}}
+        with override_settings(AI_MODEL_PRICES=prices):
+            call_command('rollup_ai_usage', days=1, stdout=io.StringIO())
+        daily = AIUsageDaily.objects.get(model_name=STYLE_MODEL)
+        self.assertEqual((daily.calls, daily.failures), (2, 1))
+        self.assertEqual(daily.latency_p95_ms, max(ok.latency_ms, failed.latency_ms))
+        self.assertAlmostEqual(daily.cost, (ok.prompt_tokens * 1000 + ok.completion_tokens * 2000) / 1_000_000, places=4)
+
+        staff = User.objects.create_user(username='ops', email='ops@example.com', password='testpass123', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/admin-dashboard/ai-usage/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, STYLE_MODEL)
+
+    def test_prune_rolls_up_before_deleting(self):
+        """清理旧记录前先汇总这些天，从未汇总过的日期不会丢失统计"""
+        old = timezone.now() - timedelta(days=10)
+        AICallRecord.objects.create(created_at=old, kind='style', model_name='m', endpoint='e', outcome='ok',
+                                    prompt_tokens=10, completion_tokens=5, latency_ms=100)
+        call_command('rollup_ai_usage', days=1, prune_days=7, stdout=io.StringIO())
+        self.assertFalse(AICallRecord.objects.exists())
+        daily = AIUsageDaily.objects.get(date=timezone.localdate(old), model_name='m')
+        self.assertEqual((daily.calls, daily.prompt_tokens, daily.completion_tokens), (1, 10, 5))
+
+    def test_calls_attached_after_image_is_created(self):
+        """建档前收集的调用记录在建档后关联图片，无论记录是否已写入数据库"""
+        with override_settings(AI_QNAIGC_BASE_URL=self.server.base_url):
+            with metering.collect([]) as flushed_calls:
+                analyze_image_style(None, 'key', image_bytes=make_upload().read())
+            metering.flush()
+            with metering.collect([]) as buffered_calls:
+                analyze_image_emotion(None, 'key', image_bytes=make_upload().read())
+        metering.attach_image(flushed_calls, 7)
+        metering.attach_image(buffered_calls, 8)
+        metering.flush_at_exit()
+        self.assertEqual(dict(AICallRecord.objects.values_list('kind', 'image_id')), {'style': 7, 'emotion': 8})
+
+
+class PayloadPreparationTestCase(TestCase):
+    """发给视觉模型的图片预处理测试用例"""
+
+    def test_jpeg_is_draft_decoded_and_oriented(self):
+        """大 JPEG 缩小解码到最长边，并按 EXIF 方向摆正"""
+        exif = PILImage.Exif()
+        exif[Base.Orientation] = 6
+        data = make_upload(size=(3000, 2000), exif=exif).read()
+
+        with mock.patch.object(JpegImageFile, 'draft', autospec=True, side_effect=JpegImageFile.draft) as draft:
+            payload = prepare_payload(data, max_size=1024)
+        draft.assert_called_once()
+        self.assertEqual(PILImage.open(io.BytesIO(payload)).size, (683, 1024))
+
+        # 已解码全尺寸图片时从它缩小，结果与直接缩小解码一致
+        decoded = DecodedImage(data)
+        decoded.image
+        self.assertEqual(decoded.resized(1024).size, (683, 1024))
+        self.assertEqual(DecodedImage(data).resized(1024).size, (683, 1024))
+
+    def test_small_and_non_jpeg_images(self):
+        """不放大小图；PNG 等格式转为 RGB JPEG"""
+        buf = io.BytesIO()
+        PILImage.new('RGBA', (1600, 400), (10, 200, 30, 128)).save(buf, format='PNG')
+        img = PILImage.open(io.BytesIO(prepare_payload(buf.getvalue(), max_size=800)))
+        self.assertEqual((img.format, img.mode, img.size), ('JPEG', 'RGB', (800, 200)))
+        small = PILImage.open(io.BytesIO(prepare_payload(make_upload(size=(64, 48)).read())))
+        self.assertEqual(small.size, (64, 48))
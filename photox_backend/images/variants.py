@@ -0,0 +1,123 @@
+# images/variants.py
+"""
+缩略图等派生图片
+
+入库时按 IMAGE_VARIANT_SIZES 中的每个尺寸（最长边）生成 WebP 和渐进式 JPEG 两种格式，
+上传到存储后端后写入 Image.variants，列表、信息流等接口可按需选择合适的尺寸而不必下载原图。
+
+variants 结构：
+    {"256": {"width": 256, "height": 171, "webp": "<url>", "jpeg": "<url>"}, ...}
+"""
+import io
+import logging
+
+from django.conf import settings
+from PIL import Image as PILImage
+from PIL import ImageOps, features
+
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# 格式 -> (文件扩展名, PIL 保存参数)
+VARIANT_FORMATS = {
+    'webp': ('.webp', {'format': 'WEBP', 'method': 4}),
+    'jpeg': ('.jpg', {'format': 'JPEG', 'progressive': True, 'optimize': True}),
+}
+
+
+def variant_sizes():
+    """配置的派生尺寸，从大到小排列（小图由上一级缩放得到，减少重采样的计算量）"""
+    return sorted({int(size) for size in str(settings.IMAGE_VARIANT_SIZES).split(',') if size.strip()}, reverse=True)
+
+
+def variant_key(content_hash, size, fmt):
+    """派生图片的存储 key，按内容寻址，内容相同的原图共享同一组派生图片"""
+    return f"images/variants/{content_hash}_{size}{VARIANT_FORMATS[fmt][0]}"
+
+
+def available_formats():
+    if features.check('webp'):
+        return list(VARIANT_FORMATS)
+    return ['jpeg']
+
+
+def render_variants(image):
+    """
+    在内存中生成各尺寸、各格式的派生图片字节。
+    原图已经小于某个尺寸时不放大，只保留一份原尺寸的派生图。
+    返回 [(size, width, height, {fmt: bytes}), ...]
+    """
+    rendered = []
+    source = image
+    original_kept = False
+    for size in variant_sizes():
+        width, height = source.size
+        if max(image.size) <= size:
+            if original_kept:
+                continue
+            original_kept = True
+            resized = image
+        else:
+            ratio = size / max(width, height)
+            resized = source.resize(
+                (max(1, round(width * ratio)), max(1, round(height * ratio))),
+                PILImage.Resampling.LANCZOS,
+                reducing_gap=3.0,
+            )
+            source = resized
+
+        encoded = {}
+        for fmt in available_formats():
+            buf = io.BytesIO()
+            resized.save(buf, quality=settings.IMAGE_VARIANT_QUALITY, **VARIANT_FORMATS[fmt][1])
+            encoded[fmt] = buf.getvalue()
+        rendered.append((size, resized.size[0], resized.size[1], encoded))
+    return rendered
+
+
+def generate_variants(decoded):
+    """生成并上传派生图片，返回 variants 字典；任一文件上传失败时抛出异常"""
+    storage = get_storage()
+    variants = {}
+    # 派生图片不带 EXIF，先按方向摆正，否则手机竖拍的照片缩略图会横着显示
+    for size, width, height, encoded in render_variants(ImageOps.exif_transpose(decoded.image)):
+        entry = {"width": width, "height": height}
+        for fmt, data in encoded.items():
+            url = storage.put(key=variant_key(decoded.content_hash, size, fmt), data=data)
+            if not url:
+                raise Exception(f"派生图片上传失败: {size} {fmt}")
+            entry[fmt] = url
+        variants[str(size)] = entry
+    return variants
+
+
+def generate_variants_safely(decoded):
+    """派生图片是可选优化，失败时记录日志并返回空字典，客户端回退到原图"""
+    try:
+        return generate_variants(decoded)
+    except Exception as e:
+        logger.error(f"生成派生图片失败: {str(e)}")
+        return {}
+
+
+def variant_keys(variants):
+    """从 variants 字典中取出所有存储 key（用于删除）"""
+    storage = get_storage()
+    keys = []
+    for entry in (variants or {}).values():
+        for fmt in VARIANT_FORMATS:
+            key = storage.key_from_url(entry.get(fmt, '')) if entry.get(fmt) else None
+            if key:
+                keys.append(key)
+    return keys
+
+
+def smallest_variant_url(variants, fmt='jpeg'):
+    """最小尺寸派生图片的 URL（用于本地模型等只需要小图的场景），没有时返回 None"""
+    sizes = sorted((int(size) for size in (variants or {}) if str(size).isdigit()))
+    for size in sizes:
+        url = variants[str(size)].get(fmt)
+        if url:
+            return url
+    return None
@@ -2,15 +2,20 @@
 from django.conf import settings  # 导入 settings
 from django.core.files.storage import FileSystemStorage
 from django.shortcuts import render
-from django.http import HttpResponse
-from rest_framework.exceptions import PermissionDenied
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.generics import ListAPIView
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser
+import datetime
+import io
 import time
 import json
 import logging
@@ -23,19 +28,34 @@ import tempfile
 from PIL import Image as PILImage
 import requests
 import random
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection, transaction
 
 
 from .pro import enhance_image, super_resolution, denoise_image, color_enhance_image
 from .solve import adjust_brightness, adjust_contrast, adjust_saturation, adjust_hue, adjust_sharpness, adjust_blur
 from ai_image import ai_image
-from .delete import delete_image_from_cloud
-from .models import Image
-from .serializers import ImageUploadSerializer, ImageSerializer
+from .delete import delete_image_from_cloud, delete_image
+from .models import Image, UploadSession
+from .serializers import (
+    ImageUploadSerializer, ImageSerializer, UploadSessionCreateSerializer, UploadSessionSerializer
+)
 from .ai.save import upload_and_set_metadata  # 七牛云上传工具
 from .tasks import ai_image_analysis
 from .ai.ai_classify import image_classification
 from .ai.color import extract_colors_with_colorthief
 from .ai.description import generate_image_description
+from .analysis import ANALYSES, run_analyses, stream_description
+from .ai import cascade, local_model, metering, resilience
+from .ai.decode import DecodedImage
+from .phash import find_similar, near_duplicates_for_user
+from .variants import generate_variants_safely
+from .ingest import (
+    spool_upload, build_storage_key, initial_stages, submit_ingest,
+    process_upload_io, user_slot, assign_auto_album, classify_decoded, upload_decoded, classification_fields,
+    find_duplicate, create_from_duplicate, enqueue_spooled, exif_fields,
+    chunked_spool_path, append_chunk, hash_file, hash_upload
+)
 logger = logging.getLogger(__name__)
 
 def welcome_view(request):
@@ -76,38 +96,43 @@ class ImageUploadView(APIView):
             # 获取上传的图片文件
             image_file = request.FILES['image']
             logger.info(f"接收到上传的图片: {image_file.name}, 大小: {image_file.size} 字节")
+
+            # 异步入库模式：只保存原始字节并建档，立即返回 202，后续处理交给后台线程池
+            mode = request.query_params.get('mode') or request.data.get('mode') or settings.IMAGE_UPLOAD_DEFAULT_MODE
+            if mode == 'async':
+                return self.accept_async(request, serializer, image_file)
             
             # 正式处理逻辑
             try:
-                # 使用 FileSystemStorage 保存文件，生成临时路径
-                fs = FileSystemStorage(location='/tmp')  # 存储到临时目录
-                tmp_file_path = fs.save(image_file.name, image_file)  # 保存到临时目录
-                tmp_file_path = fs.path(tmp_file_path)  # 获取文件的绝对路径
-                logger.info(f"图片已保存到临时路径: {tmp_file_path}")
-
-                # 使用原始图片名称或生成唯一文件名
-                safe_filename = os.path.basename(image_file.name).replace(' ', '_')
-                file_name = f"images/{str(time.time()).replace('.', '')}_{safe_filename}"
+                # 读取并解码一次，颜色提取、AI 分类和上传都复用内存中的数据，不再经过 /tmp 临时文件
+                decoded = DecodedImage.from_upload(image_file)
+                logger.info(f"图片已读入内存: {decoded.size_bytes} 字节, SHA-256: {decoded.content_hash}")
+
+                # 内容完全相同的图片已处理过时，直接复用存储对象和 AI 结果
+                duplicate = find_duplicate(decoded.content_hash)
+                image = create_from_duplicate(
+                    duplicate,
+                    user=request.user,
+                    title=serializer.validated_data.get('title', ''),
+                    is_public=serializer.validated_data.get('is_public', False),
+                ) if duplicate else None
+                if image:
+                    return Response(ImageSerializer(image).data, status=status.HTTP_201_CREATED)
+
+                # 按内容哈希生成存储路径
+                file_name = build_storage_key(image_file.name, decoded.content_hash)
                 logger.info(f"在七牛云中的存储路径: {file_name}")
 
                 # 从环境变量获取七牛云的配置
                 access_key = settings.QINIU_ACCESS_KEY
                 secret_key = settings.QINIU_SECRET_KEY
                 bucket_name = settings.QINIU_BUCKET_NAME
-                # api_key = "sk-ff8f03a8cfbc03d7df75b7ddb6b1fb7f0bfc8116e02986306865aa9149741301"
-                api_key = "sk-3658ae5ea3284ff4865227db05f4a214"
-                colors = extract_colors_with_colorthief(tmp_file_path, num_colors=2)
-
-                # 更新AI分类调用，使用新的参数格式
-                result = image_classification(
-                    image_path=tmp_file_path,
-                    api_key=api_key,
-                    # model_id=3,
-                    classes_file="ai/classes.txt",
-                    # model_file="ai/model.txt"
-                )
-                category_id = result['category_id']
-                tags = [tag['name'] for tag in result['tags']]
+                colors = decoded.palette(num_colors=2)
+
+                # 更新AI分类调用，使用内存中已缩放好的图片；调用记录在图片建档后关联图片 ID
+                ai_calls = []
+                with metering.collect(ai_calls):
+                    result = classify_decoded(decoded)
                 logger.info(f"七牛云配置信息 - Access Key: {access_key[:5]}..., Bucket: {bucket_name}")
 
                 if not all([access_key, secret_key, bucket_name]):
@@ -117,47 +142,20 @@ class ImageUploadView(APIView):
                         "message": "七牛云配置不完整，请配置环境变量"
                     }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-                # 尝试AI分析，如果失败则使用默认值
-                try:
-                    logger.info("开始AI分析图片...")
-                    # tags, category = ai_image(tmp_file_path)
-                    # logger.info(f"AI分析结果 - 标签: {tags}, 分类: {category}")
-                except Exception as e:
-                    logger.error(f"AI分析图片失败: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    tags = ["未分类"]
-                    category = "其他"
-                    logger.info("使用默认标签和分类")
-
-                 
-
                 # 上传图片到七牛云并获取外链 URL
                 try:
                     logger.info("开始上传图片到七牛云...")
-                    image_url = upload_and_set_metadata(
-                        access_key=access_key,
-                        secret_key=secret_key,
-                        bucket_name=bucket_name,
-                        file_path=tmp_file_path,  # 传递临时文件的绝对路径
-                        key=file_name,  # 七牛云中的路径+文件名
-                    )
+                    image_url = upload_decoded(decoded, file_name)
                     logger.info(f"上传结果 - URL: {image_url}")
+                    variants = generate_variants_safely(decoded) if image_url else {}
                 except Exception as e:
                     logger.error(f"上传到七牛云时发生异常: {str(e)}")
                     logger.error(traceback.format_exc())
-                    # 删除临时文件
-                    if os.path.exists(tmp_file_path):
-                        fs.delete(tmp_file_path)
                     return Response({
                         "code": 1,
                         "message": f"上传到七牛云失败: {str(e)}"
                     }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-                # 删除临时文件
-                logger.info("删除临时文件...")
-                if os.path.exists(tmp_file_path):
-                    fs.delete(tmp_file_path)
-
                 if not image_url:
                     logger.error("图片URL为空")
                     return Response({
@@ -168,38 +166,28 @@ class ImageUploadView(APIView):
                 # 保存图片信息到数据库
                 try:
                     logger.info("将图片信息保存到数据库...")
-                    # 将标签列表转换为JSON字符串
-                    tags_json = json.dumps(tags, ensure_ascii=False)
-                    
                     image = Image.objects.create(
                         image_url=image_url,
                         title=serializer.validated_data.get('title', ''),
-                        tags=tags_json,  # 存储为JSON字符串
                         user=request.user,  # 上传者为当前认证的用户
                         is_public=serializer.validated_data.get('is_public', False),
-                        category_id=category_id,  # 使用 category_id
-                        colors=colors  # 添加颜色数据
+                        colors=colors,  # 添加颜色数据
+                        content_hash=decoded.content_hash,
+                        perceptual_hash=decoded.perceptual_hash,
+                        variants=variants,
+                        # 标签存储为JSON字符串；分类失败时标记为待重新分类
+                        **classification_fields(result),
+                        **exif_fields(decoded)
                     )
                     logger.info(f"数据库保存成功，图片ID: {image.id}")
+                    metering.attach_image(ai_calls, image.id)
 
-                    # 自动创建对应类别的相册并添加图片
+                    # 自动创建对应类别的相册并添加图片（分类失败时等重新分类后再归档）
                     try:
-                        # 获取类别名称
+                        if image.needs_reclassify:
+                            raise Exception("AI分类失败，图片已标记为待重新分类")
                         category_name = result['category_name']
-
-                        # 查找或创建对应类别的相册
-                        from albums.models import Album
-                        album, created = Album.objects.get_or_create(
-                            title=f"{category_name}相册",
-                            user=request.user,
-                            defaults={
-                                'description': f'自动创建的{category_name}分类相册',
-                                'is_public': False
-                            }
-                        )
-
-                        # 将图片添加到相册
-                        album.images.add(image)
+                        assign_auto_album(image, category_name)
                         logger.info(f"图片已添加到{category_name}相册")
 
                     except Exception as e:
@@ -209,6 +197,8 @@ class ImageUploadView(APIView):
 
                     # 构造成功响应
                     response_data = ImageSerializer(image).data  # 直接返回图片的序列化数据
+                    if settings.IMAGE_NEAR_DUPLICATE_WARNING:
+                        response_data['near_duplicates'] = near_duplicates_for_user(image)
                     logger.info("上传流程完成，返回成功响应")
                     return Response(response_data, status=status.HTTP_201_CREATED)
                 except Exception as e:
@@ -234,6 +224,247 @@ class ImageUploadView(APIView):
                 "message": f"服务器错误: {str(e)}"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def accept_async(self, request, serializer, image_file):
+        """保存原始文件并创建处理中的图片记录，返回 202 Accepted"""
+        spool_path, content_hash = spool_upload(image_file)
+        logger.info(f"图片已写入暂存目录: {spool_path}")
+
+        # 内容完全相同的图片已处理过时无需进入后台队列，直接复用结果
+        image, accepted = enqueue_spooled(
+            request.user,
+            spool_path,
+            content_hash,
+            image_file.name,
+            title=serializer.validated_data.get('title', ''),
+            is_public=serializer.validated_data.get('is_public', False),
+        )
+        return ingest_response(image, accepted)
+
+
+def ingest_response(image, accepted):
+    """入库提交后的统一响应：复用已有结果返回 201，进入后台处理返回 202 和状态查询地址"""
+    if not accepted:
+        return Response(ImageSerializer(image).data, status=status.HTTP_201_CREATED)
+    return Response({
+        "code": 0,
+        "message": "图片已接收，正在后台处理",
+        "data": ImageSerializer(image).data,
+        "status_url": reverse('images:image-status', kwargs={'image_id': image.id}),
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+class UploadSessionCreateView(APIView):
+    """创建分片续传会话，之后按偏移量 PUT 各个分片，最后调用 finalize"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = UploadSessionCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({"code": 1, "message": "参数错误", "errors": serializer.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        session = UploadSession(
+            user=request.user,
+            filename=os.path.basename(data['filename']),
+            total_size=data['total_size'],
+            title=data.get('title', ''),
+            is_public=data.get('is_public', False),
+        )
+        session.spool_path = chunked_spool_path(session.id, session.filename)
+        open(session.spool_path, 'wb').close()
+        session.save()
+        logger.info(f"创建分片上传会话 {session.id}: {session.filename}, {session.total_size} 字节")
+
+        return Response({
+            "code": 0,
+            "message": "上传会话已创建",
+            "data": UploadSessionSerializer(session).data,
+            "max_chunk_size": settings.IMAGE_UPLOAD_CHUNK_MAX_SIZE,
+        }, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(APIView):
+    """
+    GET 查询已接收的偏移量（断点续传时从该位置继续）；
+    PUT 上传一个分片，请求体为原始字节，偏移量通过 ?offset= 或 Upload-Offset 请求头给出；
+    DELETE 放弃上传。
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_session(self, request, upload_id):
+        try:
+            return UploadSession.objects.get(id=upload_id, user=request.user)
+        except UploadSession.DoesNotExist:
+            return None
+
+    def session_response(self, session, status_code=status.HTTP_200_OK, message="success"):
+        response = Response({
+            "code": 0 if status_code < 400 else 1,
+            "message": message,
+            "data": UploadSessionSerializer(session).data,
+        }, status=status_code)
+        response['Upload-Offset'] = str(session.received_size)
+        return response
+
+    def get(self, request, upload_id):
+        session = self.get_session(request, upload_id)
+        if session is None:
+            return Response({"code": 1, "message": "上传会话不存在"}, status=status.HTTP_404_NOT_FOUND)
+        return self.session_response(session)
+
+    def put(self, request, upload_id):
+        offset = request.query_params.get('offset', request.headers.get('Upload-Offset'))
+        try:
+            offset = int(offset)
+        except (TypeError, ValueError):
+            return Response({"code": 1, "message": "缺少或无效的 offset"}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if content_length > settings.IMAGE_UPLOAD_CHUNK_MAX_SIZE:
+            return Response({
+                "code": 1,
+                "message": f"分片超出允许的大小 {settings.IMAGE_UPLOAD_CHUNK_MAX_SIZE} 字节"
+            }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        with transaction.atomic():
+            # 锁住会话行，同一会话的并发分片请求串行写入
+            session = UploadSession.objects.select_for_update().filter(id=upload_id, user=request.user).first()
+            if session is None:
+                return Response({"code": 1, "message": "上传会话不存在"}, status=status.HTTP_404_NOT_FOUND)
+            if session.status != UploadSession.STATUS_UPLOADING:
+                return self.session_response(session, status.HTTP_409_CONFLICT, "上传会话已完成")
+            if offset != session.received_size:
+                # 偏移量不一致（重复发送或跳过了分片），客户端应按返回的 Upload-Offset 继续
+                return self.session_response(session, status.HTTP_409_CONFLICT, "偏移量与已接收的数据不一致")
+
+            limit = min(settings.IMAGE_UPLOAD_CHUNK_MAX_SIZE, session.total_size - session.received_size)
+            try:
+                # 直接从请求流按块写入暂存文件，不在内存中缓存整个分片
+                written = append_chunk(session.spool_path, offset, request.stream or io.BytesIO(), limit)
+            except ValueError as e:
+                return Response({"code": 1, "message": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+            session.received_size = offset + written
+            session.save(update_fields=['received_size', 'updated_at'])
+
+        return self.session_response(session)
+
+    def delete(self, request, upload_id):
+        session = self.get_session(request, upload_id)
+        if session is None:
+            return Response({"code": 1, "message": "上传会话不存在"}, status=status.HTTP_404_NOT_FOUND)
+        if session.status == UploadSession.STATUS_UPLOADING and os.path.exists(session.spool_path):
+            os.remove(session.spool_path)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionFinalizeView(APIView):
+    """所有分片接收完毕后提交入库，复用异步上传的后台处理流程（颜色、分类、七牛云上传、相册）"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().filter(id=upload_id, user=request.user).first()
+            if session is None:
+                return Response({"code": 1, "message": "上传会话不存在"}, status=status.HTTP_404_NOT_FOUND)
+
+            # 重复调用 finalize 时返回首次提交的结果
+            if session.status == UploadSession.STATUS_COMPLETED:
+                if session.image is None:
+                    return Response({"code": 1, "message": "图片已被删除"}, status=status.HTTP_410_GONE)
+                return ingest_response(session.image, session.image.status == Image.STATUS_PROCESSING)
+
+            if session.received_size != session.total_size:
+                return Response({
+                    "code": 1,
+                    "message": f"文件尚未上传完整: {session.received_size}/{session.total_size}"
+                }, status=status.HTTP_409_CONFLICT)
+
+            content_hash = hash_file(session.spool_path)
+            expected = request.data.get('sha256')
+            if expected and expected.lower() != content_hash:
+                return Response({"code": 1, "message": "文件校验失败，SHA-256 不一致"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            image, accepted = enqueue_spooled(
+                request.user,
+                session.spool_path,
+                content_hash,
+                session.filename,
+                title=session.title,
+                is_public=session.is_public,
+            )
+            session.status = UploadSession.STATUS_COMPLETED
+            session.image = image
+            session.save(update_fields=['status', 'image', 'updated_at'])
+
+        logger.info(f"分片上传会话 {session.id} 已完成，生成图片 {image.id}")
+        return ingest_response(image, accepted)
+
+
+class ImageStatusView(APIView):
+    """查询图片入库处理进度"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, image_id):
+        try:
+            image = Image.objects.get(id=image_id)
+        except Image.DoesNotExist:
+            return Response({"code": 1, "message": "Image not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if image.user != request.user:
+            raise PermissionDenied("You do not have permission to view this image.")
+
+        data = {
+            "id": image.id,
+            "status": image.status,
+            "stages": image.processing_stages,
+            "error": image.processing_error,
+        }
+        if image.status == Image.STATUS_READY:
+            data["image"] = ImageSerializer(image, context={'request': request}).data
+
+        return Response({"code": 0, "message": "ok", "data": data}, status=status.HTTP_200_OK)
+
+class SimilarImagesView(APIView):
+    """相似/近似重复图片查询（基于感知哈希 BK 树索引）"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, image_id):
+        try:
+            image = Image.objects.get(id=image_id)
+        except Image.DoesNotExist:
+            return Response({"code": 1, "message": "Image not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if image.user != request.user and not image.is_public:
+            raise PermissionDenied("You do not have permission to view this image.")
+
+        try:
+            max_distance = int(request.query_params.get('max_distance', settings.PHASH_MAX_DISTANCE))
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({"code": 1, "message": "参数格式错误"}, status=status.HTTP_400_BAD_REQUEST)
+        max_distance = max(0, min(max_distance, 16))
+
+        matches = find_similar(image.perceptual_hash, max_distance, exclude_id=image.id)
+        distances = {match_id: distance for distance, match_id in matches}
+
+        # 只返回当前用户可见的图片：自己的或公开的（已删除的图片自然不会出现在查询结果中）
+        visible = Image.objects.filter(id__in=distances.keys(), status=Image.STATUS_READY).filter(
+            models.Q(user=request.user) | models.Q(is_public=True)
+        ).select_related('user')
+        visible = sorted(visible, key=lambda img: (distances[img.id], img.id))[:limit]
+
+        data = []
+        for img in visible:
+            item = ImageSerializer(img, context={'request': request}).data
+            item['distance'] = distances[img.id]
+            data.append(item)
+
+        return Response({"code": 0, "message": "ok", "data": data}, status=status.HTTP_200_OK)
+
 class BatchImageUploadView(APIView):
     """批量图片上传视图"""
     permission_classes = [IsAuthenticated]
@@ -273,14 +504,13 @@ class BatchImageUploadView(APIView):
             is_public = request.data.get('is_public', 'false').lower() == 'true'
             
             # 批量处理结果
-            results = []
+            results_by_index = {}  # 按文件序号记录成功结果，最终按上传顺序返回
             errors = []
             
             # 从环境变量获取七牛云的配置
             access_key = settings.QINIU_ACCESS_KEY
             secret_key = settings.QINIU_SECRET_KEY
             bucket_name = settings.QINIU_BUCKET_NAME
-            api_key = "sk-3658ae5ea3284ff4865227db05f4a214"
             
             if not all([access_key, secret_key, bucket_name]):
                 logger.error("七牛云配置不完整")
@@ -289,92 +519,96 @@ class BatchImageUploadView(APIView):
                     "message": "七牛云配置不完整，请配置环境变量"
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
-            # 批量处理每个文件
+            # 请求线程内只分块计算内容哈希并查重（不保留文件内容），读取、解码放到工作线程中逐个进行，
+            # 同一时间内存中最多只有并发数个文件的解码结果，不会整批常驻
+            jobs = []
             for index, image_file in enumerate(image_files):
                 try:
-                    logger.info(f"处理第 {index + 1} 个文件: {image_file.name}")
-                    
-                    # 使用 FileSystemStorage 保存文件，生成临时路径
-                    fs = FileSystemStorage(location='/tmp')
-                    tmp_file_path = fs.save(image_file.name, image_file)
-                    tmp_file_path = fs.path(tmp_file_path)
-                    logger.info(f"图片已保存到临时路径: {tmp_file_path}")
-
-                    # 使用原始图片名称或生成唯一文件名
-                    safe_filename = os.path.basename(image_file.name).replace(' ', '_')
-                    file_name = f"images/{str(time.time()).replace('.', '')}_{safe_filename}"
-                    
-                    # AI分析
-                    colors = extract_colors_with_colorthief(tmp_file_path, num_colors=2)
-                    result = image_classification(
-                        image_path=tmp_file_path,
-                        api_key=api_key,
-                        classes_file="ai/classes.txt",
-                    )
-                    category_id = result['category_id']
-                    tags = [tag['name'] for tag in result['tags']]
-                    
-                    # 上传到七牛云
-                    image_url = upload_and_set_metadata(
-                        access_key=access_key,
-                        secret_key=secret_key,
-                        bucket_name=bucket_name,
-                        file_path=tmp_file_path,
-                        key=file_name,
-                    )
-                    
-                    # 删除临时文件
-                    if os.path.exists(tmp_file_path):
-                        fs.delete(tmp_file_path)
-                    
-                    if not image_url:
-                        raise Exception("上传到七牛云失败，未获取到图片URL")
-                    
-                    # 保存到数据库
-                    tags_json = json.dumps(tags, ensure_ascii=False)
-                    file_title = title or image_file.name
-                    
-                    image = Image.objects.create(
-                        image_url=image_url,
-                        title=file_title,
-                        tags=tags_json,
+                    content_hash = hash_upload(image_file)
+                    # 内容完全相同的图片已处理过时直接复用，不再提交到线程池
+                    duplicate = find_duplicate(content_hash)
+                    image = create_from_duplicate(
+                        duplicate,
                         user=request.user,
+                        title=title or image_file.name,
                         is_public=is_public,
-                        category_id=category_id,
-                        colors=colors
-                    )
-                    
-                    # 自动添加到相册
-                    try:
-                        category_name = result['category_name']
-                        from albums.models import Album
-                        album, created = Album.objects.get_or_create(
-                            title=f"{category_name}相册",
-                            user=request.user,
-                            defaults={
-                                'description': f'自动创建的{category_name}分类相册',
-                                'is_public': False
-                            }
-                        )
-                        album.images.add(image)
-                    except Exception as e:
-                        logger.error(f"自动添加到相册失败: {str(e)}")
-                    
-                    # 添加到成功结果
-                    results.append(ImageSerializer(image).data)
-                    logger.info(f"第 {index + 1} 个文件处理成功")
-                    
+                    ) if duplicate else None
+                    if image:
+                        results_by_index[index] = ImageSerializer(image).data
+                        continue
+                    jobs.append((index, image_file, content_hash))
                 except Exception as e:
-                    logger.error(f"处理第 {index + 1} 个文件失败: {str(e)}")
+                    logger.error(f"读取第 {index + 1} 个文件失败: {str(e)}")
                     errors.append({
                         "file": image_file.name,
                         "error": str(e)
                     })
-                    # 清理临时文件
-                    if 'tmp_file_path' in locals() and os.path.exists(tmp_file_path):
-                        fs.delete(tmp_file_path)
+
+            def run_job(image_file, content_hash):
+                # 读取解码、颜色提取、AI 分类、七牛云上传都放到线程池并发执行；
+                # 只返回落库需要的字段，DecodedImage（含全尺寸解码结果）在任务结束时即被释放
+                with user_slot(request.user.id):
+                    try:
+                        decoded = DecodedImage.from_upload(image_file)
+                        # 模型调用记录在请求线程建档后再关联图片 ID
+                        with metering.collect([]) as ai_calls:
+                            output = process_upload_io(decoded, build_storage_key(image_file.name, content_hash))
+                        output['exif'] = exif_fields(decoded)
+                        output['ai_calls'] = ai_calls
+                        return output
+                    finally:
+                        connection.close()
+
+            max_workers = max(1, min(settings.IMAGE_BATCH_UPLOAD_CONCURRENCY, len(jobs)))
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-upload') as executor:
+                futures = [executor.submit(run_job, image_file, content_hash)
+                           for _, image_file, content_hash in jobs]
+
+                # 按提交顺序收集结果并在请求线程内落库，保持与原来一致的结果顺序
+                for (index, image_file, content_hash), future in zip(jobs, futures):
+                    try:
+                        output = future.result()
+                        result = output['classification']
+
+                        # 保存到数据库
+                        file_title = title or image_file.name
+                        
+                        image = Image.objects.create(
+                            image_url=output['image_url'],
+                            title=file_title,
+                            user=request.user,
+                            is_public=is_public,
+                            colors=output['colors'],
+                            content_hash=content_hash,
+                            perceptual_hash=output['perceptual_hash'],
+                            variants=output['variants'],
+                            **classification_fields(result),
+                            **output['exif']
+                        )
+                        metering.attach_image(output['ai_calls'], image.id)
+                        
+                        # 自动添加到相册（分类失败时等重新分类后再归档）
+                        if not image.needs_reclassify:
+                            try:
+                                assign_auto_album(image, result['category_name'])
+                            except Exception as e:
+                                logger.error(f"自动添加到相册失败: {str(e)}")
+                        
+                        # 添加到成功结果
+                        results_by_index[index] = ImageSerializer(image).data
+                        if settings.IMAGE_NEAR_DUPLICATE_WARNING:
+                            results_by_index[index]['near_duplicates'] = near_duplicates_for_user(image)
+                        logger.info(f"第 {index + 1} 个文件处理成功")
+                        
+                    except Exception as e:
+                        logger.error(f"处理第 {index + 1} 个文件失败: {str(e)}")
+                        errors.append({
+                            "file": image_file.name,
+                            "error": str(e)
+                        })
             
             # 返回批量处理结果
+            results = [results_by_index[i] for i in sorted(results_by_index)]
             response_data = {
                 "code": 0,
                 "message": f"批量上传完成，成功 {len(results)} 个，失败 {len(errors)} 个",
@@ -445,6 +679,11 @@ class ImageListView(ListAPIView):
                 is_public = str(is_public).lower() == 'true'
                 queryset = queryset.filter(is_public=is_public)
 
+        # 他人仍在后台处理中的图片还没有可用的URL，只对上传者本人可见
+        queryset = queryset.filter(
+            models.Q(status=Image.STATUS_READY) | models.Q(user_id=getattr(self.request.user, 'id', None))
+        )
+
         category_id = self.request.query_params.get('category_id')
         if category_id:
             queryset = queryset.filter(category_id=category_id)
@@ -453,6 +692,9 @@ class ImageListView(ListAPIView):
         if exclude_id:
             queryset = queryset.exclude(id=exclude_id)
 
+        # ====== 按 EXIF 拍摄信息过滤和排序（均走索引列） ======
+        queryset = self.filter_by_exif(queryset)
+
         # ====== 热门推荐逻辑：用Subquery统计点赞数并降序排序 ======
         order_by = self.request.query_params.get('order_by')
         if order_by == 'like_count':
@@ -483,6 +725,53 @@ class ImageListView(ListAPIView):
         return queryset
 
 
+    def filter_by_exif(self, queryset):
+        """
+        taken_after/taken_before：拍摄时间范围（ISO 日期或日期时间）
+        camera_make/camera_model/lens_model：相机和镜头
+        min_lat/max_lat/min_lng/max_lng：拍摄地点范围，只匹配当前用户自己的图片
+        order_by=taken_at/-taken_at：按拍摄时间排序，没有拍摄时间的排在最后
+        """
+        params = self.request.query_params
+
+        for param, lookup in (('taken_after', 'taken_at__gte'), ('taken_before', 'taken_at__lte')):
+            if params.get(param):
+                value = parse_datetime(params[param])
+                if value is None:
+                    date_value = parse_date(params[param])
+                    if date_value is None:
+                        raise ValidationError({param: "日期格式无效"})
+                    value = datetime.datetime.combine(
+                        date_value, datetime.time.max if param == 'taken_before' else datetime.time.min
+                    )
+                if timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+                queryset = queryset.filter(**{lookup: value})
+
+        for field in ('camera_make', 'camera_model', 'lens_model'):
+            if params.get(field):
+                queryset = queryset.filter(**{field: params[field]})
+
+        bounds = [params.get(name) for name in ('min_lat', 'max_lat', 'min_lng', 'max_lng')]
+        if any(bounds):
+            try:
+                min_lat, max_lat, min_lng, max_lng = [float(value) for value in bounds]
+            except (TypeError, ValueError):
+                raise ValidationError({"location": "min_lat/max_lat/min_lng/max_lng 需同时提供且为数字"})
+            # 拍摄地点属于隐私，只在自己的图片中检索
+            queryset = queryset.filter(
+                user_id=getattr(self.request.user, 'id', None),
+                gps_latitude__range=(min_lat, max_lat),
+                gps_longitude__range=(min_lng, max_lng),
+            )
+
+        order_by = params.get('order_by')
+        if order_by == 'taken_at':
+            queryset = queryset.order_by(models.F('taken_at').asc(nulls_last=True), 'created_at')
+        elif order_by == '-taken_at':
+            queryset = queryset.order_by(models.F('taken_at').desc(nulls_last=True), '-created_at')
+        return queryset
+
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
     
@@ -539,11 +828,8 @@ class ImageDetailView(APIView):
         if image.user != request.user:
             raise PermissionDenied("You do not have permission to delete this image.")
 
-        # # 删除图片文件（目前只实现了数据库的删除，七牛云上未删除）
-        # delete_image_from_cloud(image.image_url)
-
-        # 删除图片记录
-        image.delete()
+        # 删除图片记录；没有其他记录引用同一存储对象时，一并删除存储中的文件和派生图片
+        delete_image(image)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -569,7 +855,7 @@ class ImageFeedView(ListAPIView):
         
         # 获取关注用户的公开图片 + 自己的所有图片
         queryset = Image.objects.filter(
-            models.Q(user__in=following_users, is_public=True) |  # 关注用户的公开图片
+            models.Q(user__in=following_users, is_public=True, status=Image.STATUS_READY) |  # 关注用户的公开图片
             models.Q(user=user)  # 自己的所有图片
         ).select_related('user').prefetch_related('user__followers', 'user__following')
         
@@ -585,8 +871,21 @@ class ImageFeedView(ListAPIView):
         context['request'] = self.request
         return context
 
+def wants_stream(request):
+    """请求参数 stream=true 时以 Server-Sent Events 流式返回"""
+    return request.query_params.get('stream', '').lower() in ('1', 'true')
+
+
+def description_stream_response(image, force=False):
+    """流式描述的响应；关闭代理缓冲，使每个事件立即到达客户端"""
+    response = StreamingHttpResponse(stream_description(image, force=force), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 class ImageAIAnalysisView(APIView):
-    """AI智能分析视图 - 获取图片的AI分析描述"""
+    """AI智能分析视图 - 获取图片的AI分析描述（?stream=true 时流式返回并保存描述）"""
     permission_classes = [IsAuthenticated]
 
     def get(self, request, image_id):
@@ -595,6 +894,10 @@ class ImageAIAnalysisView(APIView):
         except Image.DoesNotExist:
             return Response({"code": 1, "message": "Image not found"}, status=status.HTTP_404_NOT_FOUND)
 
+        if wants_stream(request):
+            # 与原接口一致，每次都重新生成
+            return description_stream_response(image, force=True)
+
         try:
             # 导入AI分析功能
             import sys
@@ -635,26 +938,14 @@ def ai_description_view(request, image_id):
         image = Image.objects.get(id=image_id)
     except Image.DoesNotExist:
         return Response({"error": "图片不存在"}, status=404)
+    if wants_stream(request):
+        return description_stream_response(image)
     # 如果已分析过，直接返回
     if image.ai_description:
         return Response({"description": image.ai_description})
-    api_key = "sk-ff8f03a8cfbc03d7df75b7ddb6b1fb7f0bfc8116e02986306865aa9149741301"
-    import os
-    import tempfile
-    import requests
-    # 下载图片到本地临时文件，分析后删除
-    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-        resp = requests.get(image.image_url)
-        tmp.write(resp.content)
-        tmp.flush()
-        tmp_path = tmp.name
-    try:
-        result = generate_image_description(tmp_path, api_key, 3)
-        result = result['description']
-        image.ai_description = result
-        image.save()
-    finally:
-        os.remove(tmp_path)
+    # 相同内容的图片已生成过描述时直接复用，不再下载原图和调用模型
+    outcome = run_analyses(image, ['description'])['description']
+    result = (outcome['result'] or {}).get('description', outcome.get('error', '描述生成失败'))
     return Response({"description": result})
 
 class ImageTagsView(APIView):
@@ -747,38 +1038,79 @@ class ImageStyleAnalysisView(APIView):
                 "emotion_analysis": image.ai_emotion_analysis
             })
         
-        # 执行AI分析
-        import tempfile
-        import requests
-        from .ai.style_analysis import analyze_image_style, analyze_image_emotion
-        
-        api_key = "sk-3658ae5ea3284ff4865227db05f4a214"
-        
-        # 下载图片到临时文件
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-            resp = requests.get(image.image_url)
-            tmp.write(resp.content)
-            tmp.flush()
-            tmp_path = tmp.name
+        # 风格和情感分析并发执行，原图只下载一次；相同内容的图片已分析过时直接复用结果
+        outcomes = run_analyses(image, ['style', 'emotion'])
+        style_result = outcomes['style']['result']
+        emotion_result = outcomes['emotion']['result']
         
+        return Response({
+            "style_analysis": style_result or {},
+            "emotion_analysis": emotion_result or {}
+        })
+
+
+class ImageAnalyzeView(APIView):
+    """
+    一次执行全部 AI 分析（分类、描述、风格、情感）
+    原图只下载一次，各模型调用并发执行，每项结果完成后立即保存
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, image_id):
         try:
-            # 执行风格分析
-            style_result = analyze_image_style(tmp_path, api_key)
-            emotion_result = analyze_image_emotion(tmp_path, api_key)
-            
-            # 保存结果
-            if style_result:
-                image.ai_style_analysis = style_result
-            if emotion_result:
-                image.ai_emotion_analysis = emotion_result
-            image.save()
-            
-            return Response({
-                "style_analysis": style_result or {},
-                "emotion_analysis": emotion_result or {}
-            })
-        finally:
-            os.remove(tmp_path)
+            image = Image.objects.get(id=image_id)
+        except Image.DoesNotExist:
+            return Response({"code": 1, "message": "图片不存在"}, status=status.HTTP_404_NOT_FOUND)
+
+        is_owner = image.user_id == request.user.id
+        if not is_owner and not image.is_public:
+            return Response({"code": 1, "message": "图片不存在"}, status=status.HTTP_404_NOT_FOUND)
+        if image.status != Image.STATUS_READY:
+            return Response({"code": 1, "message": "图片尚未处理完成"}, status=status.HTTP_409_CONFLICT)
+
+        # 分类结果会改写图片的标签和种类，只有所有者可以执行
+        default = list(ANALYSES) if is_owner else [name for name in ANALYSES if name != 'classify']
+        names = request.data.get('analyses') or default
+        if not isinstance(names, list) or any(name not in ANALYSES for name in names):
+            return Response({"code": 1, "message": f"analyses 只能包含: {', '.join(ANALYSES)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if 'classify' in names and not is_owner:
+            return Response({"code": 1, "message": "无权限重新分类此图片"}, status=status.HTTP_403_FORBIDDEN)
+        force = str(request.data.get('force', '')).lower() in ('1', 'true')
+
+        started = time.monotonic()
+        outcomes = run_analyses(image, list(dict.fromkeys(names)), force=force)
+        errors = {name: outcome['error'] for name, outcome in outcomes.items() if outcome.get('error')}
+        return Response({
+            "code": 0 if not errors else 1,
+            "message": "分析完成" if not errors else "部分分析失败",
+            "data": {
+                "image_id": image.id,
+                "results": {name: outcome['result'] for name, outcome in outcomes.items()},
+                "sources": {name: outcome['source'] for name, outcome in outcomes.items()},
+                "errors": errors,
+                "elapsed_ms": round((time.monotonic() - started) * 1000),
+            }
+        }, status=status.HTTP_200_OK if not errors else status.HTTP_207_MULTI_STATUS)
+
+
+class AIHealthView(APIView):
+    """视觉大模型各端点的熔断状态、延迟和重试/对冲统计，以及本地模型注册表（当前 worker 进程），供运维监控"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        snapshot = resilience.health_snapshot()
+        degraded = any(endpoint['state'] != resilience.STATE_CLOSED for endpoint in snapshot['endpoints'])
+        return Response({
+            "code": 0,
+            "message": "部分模型端点已熔断" if degraded else "正常",
+            "data": {
+                **snapshot,
+                "degraded": degraded,
+                "needs_reclassify": Image.objects.filter(needs_reclassify=True).count(),
+                "cascade": cascade.stats(),
+                "local_models": local_model.registry.snapshot(),
+            }
+        })
 
 
 class ImageRecommendationView(APIView):
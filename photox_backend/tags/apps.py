@@ -3,4 +3,8 @@ from django.apps import AppConfig
 class TagsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tags'
-    verbose_name = '标签管理'
\ No newline at end of file
+    verbose_name = '标签管理'
+
+    def ready(self):
+        # 注册信号：标签变化时更新分类器词表版本
+        from . import signals  # noqa: F401
\ No newline at end of file
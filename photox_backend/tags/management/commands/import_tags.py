@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from images.ai.vocabulary import batch_update
 from tags.models import Tag
 import os
 
@@ -26,7 +27,9 @@ class Command(BaseCommand):
             return
 
         if file_path.endswith('.txt'):
-            self.import_from_txt(file_path)
+            # 整批导入只更新一次词表版本
+            with batch_update():
+                self.import_from_txt(file_path)
         else:
             self.stdout.write(self.style.ERROR("只支持.txt格式文件"))
 
@@ -0,0 +1,24 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tags', '0002_remove_tag_created_at_remove_tag_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VocabularyVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0, verbose_name='版本号')),
+            ],
+            options={
+                'verbose_name': '词表版本',
+                'verbose_name_plural': '词表版本',
+            },
+        ),
+    ]
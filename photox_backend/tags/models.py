@@ -10,4 +10,15 @@ class Tag(models.Model):
         ordering = ['id']
 
     def __str__(self):
-        return f"{self.id}:{self.name}"
\ No newline at end of file
+        return f"{self.id}:{self.name}"
+
+class VocabularyVersion(models.Model):
+    """分类词表版本号（只有一行）：标签变化后更新，各 worker 进程比较版本号决定是否重新加载词表"""
+    version = models.BigIntegerField(default=0, verbose_name='版本号')
+
+    class Meta:
+        verbose_name = '词表版本'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return str(self.version)
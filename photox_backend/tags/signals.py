@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from images.ai.vocabulary import bump_version
+from .models import Tag
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_vocabulary_changed(sender, **kwargs):
+    """标签增删改后更新词表版本，各 worker 下次分类时重新加载标签"""
+    bump_version()
@@ -4,6 +4,7 @@ from rest_framework.views import APIView
 from rest_framework.permissions import IsAdminUser
 import logging
 
+from images.ai.vocabulary import batch_update
 from tags.models import Tag
 from tags.serializers import TagSerializer, TagImportSerializer
 
@@ -51,30 +52,32 @@ class TagImportView(APIView):
         created_count = 0
         updated_count = 0
 
-        for line in content:
-            line = line.strip()
-            if not line or ':' not in line:
-                continue
-
-            try:
-                parts = line.split(':', 1)
-                tag_id = int(parts[0].strip())
-                tag_name = parts[1].strip()
-
-                # 创建或更新标签（不再处理时间字段）
-                tag, created = Tag.objects.update_or_create(
-                    id=tag_id,
-                    defaults={'name': tag_name}
-                )
-
-                if created:
-                    created_count += 1
-                else:
-                    updated_count += 1
-
-            except (ValueError, TypeError) as e:
-                logger.error(f"解析标签行错误: {line} - {str(e)}")
-                continue
+        # 整批导入只更新一次词表版本
+        with batch_update():
+            for line in content:
+                line = line.strip()
+                if not line or ':' not in line:
+                    continue
+
+                try:
+                    parts = line.split(':', 1)
+                    tag_id = int(parts[0].strip())
+                    tag_name = parts[1].strip()
+
+                    # 创建或更新标签（不再处理时间字段）
+                    tag, created = Tag.objects.update_or_create(
+                        id=tag_id,
+                        defaults={'name': tag_name}
+                    )
+
+                    if created:
+                        created_count += 1
+                    else:
+                        updated_count += 1
+
+                except (ValueError, TypeError) as e:
+                    logger.error(f"解析标签行错误: {line} - {str(e)}")
+                    continue
 
         return Response({
             "code": 0,
@@ -11,4 +11,5 @@ urlpatterns = [
     path('user-analytics/', admin_views.user_analytics, name='user_analytics'),
     path('content-moderation/', admin_views.content_moderation, name='content_moderation'),
     path('albums/album/', admin_views.album_management, name='album_management'),
+    path('ai-usage/', admin_views.ai_usage_dashboard, name='ai_usage'),
 ] 
\ No newline at end of file
@@ -10,7 +10,8 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.utils import timezone
 from datetime import timedelta
 
-from images.models import Image
+from images.models import Image, AIUsageDaily
+from images.ai import metering
 from albums.models import Album
 from community.models import Comment, Like, Follow, Notification
 
@@ -657,3 +658,47 @@ def stats_dashboard(request):
     
     return render(request, 'admin/stats_dashboard.html', context)
 
+
+@staff_member_required
+def ai_usage_dashboard(request):
+    """AI 调用用量仪表板：各模型每天的调用量、p50/p95 延迟和费用"""
+    try:
+        days = max(1, min(int(request.GET.get('days', 14)), 90))
+    except ValueError:
+        days = 14
+    today = timezone.localdate()
+
+    # 今天的数据按调用记录实时计算，之前的日期读取 rollup_ai_usage 命令生成的汇总
+    today_rows = metering.summarize(today)
+    history = list(AIUsageDaily.objects.filter(date__gte=today - timedelta(days=days - 1), date__lt=today))
+    daily_rows = today_rows + [
+        {
+            'date': row.date, 'model_name': row.model_name, 'calls': row.calls, 'failures': row.failures,
+            'prompt_tokens': row.prompt_tokens, 'completion_tokens': row.completion_tokens,
+            'latency_p50_ms': row.latency_p50_ms, 'latency_p95_ms': row.latency_p95_ms, 'cost': row.cost,
+        }
+        for row in history
+    ]
+
+    # 各模型在统计区间内的合计
+    models = {}
+    for row in daily_rows:
+        total = models.setdefault(row['model_name'], {
+            'model_name': row['model_name'], 'calls': 0, 'failures': 0, 'tokens': 0, 'cost': 0, 'latency_p95_ms': 0,
+        })
+        total['calls'] += row['calls']
+        total['failures'] += row['failures']
+        total['tokens'] += row['prompt_tokens'] + row['completion_tokens']
+        total['cost'] += row['cost']
+        total['latency_p95_ms'] = max(total['latency_p95_ms'], row['latency_p95_ms'])
+
+    context = {
+        'days': days,
+        'current_date': today,
+        'today_rows': today_rows,
+        'today_cost': sum(row['cost'] for row in today_rows),
+        'today_calls': sum(row['calls'] for row in today_rows),
+        'model_totals': sorted(models.values(), key=lambda item: -item['cost']),
+        'daily_rows': daily_rows,
+    }
+    return render(request, 'admin/ai_usage_dashboard.html', context)